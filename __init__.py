@@ -28,63 +28,70 @@ bl_info = {
         "category": "Import-Export"
         }
 
-import bpy
-from .kms.importer.kmsImportOperator import ImportMgsKms
-from .kms.exporter.kmsExportOperator import ExportMgsKms
-from .evm.importer.evmImportOperator import ImportMgsEvm
-from .evm.exporter.evmExportOperator import ExportMgsEvm
-from .tri.importer.triImportOperator import ImportMgsTri
-from .tri.exporter.triExportOperator import ExportMgsTri
-from .ctxr.importer.ctxrImportOperator import ImportMgsCtxr
-from .util.utilOperators import SealouseObjectMenu, SLObjectClasses
-
-#
-# Add additional functions here
-#
-
-class IMPORT_SL_MainMenu(bpy.types.Menu):
-    bl_label = "SeaLouse"
-    bl_idname = "IMPORT_SL_main_menu"
-
-    def draw(self, context):
-        self.layout.operator(ImportMgsKms.bl_idname, text="KMS File for MGS2 (.kms)")
-        self.layout.operator(ImportMgsEvm.bl_idname, text="EVM File for MGS2 (.evm)")
-        self.layout.operator(ImportMgsTri.bl_idname, text="Dump TRI textures for MGS2 (.tri)")
-        self.layout.operator(ImportMgsCtxr.bl_idname, text="Dump CTXR textures for MGS2 (.ctxr)")
-
-class EXPORT_SL_MainMenu(bpy.types.Menu):
-    bl_label = "SeaLouse"
-    bl_idname = "EXPORT_SL_main_menu"
-
-    def draw(self, context):
-        self.layout.operator(ExportMgsKms.bl_idname, text="KMS File for MGS2 (.kms)")
-        self.layout.operator(ExportMgsEvm.bl_idname, text="EVM File for MGS2 (.evm)")
-        self.layout.operator(ExportMgsTri.bl_idname, text="Edit TRI Files for MGS2 (.tri)")
-
-
-classes = {
-    ImportMgsKms,
-    ExportMgsKms,
-    ImportMgsTri,
-    ExportMgsTri,
-    ImportMgsEvm,
-    ExportMgsEvm,
-    ImportMgsCtxr,
-    IMPORT_SL_MainMenu,
-    EXPORT_SL_MainMenu
-}.union(SLObjectClasses)
-
-
-def menu_func_import(self, context):
-    self.layout.menu(IMPORT_SL_MainMenu.bl_idname)
-
-def menu_func_export(self, context):
-    self.layout.menu(EXPORT_SL_MainMenu.bl_idname)
-
-def menu_func_utils(self, context):
-    self.layout.menu(SealouseObjectMenu.bl_idname)
+try:
+    import bpy
+except ImportError: # Loaded outside Blender, e.g. by bulk extraction workers
+    bpy = None
+
+if bpy is not None:
+    from .kms.importer.kmsImportOperator import ImportMgsKms
+    from .kms.exporter.kmsExportOperator import ExportMgsKms
+    from .evm.importer.evmImportOperator import ImportMgsEvm
+    from .evm.exporter.evmExportOperator import ExportMgsEvm
+    from .tri.importer.triImportOperator import ImportMgsTri
+    from .tri.exporter.triExportOperator import ExportMgsTri
+    from .ctxr.importer.ctxrImportOperator import ImportMgsCtxr
+    from .util.utilOperators import SealouseObjectMenu, SLObjectClasses
+
+    #
+    # Add additional functions here
+    #
+
+    class IMPORT_SL_MainMenu(bpy.types.Menu):
+        bl_label = "SeaLouse"
+        bl_idname = "IMPORT_SL_main_menu"
+
+        def draw(self, context):
+            self.layout.operator(ImportMgsKms.bl_idname, text="KMS File for MGS2 (.kms)")
+            self.layout.operator(ImportMgsEvm.bl_idname, text="EVM File for MGS2 (.evm)")
+            self.layout.operator(ImportMgsTri.bl_idname, text="Dump TRI textures for MGS2 (.tri)")
+            self.layout.operator(ImportMgsCtxr.bl_idname, text="Dump CTXR textures for MGS2 (.ctxr)")
+
+    class EXPORT_SL_MainMenu(bpy.types.Menu):
+        bl_label = "SeaLouse"
+        bl_idname = "EXPORT_SL_main_menu"
+
+        def draw(self, context):
+            self.layout.operator(ExportMgsKms.bl_idname, text="KMS File for MGS2 (.kms)")
+            self.layout.operator(ExportMgsEvm.bl_idname, text="EVM File for MGS2 (.evm)")
+            self.layout.operator(ExportMgsTri.bl_idname, text="Edit TRI Files for MGS2 (.tri)")
+
+
+    classes = {
+        ImportMgsKms,
+        ExportMgsKms,
+        ImportMgsTri,
+        ExportMgsTri,
+        ImportMgsEvm,
+        ExportMgsEvm,
+        ImportMgsCtxr,
+        IMPORT_SL_MainMenu,
+        EXPORT_SL_MainMenu
+    }.union(SLObjectClasses)
+
+
+    def menu_func_import(self, context):
+        self.layout.menu(IMPORT_SL_MainMenu.bl_idname)
+
+    def menu_func_export(self, context):
+        self.layout.menu(EXPORT_SL_MainMenu.bl_idname)
+
+    def menu_func_utils(self, context):
+        self.layout.menu(SealouseObjectMenu.bl_idname)
 
 def register():
+    if bpy is None:
+        return
     from . import properties
     from . import ui
     # properties.register()
@@ -98,6 +105,8 @@ def register():
     bpy.types.VIEW3D_MT_object.append(menu_func_utils)
 
 def unregister():
+    if bpy is None:
+        return
     from . import properties
     from . import ui
     # properties.unregister()
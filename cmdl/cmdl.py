@@ -1,8 +1,12 @@
 from __future__ import annotations
-from io import BufferedReader, BufferedWriter
-from math import isnan
+from collections import deque
+from io import BufferedReader, BufferedWriter, BytesIO
 import struct
+import numpy as np
 from ..kms.kms import KMSVector3
+from ..util.util import alignOffset, packArray, readArray
+
+VERTEX_CACHE_SIZE = 32
 
 
 class CMDL:
@@ -31,32 +35,163 @@ class CMDL:
     def writeToFile(self, file: BufferedWriter):
         self.header.numSection = len(self.sections)
         self.tail.numFaces = len(self.tail.faces)
-        curSectionOffset = 0x10 + 0x20 * len(self.sections)
-        file.seek(curSectionOffset)
-        file.write(struct.pack("<3i", -1, -1, -1))
-        for section in self.sections:
-            section.dataSize = section.data.size * len(section.data.data)
+        
+        # Each section's data sits 0xC past its offset, followed by -1 words until the next offset is 0x10 aligned
+        # The first section also gets three -1 words in front of its data
+        packedData = [section.data.pack() for section in self.sections]
+        firstSectionOffset = 0x10 + 0x20 * len(self.sections)
+        curSectionOffset = firstSectionOffset
+        for section, data in zip(self.sections, packedData):
+            section.dataSize = data.nbytes
             section.dataOffset = curSectionOffset
-            curSectionOffset += section.dataSize
-            if curSectionOffset % 0x10 > 0:
-                file.seek(curSectionOffset + 0xC)
-                while ((file.tell() % 0x10) & 0xC) != 0xC:
-                    file.write(struct.pack("<i", -1))
-                curSectionOffset = file.tell() - 0xC
+            curSectionOffset = alignOffset(curSectionOffset + section.dataSize)
         
         self.header.tailOffset = curSectionOffset
         
+        records = BytesIO()
+        self.header.writeToFile(records)
+        for section in self.sections:
+            section.writeToFile(records)
+        tail = BytesIO()
+        self.tail.writeToFile(tail)
+        
+        tailStart = self.header.tailOffset + 0xC
+        buffer = bytearray(tailStart + tail.tell())
+        buffer[:firstSectionOffset] = records.getvalue()
+        buffer[firstSectionOffset:tailStart] = b"\xff" * (tailStart - firstSectionOffset)
+        for section, data in zip(self.sections, packedData):
+            packArray(buffer, section.dataOffset + 0xC, data, data.dtype)
+        buffer[tailStart:] = tail.getvalue()
+        
         file.seek(0)
+        file.write(buffer)
         
-        self.header.writeToFile(file)
+        return
+    
+    def optimizeVertexCache(self) -> tuple:
+        """Reorder the faces of each mesh for the post-transform vertex cache, then renumber its vertices
+        in first-use order, permuting every section to match. Returns the ACMR before and after."""
+        faces = np.array(self.tail.faces, np.int64).reshape(-1, 3)
+        acmrBefore = computeAcmr(faces)
+        numVertices = len(self.sections[0].data.data) if self.sections else 0
         
-        for section in self.sections:
-            section.writeToFile(file)
+        # Meshes are reordered in place, so their face and vertex ranges must not overlap
+        for first, count in (("startFace", "faceCount"), ("startVertex", "vertexCount")):
+            ranges = sorted((getattr(mesh, first), getattr(mesh, first) + getattr(mesh, count)) for mesh in self.tail.meshes)
+            if any(end > start for (_, end), (start, _) in zip(ranges, ranges[1:])):
+                print(f"Mesh {first[5:].lower()} ranges overlap, skipping vertex cache optimization")
+                return acmrBefore, acmrBefore
+        if any(len(section.data.data) != numVertices for section in self.sections):
+            print("Section lengths differ, skipping vertex cache optimization")
+            return acmrBefore, acmrBefore
         
-        file.seek(self.header.tailOffset + 0xC)
-        self.tail.writeToFile(file)
+        vertexOrder = np.arange(numVertices) # old vertex at each new position
+        for mesh in self.tail.meshes:
+            firstFace, numFaces = mesh.startFace // 3, mesh.faceCount // 3
+            firstVertex, endVertex = mesh.startVertex, mesh.startVertex + mesh.vertexCount
+            meshFaces = faces[firstFace:firstFace + numFaces]
+            if numFaces == 0 or meshFaces.min() < firstVertex or meshFaces.max() >= endVertex:
+                continue
+            meshFaces = meshFaces[optimizeFaceOrder(meshFaces)]
             
-        return
+            used, firstUse = np.unique(meshFaces, return_index=True)
+            newOrder = np.concatenate((used[np.argsort(firstUse)],
+                                       np.setdiff1d(np.arange(firstVertex, endVertex), used)))
+            vertexOrder[firstVertex:endVertex] = newOrder
+            newIndex = np.empty(mesh.vertexCount, np.int64)
+            newIndex[newOrder - firstVertex] = np.arange(firstVertex, endVertex)
+            faces[firstFace:firstFace + numFaces] = newIndex[meshFaces - firstVertex]
+        
+        for section in self.sections:
+            section.data.data = np.asarray(section.data.data)[vertexOrder]
+        self.tail.faces = faces
+        
+        return acmrBefore, computeAcmr(faces)
+
+
+def computeAcmr(faces: np.ndarray, cacheSize: int = VERTEX_CACHE_SIZE) -> float:
+    """Average cache miss ratio: vertices transformed per triangle with a FIFO post-transform cache"""
+    if len(faces) == 0:
+        return 0.0
+    cache = deque()
+    cached = set()
+    misses = 0
+    for vertex in np.asarray(faces).reshape(-1).tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        cache.append(vertex)
+        cached.add(vertex)
+        if len(cache) > cacheSize:
+            cached.discard(cache.popleft())
+    return misses / len(faces)
+
+def optimizeFaceOrder(faces: np.ndarray, cacheSize: int = VERTEX_CACHE_SIZE) -> np.ndarray:
+    """Triangle order for (n, 3) faces using Tom Forsyth's linear-speed vertex cache optimization"""
+    numFaces = len(faces)
+    vertices, corners = np.unique(faces, return_inverse=True)
+    corners = corners.reshape(-1, 3).tolist()
+    numVertices = len(vertices)
+    
+    # Triangles using each vertex
+    vertexFaces = [[] for _ in range(numVertices)]
+    for face, corner in enumerate(corners):
+        for vertex in corner:
+            vertexFaces[vertex].append(face)
+    remaining = [len(x) for x in vertexFaces]
+    
+    # Score tables, from the paper's suggested constants
+    cacheScores = [0.75] * 3 + [(1 - i / (cacheSize - 3)) ** 1.5 for i in range(cacheSize - 3)]
+    valenceScores = [0.0] + [2.0 * n ** -0.5 for n in range(1, max(remaining) + 1)]
+    cachePosition = [-1] * numVertices
+    
+    def vertexScore(vertex):
+        if remaining[vertex] == 0:
+            return -1.0
+        position = cachePosition[vertex]
+        return valenceScores[remaining[vertex]] + (cacheScores[position] if 0 <= position < cacheSize else 0.0)
+    
+    vertexScores = [vertexScore(vertex) for vertex in range(numVertices)]
+    faceScores = [sum(vertexScores[vertex] for vertex in corner) for corner in corners]
+    added = [False] * numFaces
+    order = []
+    cache = []
+    nextFace = 0 # fallback when nothing in the cache is usable
+    bestFace = faceScores.index(max(faceScores)) if numFaces else -1
+    
+    while bestFace >= 0:
+        added[bestFace] = True
+        order.append(bestFace)
+        corner = corners[bestFace]
+        for vertex in corner:
+            remaining[vertex] -= 1
+            vertexFaces[vertex].remove(bestFace)
+        
+        # Move the triangle's vertices to the front; anything past the cache falls out
+        cache = corner + [vertex for vertex in cache if vertex not in corner]
+        for position, vertex in enumerate(cache):
+            cachePosition[vertex] = position if position < cacheSize else -1
+        evicted = cache[cacheSize:]
+        cache = cache[:cacheSize]
+        
+        # Rescore what changed and pick the best triangle touching the cache
+        bestFace = -1
+        bestScore = -1.0
+        for vertex in cache + evicted:
+            vertexScores[vertex] = vertexScore(vertex)
+        for vertex in cache:
+            for face in vertexFaces[vertex]:
+                score = vertexScores[corners[face][0]] + vertexScores[corners[face][1]] + vertexScores[corners[face][2]]
+                if score > bestScore:
+                    bestScore = score
+                    bestFace = face
+        
+        if bestFace < 0:
+            while nextFace < numFaces and added[nextFace]:
+                nextFace += 1
+            bestFace = nextFace if nextFace < numFaces else -1
+    
+    return np.array(order, np.int64)
 
 
 class CMDLHeader:
@@ -160,177 +295,112 @@ class CMDLSection:
         file.write(bytes(reversed(self.magic)))
         file.write(struct.pack("<HHIIIIII", self.unknown_04, self.unknown_06, self.dataOffset, 0, \
         self.dataSize, 0, 0, 0))
-        
-        curPos = file.tell()
-        file.seek(self.dataOffset + 0xC)
-        self.data.writeToFile(file)
-        file.seek(curPos)
+        # Section data is placed by CMDL.writeToFile
 
 
 class CMDLSectionData:
-    data: List[any]
+    # Sections are read into, and packed from, arrays of this dtype and per-element shape
+    data: np.ndarray | List[any] # lists are accepted while building a model
     size: int
-    
-    def __init__(self):
-        self.data = []
-    def fromFile(self, file: BufferedReader):
-        assert(False) # Attempt to read an abstract class
-    def writeToFile(self, file: BufferedWriter):
-        assert(False) # Attempt to write an abstract class
-
-class CMDLPosData(CMDLSectionData): # Coordinates
-    size = 0x10
+    dtype: str
+    shape: Tuple[int]
     
     def __init__(self):
         self.data = []
     
     def fromFile(self, file: BufferedReader, fullSize: int):
         vertCount = fullSize // self.size
-        self.data = [struct.unpack("<ffff", file.read(0x10)) for _ in range(vertCount)]
-        assert(all(x[3] == 1.0 for x in self.data)) # Unexpected "w" (v4) value in vertex position
+        self.data = readArray(file, self.dtype, (vertCount,) + self.shape)
         
         return self
     
+    def pack(self) -> np.ndarray:
+        return np.asarray(self.data, self.dtype).reshape((-1,) + self.shape)
+    
     def writeToFile(self, file: BufferedWriter):
-        for vert in self.data:
-            file.write(struct.pack("<ffff", vert[0], vert[1], vert[2], vert[3]))
+        file.write(self.pack().tobytes())
 
-class CMDLNrmData(CMDLSectionData): # Normals
-    size = 4
-    
-    def __init__(self):
-        self.data = []
+class CMDLPosData(CMDLSectionData): # Coordinates
+    size = 0x10
+    dtype = "<f4"
+    shape = (4,)
     
     def fromFile(self, file: BufferedReader, fullSize: int):
-        vertCount = fullSize // self.size
-        for _ in range(vertCount):
-            # I would like to express my profound gratitude to... I forget where I found this.
-            # Either WoefulWolf's Nier2Blender2Nier, Kerilk's bayonetta_tools, or I wrote it myself based on both
-            # 11-bit x, 11-bit y, 10-bit z
-            normal = struct.unpack("<I", file.read(4))[0]
-            
-            normalX = normal & ((1 << 11) - 1)
-            normalY = (normal >> 11) & ((1 << 11) - 1)
-            normalZ = (normal >> 22)
-            # sign bits
-            if normalX & (1 << 10):
-                normalX &= ~(1 << 10)
-                normalX -= 1 << 10
-            if normalY & (1 << 10):
-                normalY &= ~(1 << 10)
-                normalY -= 1 << 10
-            if normalZ & (1 << 9):
-                normalZ &= ~(1 << 9)
-                normalZ -= 1 << 9
-            # normalize
-            normalX /= (1<<10)-1
-            normalY /= (1<<10)-1
-            normalZ /= (1<<9)-1
-            
-            self.data.append((normalX, normalY, normalZ))
+        super().fromFile(file, fullSize)
+        assert(np.all(self.data[:, 3] == 1.0)) # Unexpected "w" (v4) value in vertex position
         
         return self
-    
-    def writeToFile(self, file: BufferedWriter):
-        for vert in self.data:
-            # Normalize normals because sometimes Blender gets extra silly
-            vert = list(vert)
-            if isnan(vert[0]): vert[0] = 0
-            if isnan(vert[1]): vert[1] = 0
-            if isnan(vert[2]): vert[2] = 0
-            vert_total = (vert[0]**2 + vert[1]**2 + vert[2]**2)**0.5
-            if vert_total == 0.0:
-                vert_total = 1.0
-                vert[0] = 1.0
-            vert[0] /= vert_total; vert[1] /= vert_total; vert[2] /= vert_total
-            # I know where this code came from, it was ChatGPT when told to reverse that other code
-            nx = int(round(vert[0] * float((1<<10)-1)))
-            ny = int(round(vert[1] * float((1<<10)-1)))
-            nz = int(round(vert[2] * float((1<<9 )-1)))
-            if nx < 0:
-                nx += (1 << 10)
-                nx |= 1 << 10
-            if ny < 0:
-                ny += (1 << 10)
-                ny |= 1 << 10
-            if nz < 0:
-                nz += (1 << 9)
-                nz |= 1 << 9
-            normal = nx | (ny << 11) | (nz << 22)
-            file.write(struct.pack("<I", normal))
 
-class CMDLTexData(CMDLSectionData): # UV maps
+def unpackNormals(packed: np.ndarray) -> np.ndarray:
+    """Decode packed NRM0 normals (11-bit x, 11-bit y, 10-bit z, signed) to an (n, 3) float32 array"""
+    packed = np.asarray(packed, np.uint32).astype(np.int64)
+    normals = np.empty((len(packed), 3), np.float64)
+    for axis, (shift, bits) in enumerate(((0, 11), (11, 11), (22, 10))):
+        signBit = 1 << (bits - 1)
+        # sign extend, then normalize
+        normals[:, axis] = (((packed >> shift) & ((1 << bits) - 1)) ^ signBit) - signBit
+        normals[:, axis] /= signBit - 1
+    return normals.astype(np.float32)
+
+def packNormals(normals) -> np.ndarray:
+    """Encode (n, 3) normals to NRM0 words. NaN components become 0 and zero-length normals become (1, 0, 0)"""
+    # Normalize normals because sometimes Blender gets extra silly
+    normals = np.array(normals, np.float64).reshape(-1, 3)
+    normals[np.isnan(normals)] = 0
+    total = np.sqrt(normals[:, 0]**2 + normals[:, 1]**2 + normals[:, 2]**2)
+    zeroLength = total == 0.0
+    total[zeroLength] = 1.0
+    normals[zeroLength, 0] = 1.0
+    normals /= total[:, None]
+    # round half to even, like round()
+    quantized = np.rint(normals * [(1<<10)-1, (1<<10)-1, (1<<9)-1]).astype(np.int64)
+    # negative values stored two's complement in their field
+    return ((quantized[:, 0] & ((1 << 11) - 1))
+            | ((quantized[:, 1] & ((1 << 11) - 1)) << 11)
+            | ((quantized[:, 2] & ((1 << 10) - 1)) << 22)).astype("<u4")
+
+class CMDLNrmData(CMDLSectionData): # Normals, unpacked to (n, 3) float32
     size = 4
-    
-    def __init__(self):
-        self.data = []
+    dtype = "<u4"
+    shape = ()
     
     def fromFile(self, file: BufferedReader, fullSize: int):
         vertCount = fullSize // self.size
-        # Everybody loves the half-precision float format (5 bit exponent, 10 bit mantissa)
-        self.data = [struct.unpack("<ee", file.read(4)) for _ in range(vertCount)]
+        # I would like to express my profound gratitude to... I forget where I found this.
+        # Either WoefulWolf's Nier2Blender2Nier, Kerilk's bayonetta_tools, or I wrote it myself based on both
+        # 11-bit x, 11-bit y, 10-bit z
+        self.data = unpackNormals(readArray(file, self.dtype, vertCount))
         
         return self
     
-    def writeToFile(self, file: BufferedWriter):
-        for vert in self.data:
-            file.write(struct.pack("<ee", vert[0], vert[1]))
+    def pack(self) -> np.ndarray:
+        return packNormals(self.data)
+
+class CMDLTexData(CMDLSectionData): # UV maps
+    size = 4
+    # Everybody loves the half-precision float format (5 bit exponent, 10 bit mantissa)
+    dtype = "<f2"
+    shape = (2,)
 
 class CMDLOIdxData(CMDLSectionData): # Point back to KMS indices
     size = 4
-    
-    def __init__(self):
-        self.data = []
-    
-    def fromFile(self, file: BufferedReader, fullSize: int):
-        vertCount = fullSize // self.size
-        self.data = [struct.unpack("<I", file.read(4))[0] for _ in range(vertCount)]
-        
-        return self
-    
-    def writeToFile(self, file: BufferedWriter):
-        for vert in self.data:
-            file.write(struct.pack("<I", vert))
+    dtype = "<u4"
+    shape = ()
 
 class CMDLBonIData(CMDLSectionData): # Bone Indexes (EVM)
     size = 4
-    
-    def __init__(self):
-        self.data = []
-    
-    def fromFile(self, file: BufferedReader, fullSize: int):
-        vertCount = fullSize // self.size
-        self.data = [list(struct.unpack("<4B", file.read(4))) for _ in range(vertCount)]
-        
-        return self
-    
-    def writeToFile(self, file: BufferedWriter):
-        for vert in self.data:
-            for boneIndex in vert:
-                file.write(struct.pack("<B", boneIndex))
+    dtype = "u1"
+    shape = (4,)
 
 class CMDLBonWData(CMDLSectionData): # Bone weights (EVM)
     size = 8
-    
-    def __init__(self):
-        self.data = []
-    
-    def fromFile(self, file: BufferedReader, fullSize: int):
-        vertCount = fullSize // self.size
-        # Everybody loves the half-precision float format (5 bit exponent, 10 bit mantissa)
-        self.data = [list(struct.unpack("<4e", file.read(8))) for _ in range(vertCount)]
-        
-        return self
-    
-    def writeToFile(self, file: BufferedWriter):
-        for vert in self.data:
-            for boneWeight in vert:
-                file.write(struct.pack("<e", boneWeight))
+    dtype = "<f2"
+    shape = (4,)
 
 
 class CMDLTail:
     numFaces: int
-    faces: List[List[int]]
+    faces: np.ndarray | List[List[int]] # (numFaces, 3) big-endian uint32
     numMeshes: int
     meshes: List[CMDLMesh]
     
@@ -344,7 +414,7 @@ class CMDLTail:
         numFaceIndexes = struct.unpack(">I", file.read(4))[0]
         assert(numFaceIndexes % 3 == 0) # Unexpected face index count
         self.numFaces = numFaceIndexes // 3
-        self.faces = [struct.unpack(">III", file.read(0xC)) for _ in range(self.numFaces)]
+        self.faces = readArray(file, ">u4", (self.numFaces, 3))
         pad, self.numMeshes = struct.unpack(">II", file.read(8))
         assert(pad == 0) # Expected zero
         self.meshes = [
@@ -356,8 +426,7 @@ class CMDLTail:
     
     def writeToFile(self, file: BufferedWriter):
         file.write(struct.pack(">I", self.numFaces * 3))
-        for face in self.faces:
-            file.write(struct.pack(">III", face[0], face[1], face[2]))
+        file.write(np.asarray(self.faces, ">u4").reshape(-1, 3).tobytes())
         
         file.write(struct.pack(">II", 0, self.numMeshes))
         for mesh in self.meshes:
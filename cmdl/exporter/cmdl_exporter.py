@@ -1,29 +1,100 @@
 import bpy
 from ..cmdl import *
-from ...util.util import getBoneIndex, getFingerIndex, getVertWeight, getBoneName
+from functools import cache
+from ...util.util import getBoneIndex, getFingerIndex, getBoneName
+import numpy as np
 import os
 from mathutils import Vector
 
-def getLoops(mesh, bigMode: bool):
-    if not bigMode:
-        return sorted(mesh.data.loops, key=lambda loop: loop.vertex_index)
-    return sum([[mesh.data.loops[y] for y in x.loop_indices] for x in mesh.data.polygons], [])
+def foreachGet(collection, attribute: str, dtype, width: int = 1) -> np.ndarray:
+    array = np.empty(len(collection) * width, dtype)
+    collection.foreach_get(attribute, array)
+    return array.reshape(-1, width) if width > 1 else array
 
-def getVertices(mesh, bigMode: bool):
-    if not bigMode:
-        return mesh.data.vertices
-    # Seems Blender fucks up the normals whenever I split a mesh apart
-    # But it fucks up the UVs when I keep it together
-    # Solution: Keep it together, but split the UVs *only in export*
-    # Probably skyrockets RAM usage
-    return [mesh.data.vertices[x.vertex_index] for x in getLoops(mesh, True)]
+def getLoopPolygons(mesh) -> np.ndarray:
+    """Index of the polygon each loop belongs to"""
+    loopStarts = foreachGet(mesh.data.polygons, "loop_start", np.int64)
+    loopTotals = foreachGet(mesh.data.polygons, "loop_total", np.int64)
+    polygonOffsets = np.cumsum(loopTotals) - loopTotals
+    loops = np.repeat(loopStarts - polygonOffsets, loopTotals) + np.arange(loopTotals.sum())
+    loopPolygons = np.zeros(len(mesh.data.loops), np.int64)
+    loopPolygons[loops] = np.repeat(np.arange(len(loopTotals)), loopTotals)
+    return loopPolygons
 
+def weldLoops(keys: list) -> tuple:
+    """One CMDL vertex per unique row of the per-loop key columns, ordered by key.
+    Returns the first loop of each CMDL vertex and the CMDL vertex of each loop."""
+    keys = np.column_stack(keys).astype(np.int64)
+    _, firstLoops, loopToVertex = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return firstLoops, loopToVertex.reshape(-1)
 
-def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: bool = False):
+def getVertWeights(mesh, group_name: str) -> np.ndarray:
+    """getVertWeight for every vertex of the mesh"""
+    if group_name in mesh.vertex_groups:
+        group_index = mesh.vertex_groups[group_name].index
+    else:
+        print("fuck")
+        group_index = 0
+    weights = np.zeros(len(mesh.data.vertices), np.float32)
+    for vertex in mesh.data.vertices:
+        for group in vertex.groups:
+            if group.group == group_index:
+                weights[vertex.index] = group.weight
+                break
+    return weights
 
-    if evmMode:
-        bigMode = True # temporary until compressed mode set up for EVM bone skinning
+def getOidx(meshes, meshVertices: list) -> np.ndarray:
+    """Original (KMS) index of each CMDL vertex, through each mesh's kmsVertSideChannel.
+    Each mesh's indexes are offset by the Blender vertex count of the meshes before it, not by their welded CMDL vertex count."""
+    oidx = []
+    vertIndexOffset = 0
+    for mesh, vertices in zip(meshes, meshVertices):
+        kmsOidxLookup = list(mesh["kmsVertSideChannel"])
+        # Reverse index, keeping the first occurrence like list.index
+        oidxIndex = {}
+        for i, vertexIndex in enumerate(kmsOidxLookup):
+            oidxIndex.setdefault(vertexIndex, i)
+        meshOidx = [oidxIndex.get(vertexIndex, -1) for vertexIndex in vertices.tolist()]
+        if -1 in meshOidx:
+            print(mesh.name, kmsOidxLookup)
+            raise Exception(f"Vertex {vertices[meshOidx.index(-1)]} of {mesh.name} is missing from kmsVertSideChannel")
+        oidx.append(np.array(meshOidx, np.int64) + vertIndexOffset)
+        vertIndexOffset += len(mesh.data.vertices)
+    return concatenate(oidx, ())
+
+def concatenate(arrays: list, shape: tuple) -> np.ndarray:
+    return np.concatenate(arrays) if arrays else np.empty((0,) + shape)
+
+def getBoneWeights(vertex, groupBoneIndex, skinningTable: list, skinningLookup: dict):
+    """Up to four (skinning table index, weight) pairs for a vertex, heaviest first, adding new bones to the table"""
+    boneIndices = []
+    boneWeights = []
+    for group in vertex.groups:
+        if group.weight == 0:
+            continue
+        boneIndex = groupBoneIndex(group.group)
+        if boneIndex not in skinningLookup:
+            skinningLookup[boneIndex] = len(skinningTable)
+            skinningTable.append(boneIndex)
+        boneIndices.append(skinningLookup[boneIndex])
+        boneWeights.append(group.weight)
+    
+    assert(all([0.0 < x <= 1.0 for x in boneWeights]))
+    weightTotal = sum(boneWeights) # Force normalize
+    for i, weight in enumerate(boneWeights):
+        boneWeights[i] = weight * (1.0 / weightTotal)
+    
+    while len(boneWeights) < 4:
+        boneIndices.append(0)
+        boneWeights.append(0.0)
+    # Sort weights in descending order
+    weightPairs = sorted([(boneIndices[i], boneWeights[i]) for i in range(4)],
+                         key=lambda x: -x[1])
+    return [x[0] for x in weightPairs], [x[1] for x in weightPairs]
 
+
+def main(cmdl_file: str, collection_name: str, evmMode: bool = False, optimizeCache: bool = False):
+    
     cmdl = CMDL()
     
     collection = bpy.data.collections[collection_name]
@@ -32,13 +103,25 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
     bones = amt.data.bones
     meshes = [x for x in collection.all_objects if x.type == "MESH"]
     
-    # Vertex positions and normals
-    print("Computing coordinates")
-    posSection = CMDLSection(b"POS0")
-    nrmSection = CMDLSection(b"NRM0")
-
+    uv_sections: List[CMDLSectionData] = []
+    if any(len(mesh.data.uv_layers) > 0 for mesh in meshes):
+        uv_sections.append(CMDLSection(b"TEX0"))
+    if any(len(mesh.data.uv_layers) > 1 for mesh in meshes):
+        uv_sections.append(CMDLSection(b"TEX1"))
+    if any(len(mesh.data.uv_layers) > 2 for mesh in meshes):
+        uv_sections.append(CMDLSection(b"TEX2"))
+    
+    # Weld loops into CMDL vertices: loops only share a vertex if they share its material, position,
+    # weights (all implied by the vertex index) and exported normal and UVs, so UV seams split automatically
+    print("Welding vertices")
+    positions = []
+    normals = []
+    uvs = [[] for _ in uv_sections]
+    meshVertices = [] # Blender vertex behind each CMDL vertex
+    meshMaterials = [] # material index of each CMDL vertex
+    meshLoopVertices = [] # CMDL vertex of each loop
+    
     for mesh in meshes:
-        prevVertexIndex = -1
         if not evmMode:
             meshIndex = int(mesh.name.split('Mesh')[1])
             bone = bones.get(getBoneName(meshIndex)) or bones[meshIndex]
@@ -46,58 +129,52 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
         meshmesh = mesh.data
         if bpy.app.version < (4, 1):
             meshmesh.calc_normals_split()
-        for loop in getLoops(mesh, bigMode):
-            if loop.vertex_index == prevVertexIndex and not bigMode:
-                continue
-            prevVertexIndex = loop.vertex_index
-            vertex = meshmesh.vertices[loop.vertex_index]
-            if evmMode:
-                posSection.data.data.append((vertex.co.x/16, vertex.co.y/16, vertex.co.z/16, 1.0))
+        loopVertices = foreachGet(meshmesh.loops, "vertex_index", np.int32)
+        loopMaterials = foreachGet(meshmesh.polygons, "material_index", np.int32)[getLoopPolygons(mesh)]
+        loopNormals = -foreachGet(meshmesh.loops, "normal", np.float32, 3)
+        # UVs are attached to loops, not vertices
+        loopUvs = []
+        for i in range(len(uv_sections)):
+            if len(meshmesh.uv_layers) > i:
+                # double precision so the flip rounds like it always has
+                uv = foreachGet(meshmesh.uv_layers[i].uv, "vector", np.float32, 2).astype(np.float64)
+                uv[:, 1] = 1 - uv[:, 1]
+                loopUvs.append(uv)
             else:
-                posSection.data.data.append((vertex.co.x, vertex.co.y, vertex.co.z, getVertWeight(vertex, mesh, bone.name)))
-            nrm = loop.normal
-            nrmSection.data.data.append((-nrm.x, -nrm.y, -nrm.z))
-
+                loopUvs.append(np.zeros((len(meshmesh.loops), 2)))
+        
+        # Compare normals and UVs as they will be written
+        keys = [loopMaterials, loopVertices, packNormals(loopNormals)]
+        keys += [uv.astype(np.float16).view(np.uint16) for uv in loopUvs]
+        firstLoops, loopToVertex = weldLoops(keys)
+        
+        vertices = loopVertices[firstLoops]
+        coords = foreachGet(meshmesh.vertices, "co", np.float32, 3)[vertices]
+        if evmMode:
+            positions.append(np.column_stack((coords / 16, np.ones(len(coords), np.float32))))
+        else:
+            positions.append(np.column_stack((coords, getVertWeights(mesh, bone.name)[vertices])))
+        normals.append(loopNormals[firstLoops])
+        for i, uv in enumerate(loopUvs):
+            uvs[i].append(uv[firstLoops])
+        meshVertices.append(vertices)
+        meshMaterials.append(loopMaterials[firstLoops])
+        meshLoopVertices.append(loopToVertex)
+        print(f"{mesh.name}: {len(meshmesh.loops)} loops welded to {len(vertices)} vertices")
+    
+    # Vertex positions and normals
+    print("Computing coordinates")
+    posSection = CMDLSection(b"POS0")
+    nrmSection = CMDLSection(b"NRM0")
+    posSection.data.data = concatenate(positions, (4,))
+    nrmSection.data.data = concatenate(normals, (3,))
     cmdl.sections.append(posSection)
     cmdl.sections.append(nrmSection)
     
     # UV Maps
     print("Computing UV maps")
-    uv_sections: List[CMDLSectionData] = []
-    if any(len(mesh.data.uv_layers) > 0 for mesh in meshes):
-        uv_sections.append(CMDLSection(b"TEX0"))
-    if any(len(mesh.data.uv_layers) > 1 for mesh in meshes):
-        uv_sections.append(CMDLSection(b"TEX1"))
-    if any(len(mesh.data.uv_layers) > 2 for mesh in meshes):
-        uv_sections.append(CMDLSection(b"TEX2"))
-        
-    for mesh in meshes:
-        """
-        prevMat = -1
-        skinningTables = [-1] * len(mesh.material_slots)
-        kmsOidxLookup = list(mesh["kmsVertSideChannel"])
-        evmSkinLookup = list(mesh["evmSkinSideChannel"])
-        for poly in mesh.data.polygons:
-            if poly.material_index != prevMat:
-                vertex = poly.vertices[0]
-                skinningTables[poly.material_index] = list(evmSkinLookup[kmsOidxLookup.index(vertex)])
-                prevMat = poly.material_index
-        for x in skinningTables:
-            print(x)
-        """
-        prevVertexIndex = -1
-        # UVs are attached to loops, not vertices, making this part more complex
-        for loop in getLoops(mesh, bigMode):
-            if loop.vertex_index == prevVertexIndex and not bigMode:
-                continue
-            prevVertexIndex = loop.vertex_index
-            for i in range(3):
-                if len(mesh.data.uv_layers) > i:
-                    uv = mesh.data.uv_layers[i].uv[loop.index].vector
-                    uv_sections[i].data.data.append((uv.x, 1 - uv.y))
-                elif len(uv_sections) > i:
-                    uv_sections[i].data.data.append((0, 0))
-    
+    for uv_section, uv in zip(uv_sections, uvs):
+        uv_section.data.data = concatenate(uv, (2,))
     cmdl.sections += uv_sections
     
     # EVM only- bone weights
@@ -105,47 +182,25 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
         print("Computing bone weights")
         boniSection = CMDLSection(b"BONI")
         bonwSection = CMDLSection(b"BONW")
-        vertIndexOffset = 0
         
         fingerIndex = getFingerIndex([bone.name for bone in bones])
         
-        for mesh in meshes:
-            #kmsOidxLookup = list(mesh["kmsVertSideChannel"])
+        for mesh, vertices, materials in zip(meshes, meshVertices, meshMaterials):
             # TODO: make this work with multiple meshes (heck, test if the rest of it works with multiple meshes)
             skinningTables = [[] for _ in range(len(mesh.material_slots))]
-            prevVertexIndex = -1
-            for poly in mesh.data.polygons:
-              for vertexIndex in poly.vertices: # TODO: yeah this almost certainly will break outside of bigMode, temporary override at top
-                vertex = mesh.data.vertices[vertexIndex]
-                skinningTable = skinningTables[poly.material_index]
-                boneIndices = []
-                boneWeights = []
-                for group in vertex.groups:
-                    if group.weight == 0:
-                        continue
-                    boneIndex = getBoneIndex(mesh.vertex_groups[group.group].name, fingerIndex)
-                    if boneIndex in skinningTable:
-                        boneIndices.append(skinningTable.index(boneIndex))
-                    else:
-                        boneIndices.append(len(skinningTable))
-                        skinningTable.append(boneIndex)
-                    boneWeights.append(group.weight)
-                
-                assert(all([0.0 < x <= 1.0 for x in boneWeights]))
-                weightTotal = sum(boneWeights) # Force normalize
-                for i, weight in enumerate(boneWeights):
-                    boneWeights[i] = weight * (1.0 / weightTotal)
-                
-                while len(boneWeights) < 4:
-                    boneIndices.append(0)
-                    boneWeights.append(0.0)
-                # Sort weights in descending order
-                weightPairs = sorted([(boneIndices[i], boneWeights[i]) for i in range(4)],
-                                     key=lambda x: -x[1])
-                boniSection.data.data.append([x[0] for x in weightPairs])
-                bonwSection.data.data.append([x[1] for x in weightPairs])
-                print(weightPairs)
-            vertIndexOffset += len(getVertices(mesh, bigMode))
+            skinningLookups = [{} for _ in range(len(mesh.material_slots))] # bone index -> skinning table index
+            groupNames = [group.name for group in mesh.vertex_groups]
+            groupBoneIndex = cache(lambda group: getBoneIndex(groupNames[group], fingerIndex))
+            vertexWeights = {} # (material index, vertex index) -> (bone indices, bone weights)
+            for materialIndex, vertexIndex in zip(materials.tolist(), vertices.tolist()):
+                key = (materialIndex, vertexIndex)
+                if key not in vertexWeights:
+                    vertexWeights[key] = getBoneWeights(mesh.data.vertices[vertexIndex], groupBoneIndex,
+                                                        skinningTables[materialIndex],
+                                                        skinningLookups[materialIndex])
+                boneIndices, boneWeights = vertexWeights[key]
+                boniSection.data.data.append(boneIndices)
+                bonwSection.data.data.append(boneWeights)
         
         cmdl.sections.append(boniSection)
         cmdl.sections.append(bonwSection)
@@ -153,16 +208,7 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
     # Original (KMS) indexing
     print("Computing original-file indexes")
     oidxSection = CMDLSection(b"OIDX")
-    
-    vertIndexOffset = 0
-    for mesh in meshes:
-        kmsOidxLookup = list(mesh["kmsVertSideChannel"])
-        for vertex in getVertices(mesh, bigMode):
-            if vertex.index not in kmsOidxLookup:
-                print(mesh.name, kmsOidxLookup)
-            oidxSection.data.data.append(kmsOidxLookup.index(vertex.index) + vertIndexOffset)
-        vertIndexOffset += len(getVertices(mesh, bigMode))
-    
+    oidxSection.data.data = getOidx(meshes, meshVertices)
     cmdl.sections.append(oidxSection)
     
     # Tail
@@ -170,53 +216,40 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
     
     vertIndexOffset = 0
     faceIndexOffset = 0
+    faces = []
     
-    for i, mesh in enumerate(meshes):
-        #kmsOidxLookup = list(mesh["kmsVertSideChannel"])
-        vertices = getVertices(mesh, bigMode)
+    for i, (mesh, vertices, loopToVertex) in enumerate(zip(meshes, meshVertices, meshLoopVertices)):
+        polygons = mesh.data.polygons
+        materialIndices = foreachGet(polygons, "material_index", np.int32)
         
         cmdl.tail.numMeshes += len(mesh.material_slots)
         newMeshes = [CMDLMesh() for _ in range(len(mesh.material_slots))]
-
-        minVerts = [-1] * len(mesh.material_slots)
-        minFaces = [-1] * len(mesh.material_slots)
-        maxVerts = [-1] * len(mesh.material_slots)
-        maxFaces = [-1] * len(mesh.material_slots)
-        for j, polygon in enumerate(mesh.data.polygons):
-            storeIndex = polygon.material_index
-            if minFaces[storeIndex] == -1:
-                minFaces[storeIndex] = j
-            maxFaces[storeIndex] = j
-            # Faces
-            loops = [mesh.data.loops[k] for k in polygon.loop_indices]
-            if bigMode:
-                newFace = list(range(j * 3 + vertIndexOffset, j * 3 + vertIndexOffset + 3))
-            else:
-                newFace = [loop.vertex_index + vertIndexOffset for loop in loops]
-            newFace[1], newFace[2] = newFace[2], newFace[1]
-            cmdl.tail.faces.append(newFace)
-            # Mesh vertex limits
-            for vertexIndex in newFace:
-                if minVerts[storeIndex] == -1 or vertexIndex < minVerts[storeIndex]:
-                    minVerts[storeIndex] = vertexIndex
-                if vertexIndex > maxVerts[storeIndex]:
-                    maxVerts[storeIndex] = vertexIndex
+        
+        # Faces, first three corners of each polygon
+        loopStarts = foreachGet(polygons, "loop_start", np.int64)
+        meshFaces = loopToVertex[loopStarts[:, None] + np.arange(3)] + vertIndexOffset
+        meshFaces = meshFaces[:, [0, 2, 1]]
+        faces.append(meshFaces)
         
         for j, cmdlMesh in enumerate(newMeshes):
             cmdlMesh.meshIndex = i
             cmdlMesh.subMeshIndex = j
+            # Mesh vertex and face limits
+            materialPolygons = np.flatnonzero(materialIndices == j)
+            if len(materialPolygons):
+                minFace, maxFace = materialPolygons[0], materialPolygons[-1]
+                minVert, maxVert = meshFaces[materialPolygons].min(), meshFaces[materialPolygons].max()
+            else:
+                minFace = maxFace = minVert = maxVert = -1
             try:
-                assert(0 <= minVerts[j] - vertIndexOffset < len(vertices))
-                assert(0 <= maxVerts[j] - vertIndexOffset < len(vertices))
-                #assert(0 <= minFaces[j] - faceIndexOffset < len(vertices))
-                #assert(0 <= maxFaces[j] - faceIndexOffset < len(vertices))
+                assert(0 <= minVert - vertIndexOffset < len(vertices))
+                assert(0 <= maxVert - vertIndexOffset < len(vertices))
             except AssertionError:
-                raise Exception("Assertion failed! On mesh %d, submesh %d, with %d vertices, vertices range (%d, %d) and faces range (%d, %d)!" % (i, j, len(vertices), minVerts[j], maxVerts[j], minFaces[j], maxFaces[j]))
-                #assert(False) # See above log
-            cmdlMesh.startVertex = minVerts[j]
-            cmdlMesh.vertexCount = maxVerts[j] - minVerts[j] + 1
-            cmdlMesh.startFace = (minFaces[j]) * 3 + faceIndexOffset
-            cmdlMesh.faceCount = (maxFaces[j] - minFaces[j] + 1) * 3
+                raise Exception("Assertion failed! On mesh %d, submesh %d, with %d vertices, vertices range (%d, %d) and faces range (%d, %d)!" % (i, j, len(vertices), minVert, maxVert, minFace, maxFace))
+            cmdlMesh.startVertex = int(minVert)
+            cmdlMesh.vertexCount = int(maxVert - minVert + 1)
+            cmdlMesh.startFace = int(minFace) * 3 + faceIndexOffset
+            cmdlMesh.faceCount = int(maxFace - minFace + 1) * 3
             cmdlMesh.minPos.x = mesh.bound_box[0][0]
             cmdlMesh.minPos.y = mesh.bound_box[0][1]
             cmdlMesh.minPos.z = mesh.bound_box[0][2]
@@ -230,10 +263,6 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
                 cmdlMesh.maxPos.x /= 16
                 cmdlMesh.maxPos.y /= 16
                 cmdlMesh.maxPos.z /= 16
-                if bigMode:
-                    startVertex = vertices[cmdlMesh.startVertex].index
-                else:
-                    startVertex = cmdlMesh.startVertex
                 skinningTable = skinningTables[j]
                 for bone in skinningTable:
                     if bone == 0xff:
@@ -241,16 +270,18 @@ def main(cmdl_file: str, collection_name: str, evmMode: bool = False, bigMode: b
                     cmdlMesh.bones.append(bone)
                 cmdlMesh.boneCount = len(cmdlMesh.bones)
                 print("Skinning cmdlMesh to bones:", cmdlMesh.bones)
-            #for k in range(cmdlMesh.startVertex, cmdlMesh.startVertex + cmdlMesh.vertexCount):
-
-            #print(cmdlMesh.startFace, cmdlMesh.faceCount)
         
         vertIndexOffset += len(vertices)
-        faceIndexOffset += len(mesh.data.polygons) * 3
+        faceIndexOffset += len(polygons) * 3
         
         cmdl.tail.meshes += newMeshes
     
-    #print(cmdl.tail.numFaces)
+    cmdl.tail.faces = concatenate(faces, (3,))
+    
+    if optimizeCache:
+        print("Optimizing vertex cache")
+        acmrBefore, acmrAfter = cmdl.optimizeVertexCache()
+        print(f"ACMR (vertices per triangle, {VERTEX_CACHE_SIZE} entry cache): {acmrBefore:.3f} -> {acmrAfter:.3f}")
     
     with open(cmdl_file, "wb") as f:
         cmdl.writeToFile(f)
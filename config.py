@@ -6,6 +6,7 @@ evmConfig = {
     "import.merge_mat": False, # Nicer in Blender, export issues
     "export.make_cmdl": True,
     "export.cmdl_path": "_win/",
+    "export.optimize_cmdl": False,
     "export.make_ctxr": False,
     "export.ctxr_path": "../../../textures/flatlist/ovr_stm/_win/"
 }
@@ -19,6 +20,7 @@ kmsConfig = {
     "export.kms_bak": 1,
     "export.make_cmdl": True,
     "export.cmdl_path": "_win/",
+    "export.optimize_cmdl": False,
     "export.cmdl_bak": 1,
     "export.make_ctxr": False,
     "export.ctxr_path": "../../../textures/flatlist/ovr_stm/_win/",
@@ -26,6 +28,8 @@ kmsConfig = {
 }
 triConfig = {
     "import.bulk": False,
+    # Re-dump TRIs the extraction manifest says are up to date
+    "import.overwrite": False,
     # 0 = Never backup, 1 = Backup if backup doesn't exist, 2 = Always backup
     "export.tri_bak": 1,
     # Expands all bp_assets.txt in subfolders of given folder with new textures
@@ -34,6 +38,8 @@ triConfig = {
     "export.txt_bak": 1
 }
 ctxrConfig = {
-    "import.bulk": False
+    "import.bulk": False,
+    # Re-convert CTXRs the extraction manifest says are up to date
+    "import.overwrite": False
 }
 
@@ -2,18 +2,25 @@ from __future__ import annotations
 from io import BufferedReader, BufferedWriter
 import struct
 from os import path
+import numpy as np
+from ..util.util import alignOffset
+
+STREAM_BLOCK_SIZE = 1 << 20
+CHUNK_ALIGNMENT = 0x20
 
 
 class CTXR:
     header: CTXRHeader
     chunks: list[CTXRChunk]
+    directory: list[tuple[int, int]] # (offset, size) of each mip level's data in the file
     
     def __init__(self):
         self.header = CTXRHeader()
         self.chunks = []
+        self.directory = []
     
     def fromFile(self, file: BufferedReader):
-        self.header.fromFile(file)
+        self.readDirectory(file)
         
         self.chunks = [
             CTXRChunk().fromFile(file)
@@ -22,21 +29,76 @@ class CTXR:
         
         return self
     
+    def readDirectory(self, file: BufferedReader):
+        """Read the header and the size of every mip level, seeking past the data"""
+        start = file.tell()
+        self.header.fromFile(file)
+        
+        self.directory = []
+        offset = file.tell()
+        for _ in range(self.header.numMipmaps):
+            file.seek(offset)
+            sizeData = file.read(4)
+            if len(sizeData) != 4:
+                raise EOFError(f"CTXR truncated, {len(self.directory)} of {self.header.numMipmaps} mipmaps found")
+            size = struct.unpack(">I", sizeData)[0]
+            self.directory.append((offset + 4, size))
+            offset = alignOffset(offset + 4 + size, CHUNK_ALIGNMENT)
+        
+        file.seek(start + 0x80)
+        return self
+    
+    def readMip(self, file: BufferedReader, level: int) -> bytes:
+        """Read one mip level (0 is full size) using the directory, without touching the others"""
+        offset, size = self.directory[level]
+        file.seek(offset)
+        data = file.read(size)
+        if len(data) != size:
+            raise EOFError(f"CTXR mipmap {level} truncated, {size - len(data)} of {size} bytes missing")
+        return data
+    
+    def mipSize(self, level: int) -> tuple[int, int]:
+        return max(self.header.width >> level, 1), max(self.header.height >> level, 1)
+    
     def convertDDS(self) -> DDS:
         dds = DDS()
-        dds.header.flags = 0x2100f
-        dds.header.width = self.header.width
-        dds.header.height = self.header.height
-        dds.header.pitch = 0
-        dds.header.numMipmaps = self.header.numMipmaps
-        dds.header.pixelFormat.flags = 0x41
-        dds.header.caps[0] = 0x1000
-        if self.header.numMipmaps > 0:
-            dds.header.caps[0] |= 0x400008
-        for chunk in self.chunks:
-            dds.data += chunk.data
+        dds.header = self.makeDDSHeader()
+        dds.data = b"".join(chunk.data for chunk in self.chunks)
         return dds
     
+    def makeDDSHeader(self) -> DDSHeader:
+        header = DDSHeader()
+        header.flags = 0x2100f
+        header.width = self.header.width
+        header.height = self.header.height
+        header.pitch = 0
+        header.numMipmaps = self.header.numMipmaps
+        header.pixelFormat.flags = 0x41
+        header.caps[0] = 0x1000
+        if self.header.numMipmaps > 0:
+            header.caps[0] |= 0x400008
+        return header
+    
+    @staticmethod
+    def streamDDS(inFile: BufferedReader, outFile: BufferedWriter) -> int:
+        """Convert a CTXR file to DDS chunk by chunk, without holding the mip chain in memory. Returns the bytes written"""
+        ctxr = CTXR().readDirectory(inFile)
+        ctxr.makeDDSHeader().writeToFile(outFile)
+        written = 0x80
+        
+        for level, (offset, size) in enumerate(ctxr.directory):
+            inFile.seek(offset)
+            remaining = size
+            while remaining > 0:
+                block = inFile.read(min(remaining, STREAM_BLOCK_SIZE))
+                if not block:
+                    raise EOFError(f"CTXR mipmap {level} truncated, {remaining} of {size} bytes missing")
+                outFile.write(block)
+                remaining -= len(block)
+            written += size
+        
+        return written
+    
     def writeToFile(self, file: BufferedWriter):
         self.header.writeToFile(file)
         for chunk in self.chunks:
@@ -102,16 +164,15 @@ class CTXRChunk:
     def fromFile(self, file: BufferedReader):
         self.size = struct.unpack(">I", file.read(4))[0]
         self.data = file.read(self.size)
-        while file.tell() % 0x20 != 0:
-            file.read(1)
-    
+        file.seek(alignOffset(file.tell(), CHUNK_ALIGNMENT))
+        
         return self
     
     def writeToFile(self, file: BufferedWriter):
+        end = file.tell() + 4 + len(self.data)
         file.write(struct.pack(">I", self.size))
         file.write(self.data)
-        while file.tell() % 0x20 != 0:
-            file.write(b"\0")
+        file.write(b"\0" * (alignOffset(end, CHUNK_ALIGNMENT) - end))
 
 
 class DDS:
@@ -129,7 +190,9 @@ class DDS:
         
         return self
     
-    def convertCTXR(self) -> CTXR:
+    def convertCTXR(self, generateMips: bool = True, gammaCorrect: bool = False) -> CTXR:
+        """Split the DDS mip chain into CTXR chunks.
+        A single-level DDS gets the rest of its chain generated, unless generateMips is off."""
         ctxr = CTXR()
         ctxr.header.width = self.header.width
         ctxr.header.height = self.header.height
@@ -137,19 +200,38 @@ class DDS:
         ctxr.header.unknown4 = [0, 0, 0] + [0xff] * 10 + [0, 0, 0, 0, 0]
         ctxr.chunks = []
         
-        dataPos = 0
-        dataSize = self.header.width * self.header.height * 4
-        for i in range(self.header.numMipmaps):
-            # print(f"Generating mipmap {i} for CTXR, size {dataSize}...")
-            newChunk = CTXRChunk()
-            newChunk.size = dataSize
-            newChunk.data = self.data[dataPos:dataPos+dataSize]
-            ctxr.chunks.append(newChunk)
-            dataPos += dataSize
-            dataSize //= 4
+        if generateMips and self.header.numMipmaps <= 1 and self.isBGRA8():
+            levels = mipChain(self.image(), fullMipCount(self.header.width, self.header.height), gammaCorrect)
+            for level in levels:
+                newChunk = CTXRChunk()
+                newChunk.data = level.tobytes()
+                newChunk.size = len(newChunk.data)
+                ctxr.chunks.append(newChunk)
+            ctxr.header.numMipmaps = len(levels)
+        else:
+            dataPos = 0
+            dataSize = self.header.width * self.header.height * 4
+            for i in range(self.header.numMipmaps):
+                # print(f"Generating mipmap {i} for CTXR, size {dataSize}...")
+                newChunk = CTXRChunk()
+                newChunk.size = dataSize
+                newChunk.data = self.data[dataPos:dataPos+dataSize]
+                ctxr.chunks.append(newChunk)
+                dataPos += dataSize
+                dataSize //= 4
         
         return ctxr
     
+    def isBGRA8(self) -> bool:
+        pixelFormat = self.header.pixelFormat
+        return pixelFormat.fourcc == 0 and pixelFormat.bitCount == 32 and \
+            pixelFormat.bitMasks == [0xff0000, 0xff00, 0xff, 0xff000000]
+    
+    def image(self) -> np.ndarray:
+        """Top mip level as a (height, width, 4) BGRA array"""
+        size = self.header.width * self.header.height * 4
+        return np.frombuffer(self.data, np.uint8, size).reshape(self.header.height, self.header.width, 4)
+    
     def writeToFile(self, file: BufferedWriter):
         self.header.writeToFile(file)
         file.write(self.data)
@@ -227,4 +309,36 @@ class DDSPixelFormat:
         self.bitMasks[0], self.bitMasks[1], self.bitMasks[2], self.bitMasks[3]))
 
 
+def fullMipCount(width: int, height: int) -> int:
+    return max(width, height, 1).bit_length()
+
+def srgbToLinear(c: np.ndarray) -> np.ndarray:
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+def linearToSrgb(c: np.ndarray) -> np.ndarray:
+    return np.where(c <= 0.0031308, c * 12.92, 1.055 * np.maximum(c, 0.0031308) ** (1 / 2.4) - 0.055)
+
+def mipChain(image: np.ndarray, count: int, gammaCorrect: bool = False) -> list[np.ndarray]:
+    """Build count mip levels from a (height, width, 4) BGRA8 image with a 2x2 box filter.
+    With gammaCorrect, colour is averaged in linear light; alpha always is."""
+    levels = [image]
+    pixels = image.astype(np.float32) / 255
+    if gammaCorrect:
+        pixels[..., :3] = srgbToLinear(pixels[..., :3])
+    
+    for _ in range(count - 1):
+        height, width = pixels.shape[:2]
+        if height > 1:
+            pixels = (pixels[0:height & ~1:2] + pixels[1:height:2]) / 2
+        if width > 1:
+            pixels = (pixels[:, 0:width & ~1:2] + pixels[:, 1:width:2]) / 2
+        
+        level = pixels.copy()
+        if gammaCorrect:
+            level[..., :3] = linearToSrgb(level[..., :3])
+        levels.append(np.clip(np.rint(level * 255), 0, 255).astype(np.uint8))
+    
+    return levels
+
+
 ctxr_lookup_path = path.join(path.dirname(__file__), "ctxrmapping.txt")
\ No newline at end of file
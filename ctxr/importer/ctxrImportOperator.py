@@ -1,8 +1,7 @@
 import bpy
 from bpy_extras.io_utils import ImportHelper
 import os
-from ..ctxr import CTXR
-from ...util.util import replaceExt
+from ...util.bulk import bulkConvertCtxr
 from ...config import ctxrConfig
 
 
@@ -15,7 +14,8 @@ class ImportMgsCtxr(bpy.types.Operator, ImportHelper):
     filter_glob: bpy.props.StringProperty(default="*.ctxr", options={'HIDDEN'})
 
     #reset_blend: bpy.props.BoolProperty(name="Reset Blender Scene on Import", default=True)
-    bulk_import: bpy.props.BoolProperty(name="Bulk extract (not recommended)", default=ctxrConfig['import.bulk'])
+    bulk_import: bpy.props.BoolProperty(name="Bulk extract from folder", default=ctxrConfig['import.bulk'])
+    overwrite_existing: bpy.props.BoolProperty(name="Re-extract unchanged files", default=ctxrConfig['import.overwrite'])
 
     def execute(self, context):
         if self.bulk_import:
@@ -27,15 +27,8 @@ class ImportMgsCtxr(bpy.types.Operator, ImportHelper):
         extract_dir = os.path.join(base_dir, "sealouse_extract")
         os.makedirs(extract_dir, exist_ok=True)
         
-        for file in filelist:
-            filepath = os.path.join(base_dir, file)
-            outpath = os.path.join(extract_dir, replaceExt(file, "dds"))
-            print("\n\nLoading", filepath)
-            
-            ctxr = CTXR()
-            with open(filepath, "rb") as f:
-                ctxr.fromFile(f)
-            dds = ctxr.convertDDS()
-            with open(outpath, "wb") as f:
-                dds.writeToFile(f)
+        results = bulkConvertCtxr([os.path.join(base_dir, x) for x in filelist], extract_dir, force=self.overwrite_existing)
+        failures = sum(len(x.failures) for x in results)
+        if failures:
+            self.report({'WARNING'}, f"{failures} textures failed to convert, see the console for details")
         return {'FINISHED'}
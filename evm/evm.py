@@ -1,10 +1,15 @@
 from __future__ import annotations
-from io import BufferedReader, BufferedWriter
+from io import BufferedReader, BufferedWriter, BytesIO
 import struct
+from functools import partial
+import numpy as np
+from ..util.util import PackedList, packArray, readArray
+
+evmUvDtype = np.dtype([("u", "<i2"), ("v", "<i2"), ("unknown", "<u4")])
 
 def readPad(padArray: List[int], file: BufferedReader):
     for pad in range(len(padArray)):
-        padArray[pad] = struct.unpack("<I", file.read(4))
+        padArray[pad] = struct.unpack("<I", file.read(4))[0]
         if padArray[pad] != 0:
             print("Unexpected non-zero pad detected.")
 
@@ -30,7 +35,7 @@ class EVM:
         self.meshes = []
         self.bones = []
     
-    def fromFile(self, file: BufferedReader):
+    def fromFile(self, file: BufferedReader, columnar: bool = False):
         self.header = EVMHeader().fromFile(file)
         
         self.bones = [
@@ -44,7 +49,7 @@ class EVM:
         file.seek(self.header.meshOffset)
         
         self.meshes = [
-            EVMMesh().fromFile(file)
+            EVMMesh().fromFile(file, columnar)
             for _ in range(self.header.numMeshes)
         ]
         
@@ -80,84 +85,46 @@ class EVM:
         
         firstExDataOffset = self.header.meshOffset + 0x70 * self.header.numMeshes
         
+        # Pack and lay out every stream up front: all vertices, all normals,
+        # then UV1/2/3 and weights, each 0x10 aligned
+        streamTypes = [
+            ("vertexOffset", EVMMesh.packVertices),
+            ("normalOffset", EVMMesh.packNormals),
+            ("uvOffset", partial(EVMMesh.packUvs, channel=0)),
+            ("uv2Offset", partial(EVMMesh.packUvs, channel=1)),
+            ("uv3Offset", partial(EVMMesh.packUvs, channel=2)),
+            ("weightOffset", EVMMesh.packWeights),
+        ]
+        streams = [] # (offset, packed array)
+        curExDataOffset = firstExDataOffset
+        for offsetName, pack in streamTypes:
+            for mesh in self.meshes:
+                data = pack(mesh)
+                if data is None:
+                    setattr(mesh, offsetName, 0)
+                else:
+                    setattr(mesh, offsetName, curExDataOffset)
+                    streams.append((curExDataOffset, data))
+                    curExDataOffset += data.nbytes
+                curExDataOffset = padOffset(curExDataOffset)
         
-        file.seek(0)
-        
-        self.header.writeToFile(file)
-        
+        # Header and records go in front, written back to back
+        records = BytesIO()
+        self.header.writeToFile(records)
         for bone in self.bones:
-            bone.writeToFile(file)
-        
-        curExDataOffset = firstExDataOffset
-        for mesh in self.meshes:
-            mesh.vertexOffset = curExDataOffset
-            curExDataOffset += 0x8 * mesh.numVertex
-            curExDataOffset = padOffset(curExDataOffset)
-        for mesh in self.meshes:
-            mesh.normalOffset = curExDataOffset
-            curExDataOffset += 0x8 * mesh.numVertex
-            curExDataOffset = padOffset(curExDataOffset)
-
-        for mesh in self.meshes:
-            if mesh.uvs != None and any((x.u, x.v) != (0, 0) for x in mesh.uvs):
-                mesh.uvOffset = curExDataOffset
-                curExDataOffset += 0x8 * mesh.numVertex
-            else:
-                mesh.uvOffset = 0
-                mesh.uvs = None
-            curExDataOffset = padOffset(curExDataOffset)
+            bone.writeToFile(records)
         for mesh in self.meshes:
-            if mesh.uvs2 != None and any((x.u, x.v) != (0, 0) for x in mesh.uvs2):
-                mesh.uv2Offset = curExDataOffset
-                curExDataOffset += 0x8 * mesh.numVertex
-            else:
-                mesh.uv2Offset = 0
-                mesh.uvs2 = None
-            curExDataOffset = padOffset(curExDataOffset)
-        for mesh in self.meshes:
-            if mesh.uvs3 != None and any((x.u, x.v) != (0, 0) for x in mesh.uvs3):
-                mesh.uv3Offset = curExDataOffset
-                curExDataOffset += 0x8 * mesh.numVertex
-            else:
-                mesh.uv3Offset = 0
-                mesh.uvs3 = None
-            curExDataOffset = padOffset(curExDataOffset)
-        for mesh in self.meshes:
-            if mesh.weights != None:
-                mesh.weightOffset = curExDataOffset
-                curExDataOffset += 0x8 * mesh.numVertex
-            else:
-                mesh.weightOffset = 0
-            curExDataOffset = padOffset(curExDataOffset)
-                
-        for mesh in self.meshes:
-            mesh.writeToFile(file)
-            returnPos = file.tell()
+            mesh.writeToFile(records)
+        records = records.getvalue()
         
-            file.seek(mesh.vertexOffset)
-            for vert in mesh.vertices:
-                vert.writeToFile(file)
-            file.seek(mesh.normalOffset)
-            for normal in mesh.normals:
-                normal.writeToFile(file)
-            file.seek(mesh.uvOffset)
-            if mesh.uvs != None:
-                for uv in mesh.uvs:
-                    uv.writeToFile(file)
-            file.seek(mesh.uv2Offset)
-            if mesh.uvs2 != None:
-                for uv in mesh.uvs2:
-                    uv.writeToFile(file)
-            file.seek(mesh.uv3Offset)
-            if mesh.uvs3 != None:
-                for uv in mesh.uvs3:
-                    uv.writeToFile(file)
-            file.seek(mesh.weightOffset)
-            if mesh.weights != None:
-                for weight in mesh.weights:
-                    weight.writeToFile(file)
-            
-            file.seek(returnPos)
+        fileSize = max([len(records)] + [offset + data.nbytes for offset, data in streams if data.nbytes > 0])
+        buffer = bytearray(fileSize)
+        buffer[:len(records)] = records
+        for offset, data in streams:
+            packArray(buffer, offset, data, data.dtype)
+        
+        file.seek(0)
+        file.write(buffer)
 
 
 class EVMHeader:
@@ -339,6 +306,15 @@ class EVMMesh:
     uvs3: List[EVMUv] | None
     weights: List[EVMWeights] | None
     
+    # Columnar storage, only set when read with columnar=True
+    # The lists above then become read-only PackedList views of these
+    vertexData: np.ndarray | None # (numVertex, 4) int16: x, y, z, flags
+    normalData: np.ndarray | None # (numVertex, 4) int16: x, y, z, pad
+    uvData: np.ndarray | None # (numVertex,) evmUvDtype: u, v, unknown
+    uv2Data: np.ndarray | None
+    uv3Data: np.ndarray | None
+    weightData: np.ndarray | None # (numVertex, 8) uint8: 4 weights, then 4 skinning table indices (<< 2)
+    
     def __init__(self):
         self.flag = 0
         self.pad = 0
@@ -370,8 +346,15 @@ class EVMMesh:
         self.uvs2 = None
         self.uvs3 = None
         self.weights = None
-    
-    def fromFile(self, file: BufferedReader):
+        
+        self.vertexData = None
+        self.normalData = None
+        self.uvData = None
+        self.uv2Data = None
+        self.uv3Data = None
+        self.weightData = None
+    
+    def fromFile(self, file: BufferedReader, columnar: bool = False):
         self.flag, self.pad, self.colorMap, self.pad2, \
         self.specularMap, self.pad3, self.environmentMap, self.pad4, \
         self.numVertex, self.numSkin = struct.unpack("<10I", file.read(0x28))
@@ -384,6 +367,11 @@ class EVMMesh:
         
         curPos = file.tell()
         
+        if columnar:
+            self.readColumnar(file)
+            file.seek(curPos)
+            return self
+        
         #print(self.vertexOffset, self.numVertex)
         file.seek(self.vertexOffset)
         self.vertices = [
@@ -436,6 +424,84 @@ class EVMMesh:
         file.seek(curPos)
         return self
     
+    def readColumnar(self, file: BufferedReader):
+        # One bulk read per stream instead of one unpack per element
+        file.seek(self.vertexOffset)
+        self.vertexData = readArray(file, "<i2", (self.numVertex, 4))
+        file.seek(self.normalOffset)
+        self.normalData = readArray(file, "<i2", (self.numVertex, 4))
+        
+        uvStreams = []
+        for uvOffset in (self.uvOffset, self.uv2Offset, self.uv3Offset):
+            if uvOffset > 0:
+                file.seek(uvOffset)
+                uvStreams.append(readArray(file, evmUvDtype, self.numVertex))
+            else:
+                uvStreams.append(None)
+        self.uvData, self.uv2Data, self.uv3Data = uvStreams
+        
+        if self.weightOffset > 0:
+            file.seek(self.weightOffset)
+            self.weightData = readArray(file, np.uint8, (self.numVertex, 8))
+        else:
+            self.weightData = None
+        
+        self.vertices = PackedList(self.vertexData, EVMVertex.fromRow)
+        self.normals = PackedList(self.normalData, EVMNormal.fromRow)
+        self.uvs, self.uvs2, self.uvs3 = [
+            PackedList(uvData, EVMUv.fromRow) if uvData is not None else None
+            for uvData in uvStreams
+        ]
+        self.weights = PackedList(self.weightData, EVMWeights.fromRow) if self.weightData is not None else None
+    
+    def faceMask(self) -> np.ndarray:
+        """Per-vertex isFace flags as a bool array"""
+        if self.vertexData is not None:
+            return (self.vertexData[:, 3].view(np.uint16) & 0x8000) == 0
+        return np.array([vert.isFace for vert in self.vertices], dtype=bool)
+    
+    def getUvs(self, channel: int) -> List[EVMUv] | None:
+        return (self.uvs, self.uvs2, self.uvs3)[channel]
+    
+    def packVertices(self) -> np.ndarray:
+        if isinstance(self.vertices, PackedList):
+            return self.vertices.data
+        # isFace decides the top flags bit; reinterpreted as signed so the whole stream packs as int16
+        return np.frombuffer(struct.pack(f"<{4 * len(self.vertices)}h",
+                             *[x for vert in self.vertices for x in
+                               (vert.x, vert.y, vert.z, (vert.flags & 0x7fff) - (0 if vert.isFace else 0x8000))]),
+                             "<i2").reshape(-1, 4)
+    
+    def packNormals(self) -> np.ndarray:
+        if isinstance(self.normals, PackedList):
+            return self.normals.data
+        return np.frombuffer(struct.pack(f"<{4 * len(self.normals)}h",
+                             *[x for normal in self.normals for x in (normal.x, normal.y, normal.z, normal.pad)]),
+                             "<i2").reshape(-1, 4)
+    
+    def packUvs(self, channel: int) -> np.ndarray | None:
+        """Packed UV channel, or None if it is missing or all (0, 0) and so not written"""
+        uvs = self.getUvs(channel)
+        if uvs is None:
+            return None
+        if isinstance(uvs, PackedList):
+            data = uvs.data
+        else:
+            data = np.frombuffer(struct.pack("<" + "hhI" * len(uvs), *[x for uv in uvs for x in (uv.u, uv.v, uv.unknown)]),
+                                 evmUvDtype)
+        if np.count_nonzero(data["u"]) == 0 and np.count_nonzero(data["v"]) == 0:
+            return None
+        return data
+    
+    def packWeights(self) -> np.ndarray | None:
+        if self.weights is None:
+            return None
+        if isinstance(self.weights, PackedList):
+            return self.weights.data
+        return np.frombuffer(struct.pack(f"<{8 * len(self.weights)}B",
+                             *[x for weight in self.weights for x in weight.weights[:4] + weight.indices[:4]]),
+                             np.uint8).reshape(-1, 8)
+    
     def writeToFile(self, file: BufferedWriter):
         file.write(struct.pack("<10I", self.flag, self.pad, self.colorMap, self.pad2, \
         self.specularMap, self.pad3, self.environmentMap, self.pad4, \
@@ -469,6 +535,13 @@ class EVMVertex:
         self.isFace = not (self.flags & 0x8000)
         return self
     
+    @staticmethod
+    def fromRow(row: List[int]) -> EVMVertex:
+        vert = EVMVertex(row[0], row[1], row[2])
+        vert.flags = row[3] & 0xffff
+        vert.isFace = not (vert.flags & 0x8000)
+        return vert
+    
     def writeToFile(self, file: BufferedWriter):
         if self.isFace:
             self.flags &= ~0x8000
@@ -499,6 +572,12 @@ class EVMNormal:
         
         return self
     
+    @staticmethod
+    def fromRow(row: List[int]) -> EVMNormal:
+        normal = EVMNormal(row[0], row[1], row[2])
+        normal.pad = row[3]
+        return normal
+    
     def writeToFile(self, file: BufferedWriter):
         
         file.write(struct.pack("<hhhh", self.x, self.y, self.z, self.pad))
@@ -517,6 +596,12 @@ class EVMUv:
         self.u, self.v, self.unknown = struct.unpack("<hhI", file.read(0x8))
         return self
     
+    @staticmethod
+    def fromRow(row: Tuple[int]) -> EVMUv:
+        uv = EVMUv(row[0], row[1])
+        uv.unknown = row[2]
+        return uv
+    
     def writeToFile(self, file: BufferedWriter):
         file.write(struct.pack("<hhI", self.u, self.v, self.unknown))
 
@@ -541,6 +626,10 @@ class EVMWeights:
         self.weights = weights[:4]
         return self
     
+    @staticmethod
+    def fromRow(row: List[int]) -> EVMWeights:
+        return EVMWeights(row[:4], row[4:])
+    
     def writeToFile(self, file: BufferedWriter):
         for weight in self.weights:
             file.write(struct.pack("<B", weight))
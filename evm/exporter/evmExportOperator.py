@@ -14,8 +14,8 @@ class ExportMgsEvm(bpy.types.Operator, ExportHelper):
     filter_glob: props.StringProperty(default="*.evm", options={'HIDDEN'})
 
     make_cmdl: props.BoolProperty(name="Generate CMDL supplement", default=evmConfig['export.make_cmdl'])
-    big_cmdl: props.BoolProperty(name="Split CMDL faces (DO NOT)", default=False)
     cmdl_path: props.StringProperty(name="CMDL Path:", default=evmConfig['export.cmdl_path'])
+    optimize_cmdl: props.BoolProperty(name="Optimize CMDL vertex cache", default=evmConfig['export.optimize_cmdl'])
     pack_textures: props.BoolProperty(name="Repack CTXR textures", default=evmConfig['export.make_ctxr'])
     tex_path: props.StringProperty(name="CTXR Path:", default=evmConfig['export.ctxr_path'])
     
@@ -63,7 +63,7 @@ class ExportMgsEvm(bpy.types.Operator, ExportHelper):
             cmdl_path = os.path.join(win_folder, cmdl_basename)
             print("Saving", cmdl_path)
             
-            cmdl_exporter.main(cmdl_path, colName, True, self.big_cmdl)
+            cmdl_exporter.main(cmdl_path, colName, True, self.optimize_cmdl)
             print('CMDL COMPLETE :)')
         
         return {'FINISHED'}
@@ -74,6 +74,7 @@ class ExportMgsEvm(bpy.types.Operator, ExportHelper):
         col.prop(self, "make_cmdl")
         if self.make_cmdl:
             col.prop(self, "cmdl_path")
+            col.prop(self, "optimize_cmdl")
         col.prop(self, "pack_textures")
         if self.pack_textures:
             col.prop(self, "tex_path")
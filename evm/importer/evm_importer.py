@@ -1,16 +1,18 @@
 import bpy
 from ..evm import *
+import numpy as np
 import os
 from mathutils import Vector
 from ...kms.importer.rotationWrapperObj import objRotationWrapper
 from ...util.util import getBoneName, expected_parent_bones
 from ...util.materials import TextureLoad, MaterialHelper
-import bmesh
+from ...util.mesh import stripFaces, buildMesh, setLoopUvs, addWeights
 
 DEFAULT_BONE_LENGTH = 10
 
-def vertCoordCheck(vert1: EVMVertex, vert2: EVMVertex):
-    return vert1.x == vert2.x and vert1.y == vert2.y and vert1.z == vert2.z
+def loadUvs(uvData) -> np.ndarray:
+    # evmUvDtype rows to Blender UV space
+    return np.column_stack((uvData["u"] / 4096, 1 - uvData["v"] / 4096))
 
 # Credit WoefulWolf/Nier2Blender2Nier
 def reset_blend():
@@ -42,87 +44,45 @@ def set_partent(parent, child):
 
 def construct_mesh(evm: EVM, evmCollection, extract_dir: str, hasHumanBones: bool, texLoader: TextureLoad, merge_material_slots: bool):
     print("Importing mesh")
-    vertices = []
-    normals = []
-    faces = []
-    materialIndices = []
-    uvs = []
-    uvs2 = []
-    uvs3 = []
-    weights = []
-    boneIndices = []
+    vertices = [np.empty((0, 3), np.int16)]
+    normals = [np.empty((0, 3))]
+    faces = [np.empty((0, 3), np.int64)]
+    materialIndices = [np.empty(0, np.int64)]
+    uvs = ([np.empty((0, 2))], [np.empty((0, 2))], [np.empty((0, 2))])
     uniqueMaterialIndices: dict = {}
-    #bpy.context.scene.collection.children.link(bpy.data.collections.new("looseCoords"))
+    faceIndexOffset = 0
+    flip = False
     for i, vertexGroup in enumerate(evm.meshes):
-        faceIndexOffset = len(vertices)
-        vertices += [tuple(vert.xyz()) for vert in vertexGroup.vertices]
-        #for j, vert in enumerate(vertexGroup.vertices):
-        #    target = bpy.data.objects.new(str(j), None)
-        #    target.empty_display_size = 0.001
-        #    target.location = [vert.x/1000, -vert.z/1000, vert.y/1000]
-        #    bpy.data.collections["looseCoords"].objects.link(target)
-        normals += [(-nrm.x / 4096, -nrm.y / 4096, -nrm.z / 4096) for nrm in vertexGroup.normals]
-        if vertexGroup.uvs:
-            uvs += [(uv.u / 4096, 1 - uv.v / 4096) for uv in vertexGroup.uvs]
-        else:
-            uvs += [(0, 1) for _ in range(vertexGroup.numVertex)]
-        if vertexGroup.uvs2:
-            uvs2 += [(uv.u / 4096, 1 - uv.v / 4096) for uv in vertexGroup.uvs2]
-        else:
-            uvs2 += [(0, 1) for _ in range(vertexGroup.numVertex)]
-        if vertexGroup.uvs3:
-            uvs3 += [(uv.u / 4096, 1 - uv.v / 4096) for uv in vertexGroup.uvs3]
-        else:
-            uvs3 += [(0, 1) for _ in range(vertexGroup.numVertex)]
+        vertices.append(vertexGroup.vertexData[:, :3])
+        normals.append(vertexGroup.normalData[:, :3] / -4096)
+        for channel, uvData in enumerate((vertexGroup.uvData, vertexGroup.uv2Data, vertexGroup.uv3Data)):
+            uvs[channel].append(loadUvs(uvData) if uvData is not None else np.tile([0.0, 1.0], (vertexGroup.numVertex, 1)))
         
         # This is ridiculous. The data is duplicated! How can the processor...
         if i == 0:
             flip = False
-        elif (vertCoordCheck(evm.meshes[i - 1].vertices[-2], vertexGroup.vertices[0]) and
-              vertCoordCheck(evm.meshes[i - 1].vertices[-1], vertexGroup.vertices[1])):
+        elif np.array_equal(evm.meshes[i - 1].vertexData[-2:, :3], vertexGroup.vertexData[:2, :3]):
             pass # Retain previous flip
         else:
             flip = False
         
-        for j in range(2, vertexGroup.numVertex):
-            if vertexGroup.vertices[j].isFace:
-                if flip:
-                    faces.append((j - 2 + faceIndexOffset, j - 1 + faceIndexOffset, j + faceIndexOffset))
-                else:
-                    faces.append((j - 2 + faceIndexOffset, j + faceIndexOffset, j - 1 + faceIndexOffset))
-                
-                mat_id = MaterialHelper.get_unique_id(vertexGroup.flag, vertexGroup.colorMap, vertexGroup.specularMap, vertexGroup.environmentMap)
-
-                if merge_material_slots:
-                    if mat_id not in uniqueMaterialIndices:
-                        uniqueMaterialIndices[mat_id] = len(uniqueMaterialIndices)
-
-                    materialIndices.append(uniqueMaterialIndices[mat_id])
-                else:
-                    materialIndices.append(i)
-
-                flip = not flip
-            else:
-                flip = False
-    
-    # Bounding box adjustment
-    """
-    for i, vert in enumerate(vertices):
-        if vert[0] < mesh.minPos.x:
-            vert = (mesh.minPos.x, vert[1], vert[2])
-        elif vert[0] > mesh.maxPos.x:
-            vert = (mesh.maxPos.x, vert[1], vert[2])
-        if vert[1] < mesh.minPos.y:
-            vert = (vert[0], mesh.minPos.y, vert[2])
-        elif vert[1] > mesh.maxPos.y:
-            vert = (vert[0], mesh.maxPos.y, vert[2])
-        if vert[2] < mesh.minPos.z:
-            vert = (vert[0], vert[1], mesh.minPos.z)
-        elif vert[2] > mesh.maxPos.z:
-            vert = (vert[0], vert[1], mesh.maxPos.z)
-        vertices[i] = vert
-    """
-    #print("\n".join([str(x) for x in normals]))
+        groupFaces, flip = stripFaces(vertexGroup.faceMask(), flip, first=2)
+        faces.append(groupFaces + faceIndexOffset)
+        faceIndexOffset += vertexGroup.numVertex
+        
+        materialIndex = i
+        if merge_material_slots and len(groupFaces):
+            mat_id = MaterialHelper.get_unique_id(vertexGroup.flag, vertexGroup.colorMap, vertexGroup.specularMap, vertexGroup.environmentMap)
+            if mat_id not in uniqueMaterialIndices:
+                uniqueMaterialIndices[mat_id] = len(uniqueMaterialIndices)
+            materialIndex = uniqueMaterialIndices[mat_id]
+        materialIndices.append(np.full(len(groupFaces), materialIndex))
+    
+    vertices = np.concatenate(vertices)
+    normals = np.concatenate(normals)
+    faces = np.concatenate(faces)
+    materialIndices = np.concatenate(materialIndices)
+    uvs, uvs2, uvs3 = [np.concatenate(x) for x in uvs]
     
     objmesh = bpy.data.meshes.new("evmMesh")
     obj = bpy.data.objects.new(objmesh.name, objmesh)
@@ -130,23 +90,34 @@ def construct_mesh(evm: EVM, evmCollection, extract_dir: str, hasHumanBones: boo
     obj.location = Vector((0,0,0))
     obj.scale = Vector((1/16,1/16,1/16))
     evmCollection.objects.link(obj)
-    objmesh.from_pydata(vertices, [], faces, False)
+    buildMesh(objmesh, vertices, faces)
     if bpy.app.version < (4, 1):
         objmesh.use_auto_smooth = True
-    #print("\n".join([str(x.normal) for x in objmesh.loops[:10]]) + "\n")
     objmesh.normals_split_custom_set_from_vertices(normals)
     if bpy.app.version < (4, 1):
         objmesh.calc_normals_split()
     objmesh.update(calc_edges=True)
-    #for poly in objmesh.polygons:
-    #    poly.use_smooth = True
-    #print("\n".join([str(x.vertex_index) + " " + str(x.normal.x) for x in objmesh.loops[:10]]))
     
-    # Bone weights
-    i = 0
+    construct_weights(evm, obj, hasHumanBones)
+    
+    if apply_materials(evm, obj, extract_dir, texLoader, merge_material_slots):
+        objmesh.polygons.foreach_set("material_index", materialIndices.astype(np.int32))
+        setLoopUvs(objmesh, "UVMap1", uvs)
+        if (uvs2 != [0, 1]).any():
+            setLoopUvs(objmesh, "UVMap2", uvs2)
+        if (uvs3 != [0, 1]).any():
+            setLoopUvs(objmesh, "UVMap3", uvs3)
+    
+    return obj
+
+def construct_weights(evm: EVM, obj, hasHumanBones: bool):
     vgroups = obj.vertex_groups
+    vertexIndices = []
+    boneIndices = []
+    weights = []
+    i = 0
     for vertexGroup in evm.meshes:
-        if vertexGroup.weights is None:
+        if vertexGroup.weightData is None:
             i += vertexGroup.numVertex
             continue
         
@@ -157,45 +128,27 @@ def construct_mesh(evm: EVM, evmCollection, extract_dir: str, hasHumanBones: boo
             if not vgroups.get(skinName):
                 vgroups.new(name=skinName)
         
-        for weight_list in vertexGroup.weights:
-            for j in range(vertexGroup.numSkin):
-                weight = weight_list.weights[j]
-                boneIndex = vertexGroup.skinningTable[weight_list.indices[j] >> 2]
-                boneName = getBoneName(boneIndex, evm.header.fingerIndex) if hasHumanBones else f"bone{boneIndex}"
-                vgroups[boneName].add([i], weight / 128, "ADD")
-            i += 1
-    
-    if apply_materials(evm, obj, extract_dir, texLoader, merge_material_slots):
-        bm = bmesh.new()
-        bm.from_mesh(objmesh)
-        uv_layer = bm.loops.layers.uv.new("UVMap1")
-        #uv_layer = bm.loops.layers.uv.verify()
-        #bm.faces.layers.tex.verify()
-        for i, face in enumerate(bm.faces):
-            face.material_index = materialIndices[i]
-            for l in face.loops:
-                #luv = l[uv_layer]
-                ind = l.vert.index
-                #print(l.vert)
-                #print(uvs[ind])
-                l[uv_layer].uv = Vector(uvs[ind])
-        if any(x != (0, 1) for x in uvs2):
-            uv_layer2 = bm.loops.layers.uv.new("UVMap2")
-            for i, face in enumerate(bm.faces):
-                for l in face.loops:
-                    ind = l.vert.index
-                    l[uv_layer2].uv = Vector(uvs2[ind])
-        if any(x != (0, 1) for x in uvs3):
-            uv_layer3 = bm.loops.layers.uv.new("UVMap3")
-            for i, face in enumerate(bm.faces):
-                for l in face.loops:
-                    ind = l.vert.index
-                    l[uv_layer3].uv = Vector(uvs3[ind])
-            
-        bm.to_mesh(objmesh)
-        bm.free()
-    
-    return obj
+        # Weights, then skinning table indices << 2, one column per skin
+        numSkin = vertexGroup.numSkin
+        skinningTable = np.array(vertexGroup.skinningTable)
+        vertexIndices.append(np.repeat(np.arange(i, i + vertexGroup.numVertex), numSkin))
+        boneIndices.append(skinningTable[vertexGroup.weightData[:, 4:4 + numSkin] >> 2].reshape(-1))
+        weights.append(vertexGroup.weightData[:, :numSkin].reshape(-1).astype(np.int64))
+        i += vertexGroup.numVertex
+    
+    if not vertexIndices:
+        return
+    vertexIndices = np.concatenate(vertexIndices)
+    boneIndices = np.concatenate(boneIndices)
+    weights = np.concatenate(weights)
+    
+    # A vertex can name the same bone more than once, its weights add up ("ADD", capped at 1)
+    for boneIndex in np.unique(boneIndices).tolist():
+        boneName = getBoneName(boneIndex, evm.header.fingerIndex) if hasHumanBones else f"bone{boneIndex}"
+        isBone = boneIndices == boneIndex
+        boneVertices, inverse = np.unique(vertexIndices[isBone], return_inverse=True)
+        boneWeights = np.bincount(inverse.reshape(-1), weights[isBone], len(boneVertices))
+        addWeights(vgroups[boneName], boneVertices, np.minimum(boneWeights, 128) / 128, "ADD")
 
 def construct_armature(evm: EVM, evmName: str, hasHumanBones: bool):
     print("Creating armature")
@@ -251,7 +204,7 @@ def apply_materials(evm: EVM, obj, extract_dir: str, texLoader: TextureLoad, mer
 def main(evm_file: str, ctxr_path: str = None, overwrite_existing: bool = False, merge_material_slots: bool = False):
     evm = EVM()
     with open(evm_file, "rb") as f:
-        evm.fromFile(f)
+        evm.fromFile(f, columnar=True)
     
     
     extract_dir, evmname = os.path.split(evm_file)
@@ -277,12 +230,21 @@ def main(evm_file: str, ctxr_path: str = None, overwrite_existing: bool = False,
     hasHumanBones = parentBoneList[:len(expected_parent_bones)] == expected_parent_bones
     
     texLoader = TextureLoad(extract_dir, ctxr_path, overwrite_existing)
-    
-    mesh = construct_mesh(evm, col, extract_dir, hasHumanBones, texLoader, merge_material_slots)
-    amt = construct_armature(evm, collection_name, hasHumanBones)
-    set_partent(amt, mesh)
-    
-    objRotationWrapper(amt)
+    try:
+        # Convert every texture in the background while the mesh is built
+        texLoader.prefetch(
+            mapID
+            for vGroup in evm.meshes
+            for mapID in (vGroup.colorMap, vGroup.specularMap, vGroup.environmentMap)
+        )
+        
+        mesh = construct_mesh(evm, col, extract_dir, hasHumanBones, texLoader, merge_material_slots)
+        amt = construct_armature(evm, collection_name, hasHumanBones)
+        set_partent(amt, mesh)
+        
+        objRotationWrapper(amt)
+    finally:
+        texLoader.close()
     
     print('Importing finished. ;)')
     return {'FINISHED'}
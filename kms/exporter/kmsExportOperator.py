@@ -17,9 +17,9 @@ class ExportMgsKms(bpy.types.Operator, ExportHelper):
     kms_bak: props.EnumProperty(name="Backup KMS", items=BakFileModes, default=kmsConfig['export.kms_bak'])
 
     make_cmdl: props.BoolProperty(name="Generate CMDL supplement", default=kmsConfig['export.make_cmdl'])
-    #big_cmdl: props.BoolProperty(name="Split CMDL faces (DO NOT)", default=False)
     cmdl_path: props.StringProperty(name="CMDL Path", default=kmsConfig['export.cmdl_path'])
     cmdl_bak: props.EnumProperty(name="Backup CMDL", items=BakFileModes, default=kmsConfig['export.cmdl_bak'])
+    optimize_cmdl: props.BoolProperty(name="Optimize CMDL vertex cache", default=kmsConfig['export.optimize_cmdl'])
     
     make_ctxr: props.BoolProperty(name="Repack CTXR textures", default=kmsConfig['export.make_ctxr'])
     ctxr_path: props.StringProperty(name="CTXR Path", default=kmsConfig['export.ctxr_path'])
@@ -67,7 +67,7 @@ class ExportMgsKms(bpy.types.Operator, ExportHelper):
             
             create_bak(cmdl_path, self.cmdl_bak)
             print("Saving", cmdl_path)
-            cmdl_exporter.main(cmdl_path, collection.name, False, False)
+            cmdl_exporter.main(cmdl_path, collection.name, False, self.optimize_cmdl)
             print('CMDL COMPLETE :)')
         
         
@@ -81,6 +81,7 @@ class ExportMgsKms(bpy.types.Operator, ExportHelper):
         if self.make_cmdl:
             col.prop(self, "cmdl_path")
             col.prop(self, "cmdl_bak")
+            col.prop(self, "optimize_cmdl")
         col.prop(self, "make_ctxr")
         if self.make_ctxr:
             col.prop(self, "ctxr_path")
@@ -1,12 +1,13 @@
 from __future__ import annotations
 import bpy
 from ..kms import *
+import numpy as np
 import os
 from mathutils import Vector
 from ...util.util import getBoneName, expected_parent_bones
 from ...util.materials import TextureLoad, MaterialHelper
+from ...util.mesh import stripFaces, buildMesh, setLoopUvs, addWeights
 from .rotationWrapperObj import objRotationWrapper
-import bmesh
 
 DEFAULT_BONE_LENGTH = 100
 
@@ -39,79 +40,48 @@ def set_partent(parent, child):
     parent.select_set(False)
 
 
+def loadUvs(uvData) -> np.ndarray:
+    # (u, v) int16 rows to Blender UV space
+    return (uvData * [1, -1] + [0, 4096]) / 4096
+
 def construct_mesh(mesh: KMSMesh, kmsCollection, meshInd: int, meshPos, extract_dir: str, hasHumanBones: bool, texLoader: TextureLoad, merge_material_slots: bool):
     print(f"Importing mesh {meshInd}, parent {mesh.parentInd}, pos {meshPos}")
-    vertices = []
-    normals = []
-    faces = []
-    materialIndices = []
-    uvs = []
-    uvs2 = []
-    uvs3 = []
-    weights = []
+    vertices = [np.empty((0, 4), np.int16)]
+    normals = [np.empty((0, 3))]
+    faces = [np.empty((0, 3), np.int64)]
+    materialIndices = [np.empty(0, np.int64)]
+    uvs = ([np.empty((0, 2))], [np.empty((0, 2))], [np.empty((0, 2))])
     uniqueMaterialIndices: dict = {}
-    #bpy.context.scene.collection.children.link(bpy.data.collections.new("looseCoords"))
+    faceIndexOffset = 0
     for i, vertexGroup in enumerate(mesh.vertexGroups):
-        faceIndexOffset = len(vertices)
-        vertices += [(vert.x, vert.y, vert.z) for vert in vertexGroup.vertices]
-        #for j, vert in enumerate(vertexGroup.vertices):
-        #    target = bpy.data.objects.new(str(j), None)
-        #    target.empty_display_size = 0.001
-        #    target.location = [vert.x/1000, -vert.z/1000, vert.y/1000]
-        #    bpy.data.collections["looseCoords"].objects.link(target)
-        normals += [(-nrm.x / 4096, -nrm.y / 4096, -nrm.z / 4096) for nrm in vertexGroup.normals]
-        weights += [vert.weight for vert in vertexGroup.vertices]
-        if vertexGroup.uvs:
-            uvs += [(uv.u / 4096, 1 - uv.v / 4096) for uv in vertexGroup.uvs]
-        else:
-            uvs += [(0, 0) for _ in range(len(vertexGroup.vertices))]
-        if vertexGroup.uvs2:
-            uvs2 += [(uv.u / 4096, 1 - uv.v / 4096) for uv in vertexGroup.uvs2]
-        else:
-            uvs2 += [(0, 0) for _ in range(len(vertexGroup.vertices))]
-        if vertexGroup.uvs3:
-            uvs3 += [(uv.u / 4096, 1 - uv.v / 4096) for uv in vertexGroup.uvs3]
-        else:
-            uvs3 += [(0, 0) for _ in range(len(vertexGroup.vertices))]
-        flip = False
-        for j in range(vertexGroup.numVertex):
-            if vertexGroup.normals[j].isFace:
-                if flip:
-                    faces.append((j - 2 + faceIndexOffset, j - 1 + faceIndexOffset, j + faceIndexOffset))
-                else:
-                    faces.append((j - 2 + faceIndexOffset, j + faceIndexOffset, j - 1 + faceIndexOffset))
-
-                mat_id = MaterialHelper.get_unique_id(vertexGroup.flag, vertexGroup.colorMap, vertexGroup.specularMap, vertexGroup.environmentMap)
-
-                if merge_material_slots:
-                    if mat_id not in uniqueMaterialIndices:
-                        uniqueMaterialIndices[mat_id] = len(uniqueMaterialIndices)
-
-                    materialIndices.append(uniqueMaterialIndices[mat_id])
-                else:
-                    materialIndices.append(i)
-
-                flip = not flip
-            else:
-                flip = False
+        vertices.append(vertexGroup.vertexData)
+        normals.append(vertexGroup.normalData[:, :3] / -4096)
+        for channel, uvData in enumerate((vertexGroup.uvData, vertexGroup.uv2Data, vertexGroup.uv3Data)):
+            uvs[channel].append(loadUvs(uvData) if uvData is not None else np.zeros((vertexGroup.numVertex, 2)))
+        
+        groupFaces, _ = stripFaces(vertexGroup.faceMask())
+        faces.append(groupFaces + faceIndexOffset)
+        faceIndexOffset += vertexGroup.numVertex
+        
+        materialIndex = i
+        if merge_material_slots and len(groupFaces):
+            mat_id = MaterialHelper.get_unique_id(vertexGroup.flag, vertexGroup.colorMap, vertexGroup.specularMap, vertexGroup.environmentMap)
+            if mat_id not in uniqueMaterialIndices:
+                uniqueMaterialIndices[mat_id] = len(uniqueMaterialIndices)
+            materialIndex = uniqueMaterialIndices[mat_id]
+        materialIndices.append(np.full(len(groupFaces), materialIndex))
+    
+    vertices = np.concatenate(vertices)
+    normals = np.concatenate(normals)
+    faces = np.concatenate(faces)
+    materialIndices = np.concatenate(materialIndices)
+    uvs, uvs2, uvs3 = [np.concatenate(x) for x in uvs]
     
     # Bounding box adjustment
-    for i, vert in enumerate(vertices):
-        if vert[0] < mesh.minPos.x:
-            vert = (mesh.minPos.x, vert[1], vert[2])
-        elif vert[0] > mesh.maxPos.x:
-            vert = (mesh.maxPos.x, vert[1], vert[2])
-        if vert[1] < mesh.minPos.y:
-            vert = (vert[0], mesh.minPos.y, vert[2])
-        elif vert[1] > mesh.maxPos.y:
-            vert = (vert[0], mesh.maxPos.y, vert[2])
-        if vert[2] < mesh.minPos.z:
-            vert = (vert[0], vert[1], mesh.minPos.z)
-        elif vert[2] > mesh.maxPos.z:
-            vert = (vert[0], vert[1], mesh.maxPos.z)
-        vertices[i] = vert
-    
-    #print("\n".join([str(x[0]) for x in normals[:10]]) + "\n")
+    minPos = np.array(mesh.minPos.xyz(), np.float64)
+    maxPos = np.array(mesh.maxPos.xyz(), np.float64)
+    positions = vertices[:, :3].astype(np.float64)
+    positions = np.where(positions < minPos, minPos, np.where(positions > maxPos, maxPos, positions))
     
     objmesh = bpy.data.meshes.new("kmsMesh%d" % meshInd)
     obj = bpy.data.objects.new(objmesh.name, objmesh)
@@ -119,59 +89,33 @@ def construct_mesh(mesh: KMSMesh, kmsCollection, meshInd: int, meshPos, extract_
     #obj.location = Vector((0,0,0))
     obj['flag'] = mesh.flag
     kmsCollection.objects.link(obj)
-    objmesh.from_pydata(vertices, [], faces, False)
+    buildMesh(objmesh, positions, faces)
     if bpy.app.version < (4, 1):
         objmesh.use_auto_smooth = True
-    #print("\n".join([str(x.normal) for x in objmesh.loops[:10]]) + "\n")
     objmesh.normals_split_custom_set_from_vertices(normals)
     if bpy.app.version < (4, 1):
         objmesh.calc_normals_split()
     objmesh.update(calc_edges=True)
-    #for poly in objmesh.polygons:
-    #    poly.use_smooth = True
-    #print("\n".join([str(x.vertex_index) + " " + str(x.normal.x) for x in objmesh.loops[:10]]))
     
     # Bone weights
+    weights = vertices[:, 3] / 4096
+    vertexIndices = np.arange(len(vertices))
     boneName = getBoneName(meshInd) if hasHumanBones else f"bone{meshInd}"
     obj.vertex_groups.new(name=boneName)
     group = obj.vertex_groups[boneName]
-    for i, x in enumerate(weights):
-        group.add([i], x / 4096, "REPLACE")
+    addWeights(group, vertexIndices, weights)
     if mesh.parent: # 2 bones
         parentBoneName = getBoneName(mesh.parentInd) if hasHumanBones else f"bone{mesh.parentInd}"
         parentGroup = obj.vertex_groups.new(name=parentBoneName)
-        for i, x in enumerate(weights):
-            parentGroup.add([i], 1 - x / 4096, "REPLACE")
+        addWeights(parentGroup, vertexIndices, 1 - weights)
     
     if apply_materials(mesh, obj, extract_dir, texLoader, merge_material_slots):
-        bm = bmesh.new()
-        bm.from_mesh(objmesh)
-        uv_layer = bm.loops.layers.uv.new("UVMap1")
-        #uv_layer = bm.loops.layers.uv.verify()
-        #bm.faces.layers.tex.verify()
-        for i, face in enumerate(bm.faces):
-            face.material_index = materialIndices[i]
-            for l in face.loops:
-                #luv = l[uv_layer]
-                ind = l.vert.index
-                #print(l.vert)
-                #print(uvs[ind])
-                l[uv_layer].uv = Vector(uvs[ind])
-        if any(x != (0, 0) for x in uvs2):
-            uv_layer2 = bm.loops.layers.uv.new("UVMap2")
-            for i, face in enumerate(bm.faces):
-                for l in face.loops:
-                    ind = l.vert.index
-                    l[uv_layer2].uv = Vector(uvs2[ind])
-        if any(x != (0, 0) for x in uvs3):
-            uv_layer3 = bm.loops.layers.uv.new("UVMap3")
-            for i, face in enumerate(bm.faces):
-                for l in face.loops:
-                    ind = l.vert.index
-                    l[uv_layer3].uv = Vector(uvs3[ind])
-            
-        bm.to_mesh(objmesh)
-        bm.free()
+        objmesh.polygons.foreach_set("material_index", materialIndices.astype(np.int32))
+        setLoopUvs(objmesh, "UVMap1", uvs)
+        if uvs2.any():
+            setLoopUvs(objmesh, "UVMap2", uvs2)
+        if uvs3.any():
+            setLoopUvs(objmesh, "UVMap3", uvs3)
     
     return obj
 
@@ -232,7 +176,7 @@ def apply_materials(mesh: KMSMesh, obj, extract_dir: str, texLoader: TextureLoad
 def main(kms_file: str, ctxr_path: str = None, overwrite_existing: bool = False, merge_material_slots: bool = False):
     kms = KMS()
     with open(kms_file, "rb") as f:
-        kms.fromFile(f)
+        kms.fromFile(f, columnar=True)
     
     
     extract_dir, kmsname = os.path.split(kms_file)
@@ -258,30 +202,40 @@ def main(kms_file: str, ctxr_path: str = None, overwrite_existing: bool = False,
     hasHumanBones = parentBoneList[:len(expected_parent_bones)] == expected_parent_bones
     
     texLoader = TextureLoad(extract_dir, ctxr_path, overwrite_existing)
-    
-    bMeshes = []
-    for i, mesh in enumerate(kms.meshes):
-        meshPos = kms.header.pos
-        if i < kms.header.numBones:  # ?? Hair technically has no bone and just uses head pos
-            meshPos += mesh.pos
-        curMesh = mesh
-        while curMesh.parent:
-            curMesh = curMesh.parent
-            meshPos += curMesh.pos
-        bMeshes.append(construct_mesh(mesh,
-                                      col,
-                                      i,
-                                      tuple(meshPos.xyz()),
-                                      extract_dir,
-                                      hasHumanBones,
-                                      texLoader,
-                                      merge_material_slots))
-    
-    amt = construct_armature(kms, collection_name, hasHumanBones)
-    for mesh in bMeshes:
-        set_partent(amt, mesh)
-    
-    objRotationWrapper(amt)
+    try:
+        # Convert every texture in the background while the meshes are built
+        texLoader.prefetch(
+            mapID
+            for mesh in kms.meshes
+            for vGroup in mesh.vertexGroups
+            for mapID in (vGroup.colorMap, vGroup.specularMap, vGroup.environmentMap)
+        )
+        
+        bMeshes = []
+        for i, mesh in enumerate(kms.meshes):
+            meshPos = kms.header.pos
+            if i < kms.header.numBones:  # ?? Hair technically has no bone and just uses head pos
+                meshPos += mesh.pos
+            curMesh = mesh
+            while curMesh.parent:
+                curMesh = curMesh.parent
+                meshPos += curMesh.pos
+            bMeshes.append(construct_mesh(mesh,
+                                          col,
+                                          i,
+                                          tuple(meshPos.xyz()),
+                                          extract_dir,
+                                          hasHumanBones,
+                                          texLoader,
+                                          merge_material_slots))
+        
+        amt = construct_armature(kms, collection_name, hasHumanBones)
+        for mesh in bMeshes:
+            set_partent(amt, mesh)
+        
+        objRotationWrapper(amt)
+    finally:
+        texLoader.close()
     
     print('Importing finished. ;)')
     return {'FINISHED'}
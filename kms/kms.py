@@ -1,6 +1,10 @@
 from __future__ import annotations
-from io import BufferedReader, BufferedWriter
+from functools import partial
+from io import BufferedReader, BufferedWriter, BytesIO
+import mmap
 import struct
+import numpy as np
+from ..util.util import PackedList, alignOffset, packArray, readArray
 
 
 class KMS:
@@ -11,11 +15,11 @@ class KMS:
         self.header = KMSHeader()
         self.meshes = []
     
-    def fromFile(self, file: BufferedReader):
+    def fromFile(self, file: BufferedReader, columnar: bool = False, lazy: bool = False):
         self.header = KMSHeader().fromFile(file)
         
         self.meshes = [
-            KMSMesh().fromFile(file, self.header.isPs2)
+            KMSMesh().fromFile(file, self.header.isPs2, columnar, lazy)
             for _ in range(self.header.numMesh)
         ]
         
@@ -56,87 +60,81 @@ class KMS:
         firstVertexGroupOffset = firstMeshOffset + 0x50 * self.header.numMesh
         firstExDataOffset = firstVertexGroupOffset + 0x60 * sum(mesh.numVertexGroup for mesh in self.meshes)
         
-        
-        file.seek(0)
-        
-        self.header.writeToFile(file)
-        
         curVertexGroupOffset = firstVertexGroupOffset
         for mesh in self.meshes:
             mesh.vertexGroupOffset = curVertexGroupOffset
             curVertexGroupOffset += 0x60 * mesh.numVertexGroup
-            mesh.writeToFile(file)
         
+        # Lay out every stream up front: all vertices, all normals, then UV1/2/3 per mesh, each 0x10 aligned
+        vertexGroups = [vertexGroup for mesh in self.meshes for vertexGroup in mesh.vertexGroups]
+        streams = [] # (offset, size, pack function)
         curExDataOffset = firstExDataOffset
+        for vertexGroup in vertexGroups:
+            vertexGroup.vertexOffset = curExDataOffset
+            streams.append((curExDataOffset, 0x8 * vertexGroup.numVertex, vertexGroup.packVertices))
+            curExDataOffset = alignOffset(curExDataOffset + 0x8 * vertexGroup.numVertex)
+        for vertexGroup in vertexGroups:
+            vertexGroup.normalOffset = curExDataOffset
+            streams.append((curExDataOffset, 0x8 * vertexGroup.numVertex, vertexGroup.packNormals))
+            curExDataOffset = alignOffset(curExDataOffset + 0x8 * vertexGroup.numVertex)
         for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                vertexGroup.vertexOffset = curExDataOffset
-                curExDataOffset += 0x8 * vertexGroup.numVertex
-                if curExDataOffset % 0x10 > 0:
-                    curExDataOffset = (curExDataOffset + 0xf) & ~0xf # fun rounding-up trick
-        for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                vertexGroup.normalOffset = curExDataOffset
-                curExDataOffset += 0x8 * vertexGroup.numVertex
-                if curExDataOffset % 0x10 > 0:
-                    curExDataOffset = (curExDataOffset + 0xf) & ~0xf
-
-        for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                if vertexGroup.uvs != None:
-                    vertexGroup.uvOffset = curExDataOffset
-                    curExDataOffset += 0x4 * vertexGroup.numVertex
-                else:
-                    vertexGroup.uvOffset = 0
-                if curExDataOffset % 0x10 > 0:
-                    curExDataOffset = (curExDataOffset + 0xf) & ~0xf
-            for vertexGroup in mesh.vertexGroups:
-                if vertexGroup.uvs2 != None:
-                    vertexGroup.uv2Offset = curExDataOffset
-                    curExDataOffset += 0x4 * vertexGroup.numVertex
-                else:
-                    vertexGroup.uv2Offset = 0
-                if curExDataOffset % 0x10 > 0:
-                    curExDataOffset = (curExDataOffset + 0xf) & ~0xf
-            for vertexGroup in mesh.vertexGroups:
-                if vertexGroup.uvs3 != None:
-                    vertexGroup.uv3Offset = curExDataOffset
-                    curExDataOffset += 0x4 * vertexGroup.numVertex
-                else:
-                    vertexGroup.uv3Offset = 0
-                if curExDataOffset % 0x10 > 0:
-                    curExDataOffset = (curExDataOffset + 0xf) & ~0xf
-                
-        for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                vertexGroup.writeToFile(file)
+            for channel, offsetName in enumerate(("uvOffset", "uv2Offset", "uv3Offset")):
+                for vertexGroup in mesh.vertexGroups:
+                    if vertexGroup.getUvs(channel) is not None:
+                        setattr(vertexGroup, offsetName, curExDataOffset)
+                        streams.append((curExDataOffset, 0x4 * vertexGroup.numVertex,
+                                        partial(vertexGroup.packUvs, channel=channel)))
+                        curExDataOffset = alignOffset(curExDataOffset + 0x4 * vertexGroup.numVertex)
+                    else:
+                        setattr(vertexGroup, offsetName, 0)
         
+        # Header and records go in front, written back to back
+        records = BytesIO()
+        self.header.writeToFile(records)
         for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                file.seek(vertexGroup.vertexOffset)
-                for vert in vertexGroup.vertices:
-                    vert.writeToFile(file)
-        for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                file.seek(vertexGroup.normalOffset)
-                for normal in vertexGroup.normals:
-                    normal.writeToFile(file)
-        for mesh in self.meshes:
-            for vertexGroup in mesh.vertexGroups:
-                file.seek(vertexGroup.uvOffset)
-                if vertexGroup.uvs != None:
-                    for uv in vertexGroup.uvs:
-                        uv.writeToFile(file)
-            for vertexGroup in mesh.vertexGroups:
-                file.seek(vertexGroup.uv2Offset)
-                if vertexGroup.uvs2 != None:
-                    for uv in vertexGroup.uvs2:
-                        uv.writeToFile(file)
-            for vertexGroup in mesh.vertexGroups:
-                file.seek(vertexGroup.uv3Offset)
-                if vertexGroup.uvs3 != None:
-                    for uv in vertexGroup.uvs3:
-                        uv.writeToFile(file)
+            mesh.writeToFile(records)
+        for vertexGroup in vertexGroups:
+            vertexGroup.writeToFile(records)
+        records = records.getvalue()
+        
+        fileSize = max([len(records)] + [offset + size for offset, size, _ in streams if size > 0])
+        buffer = bytearray(fileSize)
+        buffer[:len(records)] = records
+        for offset, size, pack in streams:
+            if size > 0:
+                pack(buffer, offset)
+        
+        file.seek(0)
+        file.write(buffer)
+
+
+class MappedKMS(KMS):
+    """KMS read from a memory-mapped file. The header, mesh and vertex group records
+    are parsed up front; vertex group geometry is only decoded when first touched.
+    Keep it open (or use it as a context manager) while geometry may still be accessed."""
+    mapped: mmap.mmap | None
+    
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.mapped = None
+        if path is not None:
+            self.open(path)
+    
+    def open(self, path: str):
+        with open(path, "rb") as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.fromFile(self.mapped, lazy=True)
+    
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *_):
+        self.close()
 
 
 class KMSHeader:
@@ -253,7 +251,7 @@ class KMSMesh:
         self.vertexGroups = []
         self.parent = None
     
-    def fromFile(self, file: BufferedReader, isPs2: bool = False):
+    def fromFile(self, file: BufferedReader, isPs2: bool = False, columnar: bool = False, lazy: bool = False):
         self.flag, self.numVertexGroup = struct.unpack("<II", file.read(0x8))
         self.minPos.fromFile(file)
         self.maxPos.fromFile(file)
@@ -269,7 +267,7 @@ class KMSMesh:
         file.seek(self.vertexGroupOffset)
         
         self.vertexGroups = [
-            KMSVertexGroup().fromFile(file, isPs2)
+            KMSVertexGroup().fromFile(file, isPs2, columnar, lazy)
             for _ in range(self.numVertexGroup)
         ]
         
@@ -313,6 +311,19 @@ class KMSVertexGroup:
     uvs2: List[KMSUv] | None
     uvs3: List[KMSUv] | None
     
+    # Columnar storage, only set when read with columnar=True
+    # The lists above then become read-only PackedList views of these
+    vertexData: np.ndarray | None # (numVertex, 4) int16: x, y, z, weight
+    normalData: np.ndarray | None # (numVertex, 4) int16: x, y, z, flags
+    uvData: np.ndarray | None # (numVertex, 2) int16: u, v
+    uv2Data: np.ndarray | None
+    uv3Data: np.ndarray | None
+    
+    source: BufferedReader | None # lazy mode: geometry is read from here on first access
+    
+    geometryAttributes = ("vertices", "normals", "uvs", "uvs2", "uvs3",
+                          "vertexData", "normalData", "uvData", "uv2Data", "uv3Data")
+    
     def __init__(self):
         self.flag = 0
         self.numVertex = 0
@@ -338,8 +349,15 @@ class KMSVertexGroup:
         self.uvs = None
         self.uvs2 = None
         self.uvs3 = None
+        
+        self.vertexData = None
+        self.normalData = None
+        self.uvData = None
+        self.uv2Data = None
+        self.uv3Data = None
+        self.source = None
     
-    def fromFile(self, file: BufferedReader, isPs2: bool = False):
+    def fromFile(self, file: BufferedReader, isPs2: bool = False, columnar: bool = False, lazy: bool = False):
         if isPs2:
           self.flag, self.numVertex, self.colorMap, self.specularMap, \
           self.environmentMap, self.vertexOffset, self.normalOffset, self.uvOffset, \
@@ -353,8 +371,20 @@ class KMSVertexGroup:
           self.uv3Offset = struct.unpack("<17I", file.read(0x44))
           self.pad8 = file.read(0x1C)
         
+        if lazy:
+            # Leave the geometry attributes unset, __getattr__ decodes them when first touched
+            self.source = file
+            for name in KMSVertexGroup.geometryAttributes:
+                delattr(self, name)
+            return self
+        
         curPos = file.tell()
         
+        if columnar:
+            self.readColumnar(file)
+            file.seek(curPos)
+            return self
+        
         file.seek(self.vertexOffset)
         self.vertices = [
             KMSVertex().fromFile(file)
@@ -397,6 +427,75 @@ class KMSVertexGroup:
         file.seek(curPos)
         return self
     
+    def readColumnar(self, file: BufferedReader):
+        # One bulk read per stream instead of one unpack per element
+        file.seek(self.vertexOffset)
+        self.vertexData = readArray(file, "<i2", (self.numVertex, 4))
+        file.seek(self.normalOffset)
+        self.normalData = readArray(file, "<i2", (self.numVertex, 4))
+        
+        uvStreams = []
+        for uvOffset in (self.uvOffset, self.uv2Offset, self.uv3Offset):
+            if uvOffset > 0:
+                file.seek(uvOffset)
+                uvStreams.append(readArray(file, "<i2", (self.numVertex, 2)))
+            else:
+                uvStreams.append(None)
+        self.uvData, self.uv2Data, self.uv3Data = uvStreams
+        
+        self.vertices = PackedList(self.vertexData, KMSVertex.fromRow)
+        self.normals = PackedList(self.normalData, KMSNormal.fromRow)
+        self.uvs, self.uvs2, self.uvs3 = [
+            PackedList(uvData, KMSUv.fromRow) if uvData is not None else None
+            for uvData in uvStreams
+        ]
+    
+    def __getattr__(self, name):
+        # Only called for missing attributes, i.e. the geometry of a lazily read vertex group
+        source = self.__dict__.get("source")
+        if source is None or name not in KMSVertexGroup.geometryAttributes:
+            raise AttributeError(f"'KMSVertexGroup' object has no attribute '{name}'")
+        self.source = None
+        self.readColumnar(source)
+        return getattr(self, name)
+    
+    def faceMask(self) -> np.ndarray:
+        """Per-vertex isFace flags as a bool array"""
+        if self.normalData is not None:
+            return (self.normalData[:, 3].view(np.uint16) & 0x8000) == 0
+        return np.array([normal.isFace for normal in self.normals], dtype=bool)
+    
+    def getUvs(self, channel: int) -> List[KMSUv] | None:
+        return (self.uvs, self.uvs2, self.uvs3)[channel]
+    
+    def packVertices(self, buffer: bytearray, offset: int):
+        if isinstance(self.vertices, PackedList):
+            packArray(buffer, offset, self.vertices.data, "<i2")
+            return
+        struct.pack_into(f"<{4 * len(self.vertices)}h", buffer, offset,
+                         *[x for vert in self.vertices for x in (vert.x, vert.y, vert.z, vert.weight)])
+    
+    def packNormals(self, buffer: bytearray, offset: int):
+        if isinstance(self.normals, PackedList):
+            packArray(buffer, offset, self.normals.data, "<i2")
+            return
+        for normal in self.normals:
+            if normal.isFace:
+                normal.flags &= ~0x8000
+            else:
+                normal.flags |= 0x8000
+        # flags reinterpreted as signed so the whole stream packs as int16
+        struct.pack_into(f"<{4 * len(self.normals)}h", buffer, offset,
+                         *[x for normal in self.normals for x in
+                           (normal.x, normal.y, normal.z, normal.flags - ((normal.flags & 0x8000) << 1))])
+    
+    def packUvs(self, buffer: bytearray, offset: int, channel: int):
+        uvs = self.getUvs(channel)
+        if isinstance(uvs, PackedList):
+            packArray(buffer, offset, uvs.data, "<i2")
+            return
+        struct.pack_into(f"<{2 * len(uvs)}h", buffer, offset, *[x for uv in uvs for x in (uv.u, uv.v)])
+    
     def writeToFile(self, file: BufferedWriter):
         file.write(struct.pack("<17I", self.flag, self.numVertex, self.colorMap, self.pad, \
         self.specularMap, self.pad2, self.environmentMap, self.pad3, \
@@ -423,6 +522,10 @@ class KMSVertex:
         self.x, self.y, self.z, self.weight = struct.unpack("<hhhh", file.read(0x8))
         return self
     
+    @staticmethod
+    def fromRow(row: List[int]) -> KMSVertex:
+        return KMSVertex(*row)
+    
     def writeToFile(self, file: BufferedWriter):
         file.write(struct.pack("<hhhh", self.x, self.y, self.z, self.weight))
 
@@ -448,6 +551,13 @@ class KMSNormal:
         self.isFace = not (self.flags & 0x8000)
         return self
     
+    @staticmethod
+    def fromRow(row: List[int]) -> KMSNormal:
+        normal = KMSNormal(row[0], row[1], row[2])
+        normal.flags = row[3] & 0xffff
+        normal.isFace = not (normal.flags & 0x8000)
+        return normal
+    
     def writeToFile(self, file: BufferedWriter):
         if self.isFace:
             self.flags &= ~0x8000
@@ -469,5 +579,9 @@ class KMSUv:
         self.u, self.v = struct.unpack("<hh", file.read(0x4))
         return self
     
+    @staticmethod
+    def fromRow(row: List[int]) -> KMSUv:
+        return KMSUv(*row)
+    
     def writeToFile(self, file: BufferedWriter):
         file.write(struct.pack("<hh", self.u, self.v))
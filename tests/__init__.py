@@ -0,0 +1,14 @@
+# Tests and benchmarks for the file formats, on synthetic data. From the add-on folder:
+#     python -m pytest
+# The format modules only need numpy. The exporter modules import bpy and mathutils at the top,
+# so outside Blender they get empty stand-ins, with bpy.types for class-level annotations.
+import importlib.util, sys, types
+
+for name in ("bpy", "mathutils"):
+    if importlib.util.find_spec(name) is None:
+        sys.modules[name] = types.ModuleType(name)
+if not hasattr(sys.modules["mathutils"], "Vector"):
+    sys.modules["mathutils"].Vector = tuple
+if not hasattr(sys.modules["bpy"], "types"):
+    sys.modules["bpy"].types = types.ModuleType("bpy.types")
+    sys.modules["bpy"].types.__getattr__ = lambda name: object
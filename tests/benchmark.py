@@ -0,0 +1,119 @@
+"""Reader and writer timings on synthetic files, from the addons folder:
+    python -m sealouse.tests.benchmark [kms] [evm] [nrm0] [cmdl] [tri]
+"""
+from __future__ import annotations
+import contextlib, io, os, sys, tempfile, time, tracemalloc
+from ..cmdl.cmdl import CMDL, packNormals, unpackNormals
+from ..cmdl.exporter import cmdl_exporter
+from ..evm.evm import EVM
+from ..kms.kms import KMS
+from ..tri.tri import psmct32Table, psmt4Table, psmt8Table, readTexPSMCT32, readTexPSMT4, readTexPSMT8
+from .fakebpy import blenderData, makeArmature, makeGridMesh
+from .test_cmdl import encodeNormal, makeNormals, writeCMDL
+from .test_evm import makeEVM, writeEVM
+from .test_kms import makeKMS, writeKMS
+from .test_tri import makeBuffer
+
+
+def timed(function, repeats: int = 3) -> tuple[float, int]:
+    """Best time over repeats, and the peak traced allocation of one more run"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def quiet(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+def report(label: str, seconds: float, peak: int, size: int):
+    print(f"  {label:16}: {seconds * 1000:8.1f} ms, {size / 2**20 / seconds:7.1f} MiB/s, peak {peak / 2**20:6.1f} MiB")
+
+
+def benchmarkKMS():
+    data = writeKMS(makeKMS(0, numMesh=20, maxVertex=4000))
+    print(f"KMS, {len(data) / 2**20:.1f} MiB")
+    for label, columnar in (("parse objects", False), ("parse columnar", True)):
+        seconds, peak = timed(lambda: KMS().fromFile(io.BytesIO(data), columnar=columnar))
+        report(label, seconds, peak, len(data))
+    
+    kms = KMS().fromFile(io.BytesIO(data), columnar=True)
+    seconds, peak = timed(lambda: writeKMS(kms))
+    report("write", seconds, peak, len(data))
+
+def benchmarkEVM():
+    data = writeEVM(makeEVM(0, numMesh=20, maxVertex=4000))
+    print(f"EVM, {len(data) / 2**20:.1f} MiB")
+    for label, columnar in (("parse objects", False), ("parse columnar", True)):
+        seconds, peak = timed(lambda: EVM().fromFile(io.BytesIO(data), columnar=columnar))
+        report(label, seconds, peak, len(data))
+    
+    evm = EVM().fromFile(io.BytesIO(data), columnar=True)
+    seconds, peak = timed(lambda: writeEVM(evm))
+    report("write", seconds, peak, len(data))
+
+def benchmarkNRM0():
+    normals = makeNormals(0, 100000)
+    rows = normals.tolist()
+    packed = packNormals(normals)
+    print(f"NRM0, {len(normals)} normals")
+    for label, function in (("encode scalar", lambda: [encodeNormal(x) for x in rows]),
+                            ("encode", lambda: packNormals(normals)),
+                            ("decode", lambda: unpackNormals(packed))):
+        seconds, peak = timed(function)
+        report(label, seconds, peak, packed.nbytes)
+
+def benchmarkCMDL():
+    # cmdl_exporter.main on a 100k-triangle grid mesh through the bpy stand-ins
+    mesh = makeGridMesh("Mesh0", 250, 200)
+    print(f"CMDL exporter, {len(mesh.data.polygons)} triangles, {len(mesh.data.loops)} loops")
+    with tempfile.TemporaryDirectory() as folder, blenderData({"Model": [makeArmature(), mesh]}):
+        cmdlPath = os.path.join(folder, "model.cmdl")
+        for label, evmMode, optimizeCache in (("export KMS", False, False),
+                                              ("export EVM", True, False),
+                                              ("export KMS+cache", False, True)):
+            seconds, peak = timed(lambda: quiet(cmdl_exporter.main, cmdlPath, "Model", evmMode, optimizeCache), repeats=1)
+            report(label, seconds, peak, os.path.getsize(cmdlPath))
+        
+        with open(cmdlPath, "rb") as f:
+            data = f.read()
+    cmdl = CMDL().fromFile(io.BytesIO(data))
+    for label, function in (("write", lambda: writeCMDL(cmdl)),
+                            ("read", lambda: CMDL().fromFile(io.BytesIO(data)))):
+        seconds, peak = timed(function)
+        report(label, seconds, peak, len(data))
+
+def benchmarkTRI():
+    # One 512x512 texture per format out of a 4 MiB buffer
+    buffer = makeBuffer(0, 1 << 20)
+    rectangle = (8, 0, 0, 512, 512)
+    print("TRI, 512x512")
+    for label, bits, table, read in (("PSMCT32", 32, psmct32Table, readTexPSMCT32),
+                                     ("PSMT8", 8, psmt8Table, readTexPSMT8),
+                                     ("PSMT4", 4, psmt4Table, readTexPSMT4)):
+        size = 512 * 512 * bits // 8
+        seconds, peak = timed(lambda: table.__wrapped__(*rectangle))
+        report(label + " table", seconds, peak, size)
+        seconds, peak = timed(lambda: read(0, *rectangle, buffer))
+        report(label + " read", seconds, peak, size)
+
+BENCHMARKS = {
+    "kms": benchmarkKMS,
+    "evm": benchmarkEVM,
+    "nrm0": benchmarkNRM0,
+    "cmdl": benchmarkCMDL,
+    "tri": benchmarkTRI,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
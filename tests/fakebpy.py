@@ -0,0 +1,98 @@
+# Just enough of bpy's data API for the exporters to run on synthetic meshes outside Blender
+import contextlib, sys
+from types import SimpleNamespace
+import numpy as np
+from ..util.util import getBoneName
+
+
+class PropCollection(list):
+    """Items with per-attribute arrays behind foreach_get"""
+    def __init__(self, items: list, **arrays):
+        super().__init__(items)
+        self.arrays = {name: np.asarray(array) for name, array in arrays.items()}
+    
+    def foreach_get(self, attribute: str, array: np.ndarray):
+        array[:] = self.arrays[attribute].reshape(-1)
+
+class VertexGroups(list):
+    def __contains__(self, name: str) -> bool:
+        return any(group.name == name for group in self)
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return next(group for group in self if group.name == key)
+        return super().__getitem__(key)
+
+class MeshObject(dict):
+    type = "MESH"
+    
+    def __init__(self, name: str, data, vertexGroups: VertexGroups, numMaterials: int, bound_box: list):
+        super().__init__(kmsVertSideChannel=list(range(len(data.vertices))))
+        self.name = name
+        self.data = data
+        self.vertex_groups = vertexGroups
+        self.material_slots = [None] * numMaterials
+        self.bound_box = bound_box
+
+
+def makeGridMesh(name: str, width: int, height: int, numBones: int = 4, uvTile: int = 50, seed: int = 0) -> MeshObject:
+    """width x height quads as 2 * width * height triangles on two materials (bottom and top half).
+    UVs restart every uvTile columns, so the tile edges are UV seams. Each vertex is weighted to two of numBones bones."""
+    rng = np.random.default_rng(seed)
+    numVertex = (width + 1) * (height + 1)
+    y, x = np.divmod(np.arange(numVertex), width + 1)
+    coords = np.column_stack((x, y, rng.random(numVertex))).astype(np.float32)
+    
+    # Two triangles per quad, one loop per corner
+    cy, cx = np.divmod(np.arange(width * height), width)
+    corner = cx + cy * (width + 1)
+    quads = np.column_stack((corner, corner + 1, corner + width + 2, corner + width + 1))
+    triangles = quads[:, [0, 1, 2, 0, 2, 3]].reshape(-1)
+    numFaces = len(triangles) // 3
+    faceColumns = np.repeat(cx, 2)
+    faceRows = np.repeat(cy, 2)
+    
+    normals = rng.normal(size=(numVertex, 3)).astype(np.float32)
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    tileStart = np.repeat(faceColumns // uvTile * uvTile, 3)
+    loopUvs = np.column_stack(((x[triangles] - tileStart) / uvTile, y[triangles] / height)).astype(np.float32)
+    
+    boneNames = [getBoneName(i) for i in range(numBones)]
+    # Fully weighted to the first bone, as KMS meshes are to their own bone, plus a random second one
+    groupIndices = np.column_stack((np.zeros(numVertex, np.int64), rng.integers(1, numBones, numVertex)))
+    groupWeights = np.column_stack((np.ones(numVertex), rng.uniform(0.01, 1.0, numVertex)))
+    vertices = [SimpleNamespace(index=i, groups=[SimpleNamespace(group=int(g), weight=float(w)) for g, w in zip(gs, ws)])
+                for i, (gs, ws) in enumerate(zip(groupIndices.tolist(), groupWeights.tolist()))]
+    
+    data = SimpleNamespace(
+        vertices=PropCollection(vertices, co=coords),
+        loops=PropCollection([None] * len(triangles), vertex_index=triangles, normal=normals[triangles]),
+        polygons=PropCollection([None] * numFaces, loop_start=np.arange(numFaces) * 3, loop_total=np.full(numFaces, 3),
+                                material_index=(faceRows >= height // 2).astype(np.int32)),
+        uv_layers=[SimpleNamespace(uv=PropCollection([None] * len(triangles), vector=loopUvs))],
+    )
+    vertexGroups = VertexGroups(SimpleNamespace(name=name, index=i) for i, name in enumerate(boneNames))
+    boundBox = [tuple(coords.min(axis=0).tolist())] * 6 + [tuple(coords.max(axis=0).tolist())] * 2
+    return MeshObject(name, data, vertexGroups, 2, boundBox)
+
+def makeArmature(numBones: int = 4):
+    bones = [SimpleNamespace(name=getBoneName(i)) for i in range(numBones)]
+    boneList = PropCollection(bones)
+    boneList.get = lambda name: next((bone for bone in bones if bone.name == name), None)
+    return SimpleNamespace(type="ARMATURE", data=SimpleNamespace(bones=boneList))
+
+@contextlib.contextmanager
+def blenderData(collections: dict, version: tuple = (4, 1, 0)):
+    """Point the bpy stand-in's data.collections at collections ({name: objects}) for the duration"""
+    bpy = sys.modules["bpy"]
+    saved = {name: getattr(bpy, name) for name in ("data", "app") if hasattr(bpy, name)}
+    bpy.data = SimpleNamespace(collections={name: SimpleNamespace(all_objects=objects) for name, objects in collections.items()})
+    bpy.app = SimpleNamespace(version=version)
+    try:
+        yield
+    finally:
+        for name in ("data", "app"):
+            if name in saved:
+                setattr(bpy, name, saved[name])
+            else:
+                delattr(bpy, name)
@@ -0,0 +1,39 @@
+import json, os
+from ..util.bulk import bulkConvertCtxr
+from ..util.manifest import MANIFEST_NAME, ExtractManifest
+
+
+def test_failed_source_skipped_until_changed(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("SEALOUSE_CACHE_DIR", str(tmp_path / "cache"))
+    source = tmp_path / "broken.ctxr"
+    source.write_bytes(b"not a ctxr")
+    extract_dir = str(tmp_path / "extract")
+    
+    results = bulkConvertCtxr([str(source)], extract_dir, workers=1)
+    assert results[0].failures
+    with open(os.path.join(extract_dir, MANIFEST_NAME), "rt") as f:
+        entry = list(json.load(f)["sources"].values())[0]
+    assert entry["failures"] == results[0].failures and entry["outputs"] == []
+    
+    # Unchanged: skipped, but still reported
+    capsys.readouterr()
+    assert bulkConvertCtxr([str(source)], extract_dir, workers=1) == []
+    summary = capsys.readouterr().out
+    assert "1 files failed before" in summary and "broken.ctxr" in summary
+    assert "up to date" not in summary
+    
+    # Forced or changed: retried
+    assert len(bulkConvertCtxr([str(source)], extract_dir, workers=1, force=True)) == 1
+    source.write_bytes(b"still not a ctxr")
+    assert len(bulkConvertCtxr([str(source)], extract_dir, workers=1)) == 1
+
+def test_success_clears_failures(tmp_path):
+    source = tmp_path / "a.ctxr"
+    source.write_bytes(b"data")
+    manifest = ExtractManifest(str(tmp_path))
+    manifest.record(str(source), [], failures=["ValueError: bad"])
+    assert manifest.failures(str(source)) == ["ValueError: bad"]
+    assert manifest.isCurrent(str(source)) and not manifest.isStale(str(source))
+    
+    manifest.record(str(source), [])
+    assert manifest.failures(str(source)) == []
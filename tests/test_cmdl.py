@@ -0,0 +1,237 @@
+import contextlib, hashlib, io, random, struct
+from math import isnan
+import numpy as np
+import pytest
+from ..cmdl.cmdl import CMDL, CMDLMesh, CMDLNrmData, CMDLSection, computeAcmr, packNormals, unpackNormals
+
+# sha1 of writeCMDL(makeCMDL(seed)) from the writer that packed each section element by element
+REFERENCE_SHA1 = {
+    1: "c92f69ee01d767ec696e3c5aa513be1d2aad5ca2",
+    3: "75703b84aeae76197d7ba61f50f14d8d35ce0710",
+    4: "68187d62cddea2c7573fa7f0114f6a068e56aeef",
+}
+
+
+def encodeNormal(vert) -> int:
+    """The per-normal NRM0 encoder the vectorized codec replaced"""
+    vert = [0 if isnan(x) else x for x in vert]
+    total = (vert[0]**2 + vert[1]**2 + vert[2]**2)**0.5
+    if total == 0.0:
+        total = 1.0
+        vert[0] = 1.0
+    vert = [x / total for x in vert]
+    nx = int(round(vert[0] * float((1<<10)-1)))
+    ny = int(round(vert[1] * float((1<<10)-1)))
+    nz = int(round(vert[2] * float((1<<9 )-1)))
+    if nx < 0:
+        nx += (1 << 10)
+        nx |= 1 << 10
+    if ny < 0:
+        ny += (1 << 10)
+        ny |= 1 << 10
+    if nz < 0:
+        nz += (1 << 9)
+        nz |= 1 << 9
+    return nx | (ny << 11) | (nz << 22)
+
+def decodeNormal(normal: int) -> tuple[float, float, float]:
+    """The per-normal NRM0 decoder the vectorized codec replaced"""
+    normalX = normal & ((1 << 11) - 1)
+    normalY = (normal >> 11) & ((1 << 11) - 1)
+    normalZ = (normal >> 22)
+    if normalX & (1 << 10):
+        normalX &= ~(1 << 10)
+        normalX -= 1 << 10
+    if normalY & (1 << 10):
+        normalY &= ~(1 << 10)
+        normalY -= 1 << 10
+    if normalZ & (1 << 9):
+        normalZ &= ~(1 << 9)
+        normalZ -= 1 << 9
+    return normalX / ((1<<10)-1), normalY / ((1<<10)-1), normalZ / ((1<<9)-1)
+
+def makeNormals(seed: int, count: int) -> np.ndarray:
+    """Random normals, with NaN components, zero-length normals and values on rounding boundaries"""
+    rng = np.random.default_rng(seed)
+    normals = rng.normal(size=(count, 3))
+    normals[: count // 4] /= np.linalg.norm(normals[: count // 4], axis=1)[:, None]
+    normals[::97] = 0
+    normals[1::101, 1] = np.nan
+    normals[2::103] = np.nan
+    k = rng.integers(-1023, 1023, size=count // 10)
+    normals[-len(k):] = np.stack([(k + 0.5) / 1023, (k + 0.5) / 1023, ((k % 511) + 0.5) / 511], axis=1)
+    return normals
+
+
+def test_encode_matches_scalar():
+    normals = makeNormals(0, 20000)
+    expected = [encodeNormal(x) for x in normals.tolist()]
+    assert packNormals(normals).tolist() == expected
+
+def test_encode_special_cases():
+    assert packNormals([(float("nan"), 0.0, 1.0)]).tolist() == [encodeNormal((0.0, 0.0, 1.0))]
+    assert packNormals([(0.0, 0.0, 0.0), (np.nan, np.nan, np.nan)]).tolist() == [encodeNormal((1.0, 0.0, 0.0))] * 2
+    assert unpackNormals(packNormals([(0.0, 0.0, 0.0)])).tolist() == [[1.0, 0.0, 0.0]]
+
+def test_decode_matches_scalar():
+    # A spread of every bit pattern, including both sign bits of each field
+    packed = np.arange(0, 2**32, 40961, dtype=np.uint64).astype(np.uint32)
+    expected = np.array([decodeNormal(x) for x in packed.tolist()], np.float32)
+    assert np.array_equal(unpackNormals(packed), expected)
+
+def test_section_matches_scalar():
+    normals = makeNormals(1, 5000)
+    section = CMDLNrmData()
+    section.data = normals.tolist()
+    f = io.BytesIO()
+    section.writeToFile(f)
+    assert f.getvalue() == struct.pack(f"<{len(normals)}I", *[encodeNormal(x) for x in normals.tolist()])
+    
+    read = CMDLNrmData().fromFile(io.BytesIO(f.getvalue()), len(f.getvalue()))
+    assert np.array_equal(read.data, np.array([decodeNormal(x) for x in packNormals(normals).tolist()], np.float32))
+
+def makeCMDL(seed: int, numVertex: int = 0) -> CMDL:
+    """Random but deterministic CMDL, with and without TEX1 and the EVM bone sections"""
+    r = random.Random(seed)
+    cmdl = CMDL()
+    numVertex = numVertex or r.randint(1, 500)
+    magics = [b"POS0", b"NRM0", b"TEX0"]
+    magics += [b"TEX1"] if r.random() < 0.5 else []
+    magics += [b"BONI", b"BONW"] if r.random() < 0.5 else []
+    magics += [b"OIDX"]
+    for magic in magics:
+        section = CMDLSection(magic)
+        if magic == b"POS0":
+            section.data.data = [(r.uniform(-100, 100), r.uniform(-100, 100), r.uniform(-100, 100), 1.0) for _ in range(numVertex)]
+        elif magic == b"NRM0":
+            section.data.data = [(r.uniform(-1, 1), r.uniform(-1, 1), r.uniform(-1, 1)) for _ in range(numVertex)]
+        elif magic.startswith(b"TEX"):
+            section.data.data = [(r.uniform(-2, 2), r.uniform(-2, 2)) for _ in range(numVertex)]
+        elif magic == b"BONI":
+            section.data.data = [[r.randint(0, 20) for _ in range(4)] for _ in range(numVertex)]
+        elif magic == b"BONW":
+            section.data.data = [[r.random() for _ in range(4)] for _ in range(numVertex)]
+        else:
+            section.data.data = [r.randint(0, 100000) for _ in range(numVertex)]
+        cmdl.sections.append(section)
+    cmdl.tail.faces = [[r.randrange(numVertex) for _ in range(3)] for _ in range(numVertex)]
+    for _ in range(r.randint(1, 4)):
+        mesh = CMDLMesh()
+        mesh.bones = [r.randint(0, 30) for _ in range(r.randint(0, 5))]
+        mesh.boneCount = len(mesh.bones)
+        mesh.startVertex = r.randrange(numVertex)
+        mesh.minPos.x = r.random()
+        cmdl.tail.meshes.append(mesh)
+    cmdl.tail.numMeshes = len(cmdl.tail.meshes)
+    return cmdl
+
+def writeCMDL(cmdl: CMDL) -> bytes:
+    f = io.BytesIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        cmdl.writeToFile(f)
+    return f.getvalue()
+
+
+@pytest.mark.parametrize("seed", sorted(REFERENCE_SHA1))
+def test_write_matches_reference(seed):
+    assert hashlib.sha1(writeCMDL(makeCMDL(seed))).hexdigest() == REFERENCE_SHA1[seed]
+
+@pytest.mark.parametrize("seed", [3, 4])
+def test_round_trip(seed):
+    data = writeCMDL(makeCMDL(seed))
+    cmdl = CMDL().fromFile(io.BytesIO(data))
+    # Normals are renormalized after decoding, so NRM0 comes back re-encoded and everything else byte for byte
+    expected = bytearray(data)
+    for section in cmdl.sections:
+        if section.magic == b"NRM0":
+            start = section.dataOffset + 0xC
+            words = np.frombuffer(data, "<u4", section.dataSize // 4, start)
+            expected[start:start + section.dataSize] = packNormals(unpackNormals(words)).tobytes()
+    assert writeCMDL(cmdl) == expected
+
+def makeGridCMDL(seed: int, sizes: list = [(12, 8), (9, 9)]) -> CMDL:
+    """One submesh per (width, height) grid of quads, each on its own vertex and face range, faces shuffled"""
+    rng = np.random.default_rng(seed)
+    cmdl = CMDL()
+    faces = []
+    firstVertex = 0
+    for width, height in sizes:
+        corner = (np.arange(width * height) % width + np.arange(width * height) // width * (width + 1))[:, None]
+        quads = corner + [0, 1, width + 2, width + 1]
+        meshFaces = quads[:, [0, 1, 2, 0, 2, 3]].reshape(-1, 3)
+        mesh = CMDLMesh()
+        mesh.startVertex = firstVertex
+        mesh.vertexCount = (width + 1) * (height + 1)
+        mesh.startFace = sum(len(x) for x in faces) * 3
+        mesh.faceCount = len(meshFaces) * 3
+        faces.append(rng.permutation(meshFaces) + firstVertex)
+        firstVertex += mesh.vertexCount
+        cmdl.tail.meshes.append(mesh)
+    cmdl.tail.numMeshes = len(cmdl.tail.meshes)
+    cmdl.tail.faces = np.concatenate(faces)
+    
+    for magic, width in ((b"POS0", 4), (b"NRM0", 3), (b"TEX0", 2)):
+        section = CMDLSection(magic)
+        section.data.data = rng.random((firstVertex, width))
+        cmdl.sections.append(section)
+    oidx = CMDLSection(b"OIDX")
+    oidx.data.data = np.arange(firstVertex)
+    cmdl.sections.append(oidx)
+    return cmdl
+
+def cornerRows(cmdl: CMDL) -> list:
+    """Every section's rows at each corner of each triangle, in face order"""
+    faces = np.asarray(cmdl.tail.faces)
+    rows = [np.asarray(section.data.data).reshape(len(section.data.data), -1)[faces] for section in cmdl.sections]
+    return [tuple(np.concatenate([x[i].reshape(-1) for x in rows]).tolist()) for i in range(len(faces))]
+
+
+def test_acmr():
+    assert computeAcmr(np.array([[0, 1, 2], [2, 1, 3]])) == 2.0
+    # FIFO: 0, 1, 2 are evicted by 3, 4, 5 before they come back
+    assert computeAcmr(np.array([[0, 1, 2], [3, 4, 5], [0, 1, 2]]), cacheSize=3) == 3.0
+    assert computeAcmr(np.array([[0, 1, 2], [3, 4, 5], [0, 1, 2]]), cacheSize=6) == 2.0
+
+def test_vertex_cache_keeps_triangles():
+    cmdl = makeGridCMDL(0)
+    before = cornerRows(cmdl)
+    beforeFaces = np.asarray(cmdl.sections[-1].data.data)[cmdl.tail.faces]
+    
+    acmrBefore, acmrAfter = cmdl.optimizeVertexCache()
+    
+    # Same triangles with the same corner order and per-corner data, only reordered and renumbered
+    assert sorted(cornerRows(cmdl)) == sorted(before)
+    afterFaces = np.asarray(cmdl.sections[-1].data.data)[cmdl.tail.faces]
+    assert sorted(map(tuple, afterFaces.tolist())) == sorted(map(tuple, beforeFaces.tolist()))
+    # A shuffled grid always has room to improve
+    assert acmrAfter < acmrBefore
+    assert acmrAfter == computeAcmr(cmdl.tail.faces)
+
+def test_vertex_cache_ranges_and_first_use_order():
+    cmdl = makeGridCMDL(1)
+    ranges = [(x.startVertex, x.vertexCount, x.startFace, x.faceCount) for x in cmdl.tail.meshes]
+    faceMeshes = [set(np.asarray(cmdl.sections[-1].data.data)[cmdl.tail.faces[x.startFace // 3:(x.startFace + x.faceCount) // 3]].reshape(-1).tolist())
+                  for x in cmdl.tail.meshes]
+    
+    cmdl.optimizeVertexCache()
+    
+    assert [(x.startVertex, x.vertexCount, x.startFace, x.faceCount) for x in cmdl.tail.meshes] == ranges
+    for mesh, oidx in zip(cmdl.tail.meshes, faceMeshes):
+        meshFaces = cmdl.tail.faces[mesh.startFace // 3:(mesh.startFace + mesh.faceCount) // 3]
+        # Each submesh keeps its own triangles, numbered from its first vertex up in the order they are first used
+        assert set(np.asarray(cmdl.sections[-1].data.data)[meshFaces].reshape(-1).tolist()) == oidx
+        _, firstUse = np.unique(meshFaces.reshape(-1), return_index=True)
+        firstUsed = meshFaces.reshape(-1)[np.sort(firstUse)]
+        assert firstUsed.tolist() == list(range(mesh.startVertex, mesh.startVertex + len(firstUsed)))
+
+@pytest.mark.parametrize("first, count", [("startFace", "faceCount"), ("startVertex", "vertexCount")])
+def test_vertex_cache_skips_overlapping_ranges(first, count):
+    cmdl = makeGridCMDL(2)
+    mesh0, mesh1 = cmdl.tail.meshes
+    setattr(mesh1, first, getattr(mesh0, first) + getattr(mesh0, count) - 3)
+    data = writeCMDL(cmdl)
+    
+    acmrBefore, acmrAfter = cmdl.optimizeVertexCache()
+    
+    assert acmrAfter == acmrBefore
+    assert writeCMDL(cmdl) == data
@@ -0,0 +1,111 @@
+import contextlib, io
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from ..cmdl.cmdl import CMDL, packNormals
+from ..cmdl.exporter import cmdl_exporter
+from ..cmdl.exporter.cmdl_exporter import getOidx, weldLoops
+from .fakebpy import blenderData, makeArmature, makeGridMesh
+
+
+class FakeMesh(dict):
+    def __init__(self, name: str, numVertices: int, sideChannel: list):
+        super().__init__(kmsVertSideChannel=sideChannel)
+        self.name = name
+        self.data = SimpleNamespace(vertices=[None] * numVertices)
+
+
+def loopKeys(materials, vertices, normals, uvs) -> list:
+    """weldLoops key columns built the way main builds them"""
+    uvs = np.asarray(uvs, np.float64)
+    return [np.asarray(materials), np.asarray(vertices), packNormals(normals), uvs.astype(np.float16).view(np.uint16)]
+
+def test_weld_splits_on_uv_and_normal():
+    up, side = (0.0, 0.0, 1.0), (1.0, 0.0, 0.0)
+    # Loops 0-2 on vertex 0: same, other UV, other normal. Loops 3-4 on vertex 1, identical
+    keys = loopKeys([0] * 5, [0, 0, 0, 1, 1],
+                    [up, up, side, up, up],
+                    [(0.25, 0.5), (0.75, 0.5), (0.25, 0.5), (0.5, 0.5), (0.5, 0.5)])
+    firstLoops, loopToVertex = weldLoops(keys)
+    
+    assert len(firstLoops) == 4
+    assert len(set(loopToVertex[:3].tolist())) == 3
+    assert loopToVertex[3] == loopToVertex[4]
+
+def test_weld_merges_identical_loops():
+    # Equal after float16 / NRM0 rounding counts as identical
+    keys = loopKeys([1, 1, 1], [7, 7, 7],
+                    [(0.0, 1.0, 0.0), (0.0, 1.0, 1e-6), (0.0, 2.0, 0.0)],
+                    [(0.5, 0.5), (0.5 + 1e-6, 0.5), (0.5, 0.5)])
+    firstLoops, loopToVertex = weldLoops(keys)
+    assert firstLoops.tolist() == [0]
+    assert loopToVertex.tolist() == [0, 0, 0]
+
+def test_weld_indexes_consistent():
+    rng = np.random.default_rng(0)
+    numLoops = 2000
+    keys = loopKeys(rng.integers(0, 3, numLoops), rng.integers(0, 300, numLoops),
+                    rng.choice([-1.0, 0.0, 1.0], (numLoops, 3)), rng.choice([0.0, 0.5], (numLoops, 2)))
+    firstLoops, loopToVertex = weldLoops(keys)
+    columns = np.column_stack(keys).astype(np.int64)
+    
+    # Each loop's vertex is first used by a loop with the same key, and distinct vertices have distinct keys
+    assert np.array_equal(columns[firstLoops[loopToVertex]], columns)
+    assert len(np.unique(columns[firstLoops], axis=0)) == len(firstLoops)
+    assert np.array_equal(np.sort(np.unique(loopToVertex)), np.arange(len(firstLoops)))
+    assert (firstLoops[loopToVertex] <= np.arange(numLoops)).all()
+
+def test_weld_keeps_materials_contiguous():
+    rng = np.random.default_rng(1)
+    numLoops = 1000
+    materials = rng.integers(0, 4, numLoops)
+    keys = loopKeys(materials, rng.integers(0, 100, numLoops), np.ones((numLoops, 3)), np.zeros((numLoops, 2)))
+    firstLoops, loopToVertex = weldLoops(keys)
+    
+    # Vertices come out grouped by material, so each submesh's vertex range holds only its own vertices
+    vertexMaterials = materials[firstLoops]
+    assert np.array_equal(vertexMaterials, np.sort(vertexMaterials))
+    for material in range(4):
+        used = np.unique(loopToVertex[materials == material])
+        assert np.array_equal(used, np.flatnonzero(vertexMaterials == material))
+
+def test_oidx_two_meshes():
+    # Mesh0's vertex 1 is split into two CMDL vertices on a seam, so 5 CMDL vertices come from 4 Blender vertices
+    mesh0 = FakeMesh("Mesh0", 4, [0, 1, 2, 1, 3])
+    mesh1 = FakeMesh("Mesh1", 3, [2, 0, 1])
+    meshVertices = [np.array([0, 1, 1, 2, 3]), np.array([0, 1, 2])]
+    
+    oidx = getOidx([mesh0, mesh1], meshVertices)
+    
+    # Mesh1 starts after Mesh0's 4 Blender vertices, not its 5 CMDL vertices
+    assert oidx.tolist() == [0, 1, 1, 2, 4, 4 + 1, 4 + 2, 4 + 0]
+
+def test_oidx_missing_vertex():
+    mesh = FakeMesh("Mesh0", 2, [0])
+    with pytest.raises(Exception, match="missing from kmsVertSideChannel"):
+        getOidx([mesh], [np.array([0, 1])])
+
+@pytest.mark.parametrize("evmMode", [False, True])
+def test_main_exports_grid(tmp_path, evmMode):
+    mesh = makeGridMesh("Mesh0", 12, 6, uvTile=4)
+    with blenderData({"Model": [makeArmature(), mesh]}), contextlib.redirect_stdout(io.StringIO()):
+        cmdl_exporter.main(str(tmp_path / "model.cmdl"), "Model", evmMode)
+    with open(tmp_path / "model.cmdl", "rb") as f:
+        cmdl = CMDL().fromFile(f)
+    sections = {section.magic: section.data.data for section in cmdl.sections}
+    
+    # Every CMDL vertex sits on the Blender vertex OIDX points back to
+    coords = mesh.data.vertices.arrays["co"]
+    positions = sections[b"POS0"][:, :3] * (16 if evmMode else 1)
+    assert np.allclose(positions, coords[sections[b"OIDX"]])
+    # Every Blender triangle is exported, each corner on its own vertex
+    triangles = mesh.data.loops.arrays["vertex_index"].reshape(-1, 3)
+    assert len(cmdl.tail.faces) == len(triangles)
+    assert np.array_equal(sections[b"OIDX"][cmdl.tail.faces[:, [0, 2, 1]]], triangles)
+    # One submesh per material, bottom half then top half
+    half = len(triangles) * 3 // 2
+    assert [(x.startFace, x.faceCount) for x in cmdl.tail.meshes] == [(0, half), (half, half)]
+    # UV seams and the material boundary split vertices
+    assert len(sections[b"POS0"]) > len(coords)
+    if evmMode:
+        assert np.allclose(sections[b"BONW"].astype(np.float32).sum(axis=1), 1.0, atol=2e-3)
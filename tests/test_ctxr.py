@@ -0,0 +1,119 @@
+import io
+import numpy as np
+import pytest
+from ..ctxr.ctxr import CHUNK_ALIGNMENT, CTXR, CTXRChunk, DDS, fullMipCount, mipChain
+
+
+def makeDDS(width: int, height: int, numMipmaps: int = 1, seed: int = 0) -> DDS:
+    """32-bit BGRA DDS with random data for numMipmaps levels, each a quarter of the one before like the old chain"""
+    dds = CTXR().makeDDSHeader()
+    dds.width, dds.height, dds.numMipmaps = width, height, numMipmaps
+    size = sum((width * height * 4) >> (2 * i) for i in range(numMipmaps))
+    result = DDS()
+    result.header = dds
+    result.data = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+    return result
+
+def oldConvertCTXR(dds: DDS) -> CTXR:
+    """convertCTXR before mip generation: one chunk per existing level, each a quarter of the one before"""
+    ctxr = CTXR()
+    ctxr.header.width = dds.header.width
+    ctxr.header.height = dds.header.height
+    ctxr.header.numMipmaps = dds.header.numMipmaps
+    ctxr.header.unknown4 = [0, 0, 0] + [0xff] * 10 + [0, 0, 0, 0, 0]
+    dataPos = 0
+    dataSize = dds.header.width * dds.header.height * 4
+    for _ in range(dds.header.numMipmaps):
+        chunk = CTXRChunk()
+        chunk.size = dataSize
+        chunk.data = dds.data[dataPos:dataPos + dataSize]
+        ctxr.chunks.append(chunk)
+        dataPos += dataSize
+        dataSize //= 4
+    return ctxr
+
+def writeCTXR(ctxr: CTXR) -> bytes:
+    f = io.BytesIO()
+    ctxr.writeToFile(f)
+    return f.getvalue()
+
+def writeDDS(dds: DDS) -> bytes:
+    f = io.BytesIO()
+    dds.writeToFile(f)
+    return f.getvalue()
+
+
+# Chunk directory and padding
+
+def test_directory_and_mips():
+    # 6x5 gets 3 levels of 120, 24 and 4 bytes, none a multiple of the chunk alignment
+    data = writeCTXR(makeDDS(6, 5).convertCTXR())
+    ctxr = CTXR().fromFile(io.BytesIO(data))
+    assert [size for _, size in ctxr.directory] == [120, 24, 4]
+    assert all((offset - 4) % CHUNK_ALIGNMENT == 0 for offset, _ in ctxr.directory)
+    assert len(data) % CHUNK_ALIGNMENT == 0
+    
+    directory = CTXR().readDirectory(io.BytesIO(data))
+    assert directory.directory == ctxr.directory
+    for level, chunk in enumerate(ctxr.chunks):
+        assert directory.readMip(io.BytesIO(data), level) == chunk.data
+
+def test_stream_dds_matches_convert():
+    data = writeCTXR(makeDDS(24, 10).convertCTXR())
+    out = io.BytesIO()
+    size = CTXR.streamDDS(io.BytesIO(data), out)
+    assert out.getvalue() == writeDDS(CTXR().fromFile(io.BytesIO(data)).convertDDS())
+    assert size == len(out.getvalue())
+
+def test_write_round_trip():
+    for dds in (makeDDS(6, 5), makeDDS(64, 32, 4), makeDDS(1, 1)):
+        data = writeCTXR(dds.convertCTXR())
+        assert writeCTXR(CTXR().fromFile(io.BytesIO(data))) == data
+
+def test_truncated():
+    data = writeCTXR(makeDDS(6, 5).convertCTXR())
+    with pytest.raises(EOFError):
+        CTXR().readDirectory(io.BytesIO(data[:0x80 + 0xa0]))
+    ctxr = CTXR().readDirectory(io.BytesIO(data))
+    with pytest.raises(EOFError):
+        ctxr.readMip(io.BytesIO(data[:ctxr.directory[2][0] + 2]), 2)
+
+
+# Mip generation
+
+@pytest.mark.parametrize("size, count", [((1, 1), 1), ((256, 256), 9), ((256, 64), 9), ((64, 256), 9),
+                                         ((6, 5), 3), ((5, 1), 3), ((1, 7), 3), ((640, 480), 10)])
+def test_full_mip_count(size, count):
+    assert fullMipCount(*size) == count
+    levels = mipChain(np.zeros(size[::-1] + (4,), np.uint8), count)
+    # Down to 1x1, halving (rounding down) each side that is still larger than 1
+    assert levels[-1].shape == (1, 1, 4)
+    for before, after in zip(levels, levels[1:]):
+        assert after.shape[:2] == (max(before.shape[0] // 2, 1), max(before.shape[1] // 2, 1))
+
+def test_box_filter_2x2():
+    # BGRA: blue 0 in one corner and 255 in the others, green and alpha likewise, red all 128
+    image = np.array([[[0, 0, 128, 0], [255, 255, 128, 255]],
+                      [[255, 255, 128, 255], [255, 255, 128, 255]]], np.uint8)
+    assert mipChain(image, 2)[1].tolist() == [[[191, 191, 128, 191]]]
+    # In linear light 0.75 is sRGB 225, 128 stays 128; alpha is averaged as is
+    assert mipChain(image, 2, gammaCorrect=True)[1].tolist() == [[[225, 225, 128, 191]]]
+
+def test_generated_chain():
+    dds = makeDDS(6, 5)
+    ctxr = dds.convertCTXR()
+    assert ctxr.header.numMipmaps == 3
+    assert ctxr.chunks[0].data == dds.data
+    assert [chunk.size for chunk in ctxr.chunks] == [len(chunk.data) for chunk in ctxr.chunks] == [120, 24, 4]
+
+def test_existing_chain_unchanged():
+    dds = makeDDS(64, 32, 4)
+    assert writeCTXR(dds.convertCTXR()) == writeCTXR(oldConvertCTXR(dds))
+    assert writeCTXR(dds.convertCTXR(gammaCorrect=True)) == writeCTXR(oldConvertCTXR(dds))
+
+def test_no_generation_matches_old():
+    dds = makeDDS(32, 16)
+    assert writeCTXR(dds.convertCTXR(generateMips=False)) == writeCTXR(oldConvertCTXR(dds))
+    # Only 32-bit BGRA gets a generated chain
+    dds.header.pixelFormat.bitMasks = [0xff, 0xff00, 0xff0000, 0xff000000]
+    assert writeCTXR(dds.convertCTXR()) == writeCTXR(oldConvertCTXR(dds))
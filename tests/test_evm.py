@@ -0,0 +1,83 @@
+import contextlib, hashlib, io, random
+import pytest
+from ..evm.evm import EVM, EVMBone, EVMMesh, EVMVertex, EVMNormal, EVMUv, EVMWeights
+
+# sha1 of writeEVM(makeEVM(seed)) from the per-record writer that seeked between streams
+REFERENCE_SHA1 = {
+    1: "febaabc99a32178c86470b6bf00934a4f5b9cce4",
+    2: "3bcf734ae00afa9b5a508ce58dde52cdf14ccc9c",
+    3: "50dd2af26b1662f6c5a68dea28d51033eee56073",
+}
+
+
+def makeEVM(seed: int, numMesh: int = 5, maxVertex: int = 300) -> EVM:
+    """Random but deterministic EVM, with missing, all-zero and filled UV channels and some meshes without weights"""
+    r = random.Random(seed)
+    evm = EVM()
+    evm.header.strcode = r.getrandbits(24)
+    evm.bones = [EVMBone() for _ in range(r.randint(0, 4))]
+    for _ in range(numMesh):
+        mesh = EVMMesh()
+        mesh.flag = r.randint(0, 0xff)
+        mesh.colorMap = r.getrandbits(24)
+        numVertex = r.randint(3, maxVertex)
+        mesh.vertices = [EVMVertex(r.randint(-3000, 3000), r.randint(-3000, 3000), r.randint(-3000, 3000), r.random() < 0.8)
+                         for _ in range(numVertex)]
+        mesh.normals = [EVMNormal(r.randint(-4096, 4096), r.randint(-4096, 4096), r.randint(-4096, 4096))
+                        for _ in range(numVertex)]
+        for name in ("uvs", "uvs2", "uvs3"):
+            kind = r.random()
+            if kind < 0.3:
+                uvs = None
+            elif kind < 0.45:
+                uvs = [EVMUv(0, 0) for _ in range(numVertex)]
+            else:
+                uvs = [EVMUv(r.randint(-5000, 5000), r.randint(-5000, 5000)) for _ in range(numVertex)]
+            setattr(mesh, name, uvs)
+        if r.random() < 0.7:
+            mesh.numSkin = r.randint(1, 4)
+            mesh.skinningTable = [r.randint(0, 20) for _ in range(8)]
+            mesh.weights = [EVMWeights([r.randint(0, 128) for _ in range(4)], [r.randint(0, 7) << 2 for _ in range(4)])
+                            for _ in range(numVertex)]
+        evm.meshes.append(mesh)
+    return evm
+
+def writeEVM(evm: EVM) -> bytes:
+    f = io.BytesIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        evm.writeToFile(f)
+    return f.getvalue()
+
+def geometry(evm: EVM) -> list:
+    rows = []
+    for mesh in evm.meshes:
+        for items in (mesh.vertices, mesh.normals, mesh.uvs, mesh.uvs2, mesh.uvs3, mesh.weights):
+            rows.append(None if items is None else [vars(x) for x in items])
+    return rows
+
+
+@pytest.mark.parametrize("seed", sorted(REFERENCE_SHA1))
+def test_write_matches_reference(seed):
+    assert hashlib.sha1(writeEVM(makeEVM(seed))).hexdigest() == REFERENCE_SHA1[seed]
+
+def test_columnar_matches_objects():
+    data = writeEVM(makeEVM(1))
+    objects = EVM().fromFile(io.BytesIO(data))
+    columnar = EVM().fromFile(io.BytesIO(data), columnar=True)
+    assert geometry(columnar) == geometry(objects)
+    for mesh in columnar.meshes:
+        assert mesh.faceMask().tolist() == [x.isFace for x in mesh.vertices]
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_round_trip(columnar):
+    data = writeEVM(makeEVM(2))
+    assert writeEVM(EVM().fromFile(io.BytesIO(data), columnar=columnar)) == data
+
+def test_write_leaves_mesh_unchanged():
+    evm = makeEVM(3)
+    before = geometry(evm)
+    flags = [[x.flags for x in mesh.vertices] for mesh in evm.meshes]
+    data = writeEVM(evm)
+    assert geometry(evm) == before
+    assert [[x.flags for x in mesh.vertices] for mesh in evm.meshes] == flags
+    assert writeEVM(evm) == data
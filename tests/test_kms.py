@@ -0,0 +1,95 @@
+import contextlib, hashlib, io, os, random
+import pytest
+from ..kms.kms import KMS, KMSMesh, KMSVertexGroup, KMSVertex, KMSNormal, KMSUv, KMSVector3, MappedKMS
+
+# sha1 of writeKMS(makeKMS(seed)) from the per-element writer that wrote each record with its own struct.pack
+REFERENCE_SHA1 = {
+    1: "6210edd0e1e2441dd3154b490bd9a38c142c0235",
+    2: "80ce2ab616f65b1f9e5c7971b383a3da8a087462",
+    3: "4fd3a5a629c2e379aaf02223df5ef951fbcf915b",
+}
+
+
+def makeKMS(seed: int, numMesh: int = 4, maxVertex: int = 300) -> KMS:
+    """Random but deterministic KMS, some vertex groups without some UV channels"""
+    r = random.Random(seed)
+    kms = KMS()
+    kms.header.kmsType = 2
+    kms.header.strcode = r.getrandbits(24)
+    kms.header.minPos = KMSVector3(-100, -200, -300)
+    kms.header.maxPos = KMSVector3(100, 200, 300)
+    for i in range(numMesh):
+        mesh = KMSMesh()
+        mesh.flag = r.randint(0, 3)
+        mesh.pos = KMSVector3(r.uniform(-50, 50), r.uniform(-50, 50), r.uniform(-50, 50))
+        mesh.parentInd = r.randint(-1, i - 1)
+        for _ in range(r.randint(1, 4)):
+            vertexGroup = KMSVertexGroup()
+            vertexGroup.flag = r.randint(0, 0xff)
+            vertexGroup.colorMap = r.getrandbits(24)
+            numVertex = r.randint(1, maxVertex)
+            vertexGroup.vertices = [KMSVertex(r.randint(-0x8000, 0x7fff), r.randint(-0x8000, 0x7fff),
+                                              r.randint(-0x8000, 0x7fff), r.randint(0, 4096))
+                                    for _ in range(numVertex)]
+            vertexGroup.normals = [KMSNormal(r.randint(-4096, 4096), r.randint(-4096, 4096), r.randint(-4096, 4096),
+                                             j >= 2 and r.random() < 0.9)
+                                   for j in range(numVertex)]
+            vertexGroup.uvs, vertexGroup.uvs2, vertexGroup.uvs3 = [
+                [KMSUv(r.randint(-0x8000, 0x7fff), r.randint(-0x8000, 0x7fff)) for _ in range(numVertex)]
+                if r.random() < chance else None
+                for chance in (0.9, 0.4, 0.2)
+            ]
+            mesh.vertexGroups.append(vertexGroup)
+        kms.meshes.append(mesh)
+    return kms
+
+def writeKMS(kms: KMS) -> bytes:
+    f = io.BytesIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        kms.writeToFile(f)
+    return f.getvalue()
+
+def geometry(kms: KMS) -> list:
+    """Every decoded vertex, normal and UV, as plain values"""
+    rows = []
+    for mesh in kms.meshes:
+        for vertexGroup in mesh.vertexGroups:
+            rows.append([vars(x) for x in vertexGroup.vertices])
+            rows.append([vars(x) for x in vertexGroup.normals])
+            for uvs in (vertexGroup.uvs, vertexGroup.uvs2, vertexGroup.uvs3):
+                rows.append(None if uvs is None else [vars(x) for x in uvs])
+    return rows
+
+
+def test_columnar_matches_objects(tmp_path):
+    data = writeKMS(makeKMS(1))
+    objects = KMS().fromFile(io.BytesIO(data))
+    columnar = KMS().fromFile(io.BytesIO(data), columnar=True)
+    assert geometry(columnar) == geometry(objects)
+    
+    for mesh in columnar.meshes:
+        for vertexGroup in mesh.vertexGroups:
+            assert vertexGroup.faceMask().tolist() == [x.isFace for x in vertexGroup.normals]
+    
+    path = os.path.join(tmp_path, "test.kms")
+    with open(path, "wb") as f:
+        f.write(data)
+    with MappedKMS(path) as mapped:
+        assert geometry(mapped) == geometry(objects)
+
+@pytest.mark.parametrize("seed", sorted(REFERENCE_SHA1))
+def test_write_matches_reference(seed):
+    assert hashlib.sha1(writeKMS(makeKMS(seed))).hexdigest() == REFERENCE_SHA1[seed]
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_round_trip(columnar):
+    data = writeKMS(makeKMS(2))
+    assert writeKMS(KMS().fromFile(io.BytesIO(data), columnar=columnar)) == data
+
+def test_round_trip_mapped(tmp_path):
+    data = writeKMS(makeKMS(3))
+    path = os.path.join(tmp_path, "test.kms")
+    with open(path, "wb") as f:
+        f.write(data)
+    with MappedKMS(path) as mapped:
+        assert writeKMS(mapped) == data
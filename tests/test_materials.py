@@ -0,0 +1,27 @@
+import contextlib, io, json, os
+from ..util.manifest import MANIFEST_NAME
+from ..util.materials import TextureLoad
+from .test_texcache import writeCTXR
+
+
+def test_manifest_saved_once_on_close(tmp_path, monkeypatch):
+    monkeypatch.setenv("SEALOUSE_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "ctxr").mkdir()
+    for fill, name in enumerate(("a", "b", "c")):
+        writeCTXR(tmp_path / "ctxr" / f"{name}.ctxr", fill)
+    extract_dir = tmp_path / "extract"
+    extract_dir.mkdir()
+    
+    texLoader = TextureLoad(str(extract_dir), str(tmp_path / "ctxr"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name in ("a", "b", "c"):
+            assert texLoader.extract_texture(f"{name}.dds") == str(extract_dir / f"{name}.dds")
+    assert not os.path.exists(extract_dir / MANIFEST_NAME)
+    
+    texLoader.close()
+    with open(extract_dir / MANIFEST_NAME, "rt") as f:
+        assert len(json.load(f)["sources"]) == 3
+    # Nothing new to record, nothing rewritten
+    os.remove(extract_dir / MANIFEST_NAME)
+    texLoader.close()
+    assert not os.path.exists(extract_dir / MANIFEST_NAME)
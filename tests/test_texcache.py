@@ -0,0 +1,72 @@
+import io, os, stat
+import pytest
+from ..ctxr.ctxr import CTXR, CTXRChunk
+from ..util.texcache import cachePath, extractDDS, isIntact
+
+
+def writeCTXR(path, fill: int):
+    ctxr = CTXR()
+    ctxr.header.width = ctxr.header.height = 4
+    chunk = CTXRChunk()
+    chunk.data = bytes([fill]) * 64
+    chunk.size = len(chunk.data)
+    ctxr.chunks = [chunk]
+    f = io.BytesIO()
+    ctxr.writeToFile(f)
+    path.write_bytes(f.getvalue())
+
+
+def test_cache_hit_and_tampered_entry(tmp_path, monkeypatch):
+    monkeypatch.setenv("SEALOUSE_CACHE_DIR", str(tmp_path / "cache"))
+    source = tmp_path / "a.ctxr"
+    writeCTXR(source, 7)
+    
+    hash, size = extractDDS(str(source), str(tmp_path / "a.dds"))
+    entry = cachePath(hash)
+    assert size > 0 and isIntact(entry)
+    assert not os.path.exists(entry + ".mtime")
+    assert extractDDS(str(source), str(tmp_path / "b.dds")) == (hash, 0)
+    
+    # Written through a link anyway (the read-only flag removed): no longer intact, so the next extraction converts it again
+    expected = (tmp_path / "a.dds").read_bytes()
+    os.chmod(tmp_path / "b.dds", 0o644)
+    with open(tmp_path / "b.dds", "r+b") as f:
+        f.seek(0x80)
+        f.write(b"\xff")
+    assert not isIntact(entry)
+    assert extractDDS(str(source), str(tmp_path / "c.dds")) == (hash, size)
+    assert isIntact(entry) and (tmp_path / "c.dds").read_bytes() == expected
+
+def test_outputs_are_read_only(tmp_path, monkeypatch):
+    monkeypatch.setenv("SEALOUSE_CACHE_DIR", str(tmp_path / "cache"))
+    source = tmp_path / "a.ctxr"
+    writeCTXR(source, 7)
+    hash, _ = extractDDS(str(source), str(tmp_path / "a.dds"))
+    extractDDS(str(source), str(tmp_path / "b.dds"))
+    
+    for path in (cachePath(hash), tmp_path / "a.dds", tmp_path / "b.dds"):
+        assert stat.S_IMODE(os.stat(path).st_mode) & 0o222 == 0
+    
+    # Re-extracting over an output replaces it, leaving the read-only flag on the entry
+    extractDDS(str(source), str(tmp_path / "a.dds"))
+    assert stat.S_IMODE(os.stat(cachePath(hash)).st_mode) & 0o222 == 0
+
+@pytest.mark.skipif(hasattr(os, "geteuid") and os.geteuid() == 0, reason="root ignores read-only files")
+def test_editing_output_leaves_other_folders_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setenv("SEALOUSE_CACHE_DIR", str(tmp_path / "cache"))
+    source = tmp_path / "a.ctxr"
+    writeCTXR(source, 7)
+    (tmp_path / "modelA").mkdir()
+    (tmp_path / "modelB").mkdir()
+    extractDDS(str(source), str(tmp_path / "modelA" / "a.dds"))
+    extractDDS(str(source), str(tmp_path / "modelB" / "a.dds"))
+    expected = (tmp_path / "modelB" / "a.dds").read_bytes()
+    
+    # Saving in place is refused, so an editor has to write a new file and replace the link
+    with pytest.raises(PermissionError):
+        open(tmp_path / "modelA" / "a.dds", "r+b")
+    edited = tmp_path / "modelA" / "a.dds.new"
+    edited.write_bytes(expected[:0x80] + b"\xff" * (len(expected) - 0x80))
+    os.replace(edited, tmp_path / "modelA" / "a.dds")
+    
+    assert (tmp_path / "modelB" / "a.dds").read_bytes() == expected
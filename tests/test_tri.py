@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from ..tri.tri import (blockArrangement32, wordArrangement32, block8Layout, columnWord8Layout, columnByte8Layout,
+                       block4Layout, columnWord4Layout, columnByte4Layout, psmct32Table, psmt8Table, psmt4Table,
+                       readTexPSMCT32, readTexPSMT8, readTexPSMT4, unswizzleClut)
+
+# (dbw, dsax, dsay, rrw, rrh), including rectangles that cross page boundaries and start off the origin
+RECTANGLES = [(2, 0, 0, 64, 64), (4, 0, 0, 128, 128), (4, 8, 16, 256, 32), (2, 3, 5, 17, 130), (6, 100, 70, 200, 90)]
+
+
+def psmct32Address(dbw: int, x: int, y: int) -> int:
+    """Word address of one pixel, as the per-pixel PSMCT32 loop computed it"""
+    page = x // 64 + (y // 32) * dbw
+    block = blockArrangement32[(x % 64) // 8 + ((y % 32) // 8) * 8]
+    column = (y % 8) // 2
+    word = wordArrangement32[x % 8 + (y % 2) * 8]
+    return page * 2048 + block * 64 + column * 16 + word
+
+def psmt8Address(dbw: int, x: int, y: int) -> int:
+    """Byte address of one texel, as the per-texel PSMT8 loop computed it"""
+    dbw >>= 1
+    page = x // 128 + (y // 64) * dbw
+    px, py = x % 128, y % 64
+    block = block8Layout[px // 16 + (py // 16) * 8]
+    bx, by = px % 16, py % 16
+    column = by // 4
+    cy = by % 4
+    word = columnWord8Layout[column & 1][bx + cy * 16]
+    byt = columnByte8Layout[bx // 8 + (cy // 2) * 2]
+    return (page * 2048 + block * 64 + column * 16 + word) * 4 + byt
+
+def psmt4Address(dbw: int, x: int, y: int) -> int:
+    """Nibble address of one texel, as the per-texel PSMT4 loop computed it"""
+    dbw >>= 1
+    page = x // 128 + (y // 128) * dbw
+    px, py = x % 128, y % 128
+    block = block4Layout[px // 32 + (py // 16) * 4]
+    bx, by = px % 32, py % 16
+    column = by // 4
+    cy = by % 4
+    word = columnWord4Layout[column & 1][bx + cy * 32]
+    byt = columnByte4Layout[bx // 8 + (cy // 2) * 4]
+    return (page * 2048 + block * 64 + column * 16 + word) * 8 + byt
+
+def scalarTable(address, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int) -> list:
+    return [address(dbw, x, y) for y in range(dsay, dsay + rrh) for x in range(dsax, dsax + rrw)]
+
+def makeBuffer(seed: int, words: int = 64 * 2048) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 2**32, words, dtype=np.uint64).astype(np.uint32)
+
+
+@pytest.mark.parametrize("rectangle", RECTANGLES)
+def test_tables_match_scalar(rectangle):
+    assert psmct32Table(*rectangle).tolist() == scalarTable(psmct32Address, *rectangle)
+    assert psmt8Table(*rectangle).tolist() == scalarTable(psmt8Address, *rectangle)
+    assert psmt4Table(*rectangle).tolist() == scalarTable(psmt4Address, *rectangle)
+
+def test_tables_are_read_only():
+    with pytest.raises(ValueError):
+        psmct32Table(*RECTANGLES[0])[0] = 0
+
+@pytest.mark.parametrize("dbp", [0, 32])
+def test_read_matches_scalar(dbp):
+    buffer = makeBuffer(dbp)
+    byteBuffer = buffer.view(np.uint8)
+    dbw, dsax, dsay, rrw, rrh = RECTANGLES[2]
+    
+    pixels = readTexPSMCT32(dbp, dbw, dsax, dsay, rrw, rrh, buffer)
+    assert pixels.tolist() == [int(buffer[(dbp << 6) + a]) for a in scalarTable(psmct32Address, dbw, dsax, dsay, rrw, rrh)]
+    
+    pixels = readTexPSMT8(dbp, dbw, dsax, dsay, rrw, rrh, buffer)
+    assert pixels.tolist() == [int(byteBuffer[(dbp << 8) + a]) for a in scalarTable(psmt8Address, dbw, dsax, dsay, rrw, rrh)]
+    
+    pixels = readTexPSMT4(dbp, dbw, dsax, dsay, rrw, rrh, buffer)
+    nibbles = [(dbp << 9) + a for a in scalarTable(psmt4Address, dbw, dsax, dsay, rrw, rrh)]
+    assert pixels.tolist() == [(int(byteBuffer[a >> 1]) >> 4) if a & 1 else (int(byteBuffer[a >> 1]) & 0xf) for a in nibbles]
+
+def test_read_out_of_range_is_zero():
+    buffer = makeBuffer(1, 2048)
+    pixels = readTexPSMCT32(0, 2, 0, 0, 64, 64, buffer)
+    inRange = psmct32Table(2, 0, 0, 64, 64) < len(buffer)
+    assert not pixels[~inRange].any()
+    assert np.array_equal(pixels[inRange], buffer[psmct32Table(2, 0, 0, 64, 64)[inRange]])
+
+def test_unswizzle_clut_matches_scalar():
+    buffer = makeBuffer(2, 256)
+    expected = buffer.tolist()
+    for i in range(1, 30, 4):
+        j = i + 1
+        for k in range(8):
+            expected[i*8+k], expected[j*8+k] = expected[j*8+k], expected[i*8+k]
+    assert unswizzleClut(buffer).tolist() == expected
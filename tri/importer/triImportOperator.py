@@ -1,7 +1,7 @@
 import bpy
 from bpy_extras.io_utils import ImportHelper
 import os
-from ..tri import TRI
+from ...util.bulk import bulkDumpTri
 from ...config import triConfig
 
 
@@ -15,6 +15,7 @@ class ImportMgsTri(bpy.types.Operator, ImportHelper):
 
     #reset_blend: bpy.props.BoolProperty(name="Reset Blender Scene on Import", default=True)
     bulk_import: bpy.props.BoolProperty(name="Bulk extract from folder", default=triConfig['import.bulk'])
+    overwrite_existing: bpy.props.BoolProperty(name="Re-extract unchanged files", default=triConfig['import.overwrite'])
 
     def execute(self, context):
         if self.bulk_import:
@@ -26,13 +27,9 @@ class ImportMgsTri(bpy.types.Operator, ImportHelper):
         extract_dir = os.path.join(base_dir, "sealouse_extract")
         os.makedirs(extract_dir, exist_ok=True)
         
-        for file in filelist:
-            filepath = os.path.join(base_dir, file)
-            print("\n\nLoading", filepath)
-            
-            myTri = TRI()
-            with open(filepath, "rb") as f:
-                myTri.fromFile(f)
-            myTri.dumpTextures(extract_dir)
+        results = bulkDumpTri([os.path.join(base_dir, x) for x in filelist], extract_dir, force=self.overwrite_existing)
+        failures = sum(len(x.failures) for x in results)
+        if failures:
+            self.report({'WARNING'}, f"{failures} textures failed to dump, see the console for details")
         return {'FINISHED'}
 
@@ -1,16 +1,24 @@
 from __future__ import annotations
+from functools import lru_cache
 from io import BufferedReader, BufferedWriter
 import struct
 from os import path
+import numpy as np
 
 
 class TRI:
     header: TRIHeader
     textures: List[TRIEntry]
     
+    # Unswizzled GS memory, built on first dump and shared by every texture
+    textureBuffer: np.ndarray | None
+    clutBuffer: np.ndarray | None
+    
     def __init__(self):
         self.header = TRIHeader()
         self.textures = []
+        self.textureBuffer = None
+        self.clutBuffer = None
     
     def fromFile(self, file: BufferedReader):
         self.header.fromFile(file)
@@ -19,12 +27,19 @@ class TRI:
             TRIEntry().fromFile(file)
             for _ in range(self.header.numTexture)
         ]
+        self.textureBuffer = None
+        self.clutBuffer = None
         
         return self
     
+    def initBuffers(self):
+        if self.textureBuffer is None:
+            self.textureBuffer = self.header.initPartialProcessBuffer(0)
+            self.clutBuffer = self.header.initPartialProcessBuffer(1)
+        return self.textureBuffer, self.clutBuffer
+    
     def dumpTextures(self, extract_dir: str):
-        textureBuffer = self.header.initPartialProcessBuffer(0)
-        clutBuffer = self.header.initPartialProcessBuffer(1)
+        textureBuffer, clutBuffer = self.initBuffers()
         
         for entry in self.textures:
             print("Dumping texture %d.tga" % entry.texID)
@@ -33,8 +48,7 @@ class TRI:
     def dumpById(self, extract_dir: str, texID: int):
         for entry in self.textures:
             if entry.texID == texID:
-                textureBuffer = self.header.initPartialProcessBuffer(0)
-                clutBuffer = self.header.initPartialProcessBuffer(1)
+                textureBuffer, clutBuffer = self.initBuffers()
                 return entry.dumpTexture(extract_dir, textureBuffer, clutBuffer)
         return None
     
@@ -42,8 +56,7 @@ class TRI:
         if not (0 <= index < len(self.textures)):
             return None
         
-        textureBuffer = self.header.initPartialProcessBuffer(0)
-        clutBuffer = self.header.initPartialProcessBuffer(1)
+        textureBuffer, clutBuffer = self.initBuffers()
         
         return self.textures[index].dumpTexture(extract_dir, textureBuffer, clutBuffer)
         
@@ -63,10 +76,8 @@ class TRI:
         for tex in self.textures:
             tex.writeToFile(file)
         file.seek(self.header.imageOffset)
-        for i in range(64 * self.header.height):
-            file.write(struct.pack("<I", self.header.rawData[i]))
-        for i in range(64 * self.header.clutHeight):
-            file.write(struct.pack("<I", self.header.rawClut[i]))
+        file.write(np.asarray(self.header.rawData[:64 * self.header.height], "<u4").tobytes())
+        file.write(np.asarray(self.header.rawClut[:64 * self.header.clutHeight], "<u4").tobytes())
 
 
 class TRIHeader:
@@ -79,8 +90,8 @@ class TRIHeader:
     imageOffset: int
     clutOffset: int
     
-    rawData: List[int] # technically uints/bytes/whatever
-    rawClut: List[int]
+    rawData: np.ndarray | List[int] # uint32 words, 64 per row
+    rawClut: np.ndarray | List[int]
     
     def __init__(self):
         self.pad = 0
@@ -101,27 +112,18 @@ class TRIHeader:
         
         returnPos = file.tell()
         file.seek(self.imageOffset)
-        self.rawData = list(struct.unpack(f"<{64 * self.height}I", file.read(4 * 64 * self.height)))
+        # util imports this module, so read without readArray
+        self.rawData = np.frombuffer(file.read(4 * 64 * self.height), "<u4")
         
         file.seek(self.clutOffset)
-        self.rawClut = list(struct.unpack(f"<{64 * self.clutHeight}I", file.read(4 * 64 * self.clutHeight)))
+        self.rawClut = np.frombuffer(file.read(4 * 64 * self.clutHeight), "<u4")
         
         file.seek(returnPos)
         
         return self
     
-    blockArrangement: List[int] = [
-     0,  1,  4,  5, 16, 17, 20, 21,
-     2,  3,  6,  7, 18, 19, 22, 23,
-     8,  9, 12, 13, 24, 25, 28, 29,
-    10, 11, 14, 15, 26, 27, 30, 31]
-    
-    wordArrangement: List[int] = [
-     0,  1,  4,  5,  8,  9, 12, 13,
-     2,  3,  6,  7, 10, 11, 14, 15]
-    
     # https://github.com/Jayveer/MGS-Master-Collection-Noesis/blob/master/ps2/PS2Textures.cpp
-    def initPartialProcessBuffer(self, mode):
+    def initPartialProcessBuffer(self, mode) -> np.ndarray:
         if mode == 0:
             rawData = self.rawData
             height = self.height
@@ -129,30 +131,12 @@ class TRIHeader:
             rawData = self.rawClut
             height = self.clutHeight
         
+        # The raw area is a 64 word wide PSMCT32 image, one page per 32 rows
         resSize = (height // 32) * 2048
         if height % 32 != 0: # ceil()
             resSize += 2048
-        result = [0] * resSize
-        i = 0
-        for y in range(height):
-            for x in range(64):
-                page = y // 32
-                
-                px = x
-                py = y % 32
-                blockX = px // 8
-                blockY = py // 8
-                block = TRIHeader.blockArrangement[blockX + blockY * 8]
-                
-                bx = x % 8
-                by = y % 8
-                column = by // 2
-                cx = bx
-                cy = y % 2
-                word = TRIHeader.wordArrangement[cx + cy * 8]
-                
-                result[page * 2048 + block * 64 + column * 16 + word] = rawData[i]
-                i += 1
+        result = np.zeros(resSize, np.uint32)
+        result[psmct32Table(1, 0, 0, 64, height)] = rawData
         
         return result
     
@@ -244,7 +228,7 @@ class TRIEntry:
         = struct.unpack("<6f2I", file.read(0x20))
         return self
     
-    def dumpTexture(self, extract_dir: str, textureBuffer: List[int], clutBuffer: List[int]):
+    def dumpTexture(self, extract_dir: str, textureBuffer: np.ndarray, clutBuffer: np.ndarray):
         imageWidth = int(2**self.registerInfo2.tw)
         imageHeight = int(2**self.registerInfo2.th)
         
@@ -277,7 +261,7 @@ class TRIEntry:
             if self.registerInfo2.psm == 0x13:
                 specialClutBuffer = unswizzleClut(specialClutBuffer)
             
-            if all([x == 0 for x in specialClutBuffer]):
+            if not specialClutBuffer.any():
                 print("Invalid clut! CBP: %d, CSAX: %d, CSAY: %d" % (self.registerInfo2.cbp, self.registerInfo2.csax, self.registerInfo2.csay))
                 specialClutBuffer = readTexPSMCT32(0, 1, 0, 0, clutWidth, clutHeight, clutBuffer)
             # else:
@@ -295,12 +279,13 @@ class TRIEntry:
         
         out_path = path.join(extract_dir, "%d.tga" % self.texID)
         
+        header = b"\x00\x00\x02\x00" # magic
+        header += b"\x00\x00\x00\x00\x00\x00\x00\x00" # padding
+        header += struct.pack("<hh", texWidth, texHeight)
+        header += b"\x20\x20" # also magic I guess
+        
         with open(out_path, "wb") as f:
-            f.write(b"\x00\x00\x02\x00") # magic
-            f.write(b"\x00\x00\x00\x00\x00\x00\x00\x00") # padding
-            f.write(struct.pack("<hh", texWidth, texHeight))
-            f.write(b"\x20\x20") # also magic I guess
-            f.write(pixels)
+            f.write(header + pixels)
         
         return out_path
         
@@ -439,42 +424,32 @@ columnByte8Layout = [
     0, 2,
     1, 3]
 
-def readTexPSMT8(dbp: int, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int, halfBuffer: List[int]):
+@lru_cache(maxsize=64)
+def psmt8Table(dbw: int, dsax: int, dsay: int, rrw: int, rrh: int) -> np.ndarray:
+    """Byte address of every texel of a PSMT8 rectangle, row by row, relative to its base pointer"""
     dbw >>= 1
-    dbp <<= 6
-    
-    i = 0
-    outBuf = [[0, 0, 0, 0] for x in range(rrh * rrw)] 
-    for y in range(dsay, dsay + rrh):
-        for x in range(dsax, dsax + rrw):
-            pageX = x // 128
-            pageY = y // 64
-            page = pageX + pageY * dbw
-            
-            px = x % 128
-            py = y % 64
-            blockX = px // 16
-            blockY = py // 16
-            block = block8Layout[blockX + blockY * 8]
-            
-            bx = px % 16
-            by = py % 16
-            column = by // 4
-            
-            cx = bx
-            cy = by % 4
-            word = columnWord8Layout[column & 1][cx + cy * 16]
-            
-            dx = cx // 8
-            dy = cy // 2
-            byt = columnByte8Layout[dx + dy * 2]
-            
-            val = halfBuffer[dbp + page * 2048 + block * 64 + column * 16 + word]
-            myByte = struct.unpack("BBBB", struct.pack("<I", val))[byt]
-            outBuf[i // 4][i % 4] = myByte
-            i += 1
-    
-    return [struct.unpack("<I", struct.pack("BBBB", x[0], x[1], x[2], x[3]))[0] for x in outBuf]
+    y, x = np.mgrid[dsay:dsay + rrh, dsax:dsax + rrw]
+    page = x // 128 + (y // 64) * dbw
+    
+    px = x % 128
+    py = y % 64
+    block = np.take(block8Layout, px // 16 + (py // 16) * 8)
+    
+    bx = px % 16
+    by = py % 16
+    column = by // 4
+    cy = by % 4
+    word = np.asarray(columnWord8Layout)[column & 1, bx + cy * 16]
+    byt = np.take(columnByte8Layout, bx // 8 + (cy // 2) * 2)
+    
+    table = ((page * 2048 + block * 64 + column * 16 + word) * 4 + byt).reshape(-1)
+    table.flags.writeable = False
+    return table
+
+def readTexPSMT8(dbp: int, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int, halfBuffer: np.ndarray) -> np.ndarray:
+    """Palette index of every texel, one byte each"""
+    byteBuffer = halfBuffer.astype("<u4", copy=False).view(np.uint8)
+    return byteBuffer[(dbp << 8) + psmt8Table(dbw, dsax, dsay, rrw, rrh)]
 
 
 block4Layout = [
@@ -502,84 +477,53 @@ columnByte4Layout = [
     0, 2, 4, 6,
     1, 3, 5, 7]
 
-def splitToFourBits(val):
-    myBytes = struct.unpack("BBBB", struct.pack("<I", val))
-    result = []
-    for byt in list(myBytes):
-        result += byt & 0xf
-        result += (byt & 0xf0) >> 4
-    return result
+@lru_cache(maxsize=64)
+def psmt4Table(dbw: int, dsax: int, dsay: int, rrw: int, rrh: int) -> np.ndarray:
+    """Nibble address of every texel of a PSMT4 rectangle, row by row, relative to its base pointer"""
+    dbw >>= 1
+    y, x = np.mgrid[dsay:dsay + rrh, dsax:dsax + rrw]
+    page = x // 128 + (y // 128) * dbw
+    
+    px = x % 128
+    py = y % 128
+    block = np.take(block4Layout, px // 32 + (py // 16) * 4)
+    
+    bx = px % 32
+    by = py % 16
+    column = by // 4
+    cy = by % 4
+    word = np.asarray(columnWord4Layout)[column & 1, bx + cy * 32]
+    byt = np.take(columnByte4Layout, bx // 8 + (cy // 2) * 4)
+    
+    table = ((page * 2048 + block * 64 + column * 16 + word) * 8 + byt).reshape(-1)
+    table.flags.writeable = False
+    return table
 
-def mergeFromFourBits(vals):
-    pass
+def readTexPSMT4(dbp: int, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int, halfBuffer: np.ndarray) -> np.ndarray:
+    """Palette index of every texel, one byte each"""
+    byteBuffer = halfBuffer.astype("<u4", copy=False).view(np.uint8)
+    nibbles = (dbp << 9) + psmt4Table(dbw, dsax, dsay, rrw, rrh)
+    # odd nibbles are the high half of their byte
+    return (byteBuffer[nibbles >> 1] >> ((nibbles & 1) << 2).astype(np.uint8)) & 0xf
 
-def readTexPSMT4(dbp: int, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int, halfBuffer: List[int]):
-    dbw >>= 1
-    dbp <<= 6
-    # TODO: make this the 4-bit version
-    i = 0
-    outBuf = [([0] * 8) for x in range(rrh * rrw)]
-    for y in range(dsay, dsay + rrh):
-        for x in range(dsax, dsax + rrw):
-            pageX = x // 128
-            pageY = y // 128
-            page = pageX + pageY * dbw
-            
-            px = x % 128
-            py = y % 128
-            blockX = px // 32
-            blockY = py // 16
-            block = block4Layout[blockX + blockY * 4]
-            
-            bx = px % 32
-            by = py % 16
-            column = by // 4
-            
-            cx = bx
-            cy = by % 4
-            word = columnWord4Layout[column & 1][cx + cy * 32]
-            
-            dx = cx // 8
-            dy = cy // 2
-            byt = columnByte4Layout[dx + dy * 4]
-            
-            val = halfBuffer[dbp + page * 2048 + block * 64 + column * 16 + word]
-            myByte = struct.unpack("BBBB", struct.pack("<I", val))[byt // 2]
-            if byt % 2 == 1: # hi halfbyte
-                outBuf[i // 8][i % 8] |= (myByte & 0xf0) >> 4
-            else: # lo halfbyte
-                outBuf[i // 8][i % 8] |= myByte & 0xf
-            
-            i += 1
-    
-    trueOutBuf = []
-    for x in outBuf:
-        myRearrange = struct.unpack("<II", struct.pack("BBBBBBBB", x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7]))
-        trueOutBuf.append(myRearrange[0])
-        trueOutBuf.append(myRearrange[1])
-    
-    return trueOutBuf
 
+def paletteTable(clut: np.ndarray) -> np.ndarray:
+    """Convert RGBA CLUT words to BGRA rows, with alpha rescaled from 0x80 to 0xff"""
+    rgba = clut.astype("<u4", copy=False).view(np.uint8).reshape(-1, 4)
+    table = rgba[:, [2, 1, 0, 3]].astype(np.uint16)
+    table[:, 3] = table[:, 3] * 0xff // 0x80
+    return table.astype(np.uint8)
 
-def paintPixels(clut: List[int], pixels: List[int], width: int, height: int) -> bytes:
-    sizeOut = width * height * 4
-    texture = b""
-    # print("There are %d pixels" % len(pixels))
-    clut = [list(struct.unpack("BBBB", struct.pack("<I", x))) for x in clut] # RGBA
-    pixels = [list(struct.unpack("BBBB", struct.pack("<I", x))) for x in pixels]
-    for y in range(height):
-        for x in range(width):
-            pixelPos = x + y * width
-            pixel = pixels[pixelPos // 4][pixelPos % 4]
-            clutPix = clut[pixel]
-            #print(clutPix[2], clutPix[1], clutPix[0], ((clutPix[3] * 255) // 0x80))
-            if clutPix[3] > 0x80:  # Invalid clut
-                print("paintPixels: Invalid alpha in palette at %d, %d" % (x, y))
-                return None
-            texture += struct.pack("BBBB", \
-            clutPix[2], clutPix[1], clutPix[0], (clutPix[3] * 0xff) // 0x80)
-            #clutPix[2], clutPix[1], clutPix[0], clutPix[3])
-    return texture
+def paintPixels(clut: np.ndarray, pixels: np.ndarray, width: int, height: int) -> bytes:
+    pixels = pixels[:width * height]
+    
+    invalid = clut.astype("<u4", copy=False).view(np.uint8)[3::4] > 0x80
+    if invalid[pixels].any(): # Invalid clut
+        pixelPos = int(np.argmax(invalid[pixels]))
+        print("paintPixels: Invalid alpha in palette at %d, %d" % (pixelPos % width, pixelPos // width))
+        return None
+    
+    return paletteTable(clut)[pixels].tobytes()
 
 
 blockArrangement32: List[int] = [
@@ -592,43 +536,32 @@ wordArrangement32: List[int] = [
  0,  1,  4,  5,  8,  9, 12, 13,
  2,  3,  6,  7, 10, 11, 14, 15]
 
-def readTexPSMCT32(dbp: int, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int, halfBuffer: List[int]):
-    dbp <<= 6
-    result = [0] * (rrh * rrw)
-    i = 0
-    for y in range(dsay, dsay + rrh):
-        for x in range(dsax, dsax + rrw):
-            pageX = x // 64
-            pageY = y // 32
-            page = pageX + pageY * dbw
-            
-            px = x % 64
-            py = y % 32
-            blockX = px // 8
-            blockY = py // 8
-            block = blockArrangement32[blockX + blockY * 8]
-            
-            bx = x % 8
-            by = y % 8
-            column = by // 2
-            cx = bx
-            cy = y % 2
-            word = wordArrangement32[cx + cy * 8]
-            
-            try:
-                result[i] = halfBuffer[dbp + page * 2048 + block * 64 + column * 16 + word]
-            except:
-                print(len(result), len(halfBuffer), i, dbp + page * 2048 + block * 64 + column * 16 + word)
-            i += 1
+@lru_cache(maxsize=64)
+def psmct32Table(dbw: int, dsax: int, dsay: int, rrw: int, rrh: int) -> np.ndarray:
+    """Word address of every pixel of a PSMCT32 rectangle, row by row, relative to its base pointer"""
+    y, x = np.mgrid[dsay:dsay + rrh, dsax:dsax + rrw]
+    page = x // 64 + (y // 32) * dbw
+    block = np.take(blockArrangement32, (x % 64) // 8 + ((y % 32) // 8) * 8)
+    column = (y % 8) // 2
+    word = np.take(wordArrangement32, x % 8 + (y % 2) * 8)
+    table = (page * 2048 + block * 64 + column * 16 + word).reshape(-1)
+    table.flags.writeable = False
+    return table
+
+def readTexPSMCT32(dbp: int, dbw: int, dsax: int, dsay: int, rrw: int, rrh: int, halfBuffer: np.ndarray):
+    addresses = (dbp << 6) + psmct32Table(dbw, dsax, dsay, rrw, rrh)
+    inRange = addresses < len(halfBuffer)
+    if not inRange.all():
+        print(rrh * rrw, len(halfBuffer), int(np.argmin(inRange)), int(addresses[np.argmin(inRange)]))
+    result = np.zeros(rrh * rrw, np.uint32)
+    result[inRange] = halfBuffer[addresses[inRange]]
     
     return result
 
-def unswizzleClut(buffer: List[int]):
-    for i in range(1, 30, 4):
-        # swap sections of 32 bytes (8 ints)
-        j = i + 1
-        for k in range(8):
-            buffer[i*8+k], buffer[j*8+k] = buffer[j*8+k], buffer[i*8+k]
-    return buffer
+def unswizzleClut(buffer: np.ndarray):
+    # swap sections of 32 bytes (8 ints): 1 and 2, 5 and 6, ... 29 and 30
+    sections = np.arange(32)
+    sections[1:30:4], sections[2:31:4] = sections[2:31:4].copy(), sections[1:30:4].copy()
+    return buffer.reshape(32, 8)[sections].reshape(-1)
 
 tri_lookup_path = path.join(path.dirname(__file__), "trimapping.txt")
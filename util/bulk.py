@@ -0,0 +1,229 @@
+"""Bulk texture extraction over a process pool.
+
+Usable from the import operators and from plain Python, e.g. from the addons folder:
+    python -m sealouse.util.bulk tri path/to/tri/us
+    python -m sealouse.util.bulk ctxr path/to/textures/flatlist/_win
+"""
+from __future__ import annotations
+import argparse, contextlib, io, os, struct, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ..tri.tri import TRI
+from .util import replaceExt
+from .manifest import ExtractManifest, fileHash
+from .texcache import extractDDS, removeFile
+
+TRI_TEXTURES_PER_JOB = 32
+
+
+class BulkResult:
+    """Outputs, failures and timing for one source file, sent back from a worker"""
+    source: str
+    outputs: list[str]
+    failures: list[str]
+    warnings: list[str]
+    seconds: float
+    size: int # bytes written
+    hash: str | None # source hash, for the manifest
+    
+    def __init__(self, source: str):
+        self.source = source
+        self.outputs = []
+        self.failures = []
+        self.warnings = []
+        self.seconds = 0.0
+        self.size = 0
+        self.hash = None
+    
+    def merge(self, other: BulkResult):
+        self.outputs += other.outputs
+        self.failures += other.failures
+        self.warnings += other.warnings
+        self.seconds += other.seconds
+        self.size += other.size
+        self.hash = self.hash or other.hash
+        return self
+
+
+def runJob(worker, job: tuple) -> BulkResult:
+    start = time.perf_counter()
+    try:
+        result = worker(*job)
+    except Exception as e:
+        result = BulkResult(job[0])
+        result.failures.append(f"{type(e).__name__}: {e}")
+    result.seconds = time.perf_counter() - start
+    return result
+
+def runJobs(worker, jobs: list[tuple], workers: int | None = None) -> list[BulkResult]:
+    """Run worker(*job) for every job and merge the results per source file.
+    Jobs go to a process pool unless there is only one job or one worker."""
+    results = {job[0]: BulkResult(job[0]) for job in jobs}
+    # Report progress about 20 times on long runs
+    progressStep = len(jobs) // 20 if len(jobs) >= 200 else 0
+    
+    if workers == 1 or len(jobs) <= 1:
+        for i, job in enumerate(jobs):
+            results[job[0]].merge(runJob(worker, job))
+            printProgress(i + 1, len(jobs), progressStep)
+        return list(results.values())
+    
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(runJob, worker, job): job for job in jobs}
+        for i, future in enumerate(as_completed(futures)):
+            source = futures[future][0]
+            try:
+                results[source].merge(future.result())
+            except Exception as e: # worker process died
+                results[source].failures.append(f"{type(e).__name__}: {e}")
+            printProgress(i + 1, len(jobs), progressStep)
+    
+    return list(results.values())
+
+def printProgress(done: int, total: int, step: int):
+    if step and (done % step == 0 or done == total):
+        print(f"  {done}/{total} jobs done")
+
+def printSummary(label: str, results: list[BulkResult], seconds: float, perFile: bool = True, skipped: int = 0,
+                 failedBefore: dict[str, list[str]] = None):
+    """failedBefore: skipped sources that failed last time and haven't changed since, with those failures"""
+    failedBefore = failedBefore or {}
+    outputs = sum(len(x.outputs) for x in results)
+    failures = sum(len(x.failures) for x in results)
+    size = sum(x.size for x in results)
+    print(f"\n{label}: {len(results)} files, {outputs} outputs, {failures} failures in {seconds:.2f}s")
+    if skipped - len(failedBefore):
+        print(f"  {skipped - len(failedBefore)} files up to date, skipped")
+    if failedBefore:
+        print(f"  {len(failedBefore)} files failed before and haven't changed since, skipped")
+        for source in sorted(failedBefore):
+            print(f"  {os.path.basename(source)}")
+            for failure in failedBefore[source]:
+                print("    FAILED before:", failure)
+    if size and seconds > 0:
+        print(f"  {len(results) / seconds:.1f} files/s, {size / seconds / (1 << 20):.1f} MiB/s written")
+    
+    for result in sorted(results, key=lambda x: x.source):
+        if perFile:
+            print(f"  {os.path.basename(result.source)}: {len(result.outputs)} outputs, {result.seconds:.2f}s")
+        elif not (result.failures or result.warnings):
+            continue
+        else:
+            print(f"  {os.path.basename(result.source)}")
+        for warning in result.warnings:
+            print("    warning:", warning)
+        for failure in result.failures:
+            print("    FAILED:", failure)
+
+def findFiles(paths: list[str], ext: str) -> list[str]:
+    """Expand folders into the files inside them with the given extension"""
+    filepaths = []
+    for p in paths:
+        if os.path.isdir(p):
+            filepaths += sorted(os.path.join(p, x) for x in os.listdir(p) if x.lower().endswith(ext))
+        else:
+            filepaths.append(p)
+    return filepaths
+
+def runExtraction(label: str, worker, makeJobs, filepaths: list[str], extract_dir: str,
+                  workers: int | None, force: bool, perFile: bool) -> list[BulkResult]:
+    """Extract the sources that changed since the last run, then record them in the manifest.
+    Failed sources are recorded too, so they aren't retried until they change (or force is set)."""
+    os.makedirs(extract_dir, exist_ok=True)
+    start = time.perf_counter()
+    
+    manifest = ExtractManifest(extract_dir)
+    todo = filepaths if force else [x for x in filepaths if not manifest.isCurrent(x)]
+    failedBefore = {x: manifest.failures(x) for x in set(filepaths) - set(todo) if manifest.failures(x)}
+    
+    results = runJobs(worker, makeJobs(todo, extract_dir), workers)
+    for result in results:
+        if os.path.exists(result.source):
+            manifest.record(result.source, result.outputs, result.hash, result.failures)
+    manifest.save()
+    
+    printSummary(label, results, time.perf_counter() - start, perFile, len(filepaths) - len(todo), failedBefore)
+    return results
+
+
+def dumpTriJob(filepath: str, extract_dir: str, first: int, count: int) -> BulkResult:
+    result = BulkResult(filepath)
+    
+    tri = TRI()
+    with open(filepath, "rb") as f:
+        tri.fromFile(f)
+    textureBuffer, clutBuffer = tri.initBuffers()
+    if first == 0:
+        result.hash = fileHash(filepath)
+    
+    for entry in tri.textures[first:first + count]:
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            out_path = entry.dumpTexture(extract_dir, textureBuffer, clutBuffer)
+        messages = [x for x in log.getvalue().splitlines() if not x.startswith("Dumping")]
+        if out_path is None:
+            result.failures.append(f"{entry.texID}: " + "; ".join(messages))
+        else:
+            result.outputs.append(out_path)
+            result.warnings += [f"{entry.texID}: {x}" for x in messages]
+    
+    return result
+
+def triJobs(filepaths: list[str], extract_dir: str) -> list[tuple]:
+    """Split each TRI into jobs of TRI_TEXTURES_PER_JOB textures"""
+    jobs = []
+    for filepath in filepaths:
+        with open(filepath, "rb") as f:
+            header = f.read(0x20)
+        # TRIHeader.numTexture; a broken header still gets one job so the failure is reported
+        numTexture = struct.unpack_from("<i", header, 0x10)[0] if len(header) == 0x20 else 0
+        for first in range(0, max(numTexture, 1), TRI_TEXTURES_PER_JOB):
+            jobs.append((filepath, extract_dir, first, TRI_TEXTURES_PER_JOB))
+    return jobs
+
+def bulkDumpTri(filepaths: list[str], extract_dir: str, workers: int | None = None, force: bool = False) -> list[BulkResult]:
+    return runExtraction("TRI dump", dumpTriJob, triJobs, filepaths, extract_dir, workers, force, perFile=True)
+
+
+def convertCtxrJob(filepath: str, extract_dir: str) -> BulkResult:
+    result = BulkResult(filepath)
+    outpath = os.path.join(extract_dir, replaceExt(os.path.basename(filepath), "dds"))
+    
+    try:
+        result.hash, result.size = extractDDS(filepath, outpath)
+    except Exception:
+        # Don't leave a half-written DDS behind
+        if os.path.exists(outpath):
+            removeFile(outpath)
+        raise
+    result.outputs.append(outpath)
+    
+    return result
+
+def ctxrJobs(filepaths: list[str], extract_dir: str) -> list[tuple]:
+    return [(x, extract_dir) for x in filepaths]
+
+def bulkConvertCtxr(filepaths: list[str], extract_dir: str, workers: int | None = None, force: bool = False) -> list[BulkResult]:
+    return runExtraction("CTXR to DDS", convertCtxrJob, ctxrJobs, filepaths, extract_dir, workers, force, perFile=False)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Bulk extract MGS2 textures into sealouse_extract")
+    parser.add_argument("format", choices=["tri", "ctxr"])
+    parser.add_argument("paths", nargs="+", help="files or folders to extract")
+    parser.add_argument("-o", "--out", help="output folder (default: sealouse_extract next to the first file)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("-f", "--force", action="store_true", help="re-extract files the manifest says are up to date")
+    args = parser.parse_args(argv)
+    
+    filepaths = findFiles(args.paths, "." + args.format)
+    if not filepaths:
+        print("Nothing to extract")
+        return []
+    extract_dir = args.out or os.path.join(os.path.dirname(filepaths[0]), "sealouse_extract")
+    
+    if args.format == "ctxr":
+        return bulkConvertCtxr(filepaths, extract_dir, args.workers, args.force)
+    return bulkDumpTri(filepaths, extract_dir, args.workers, args.force)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+from __future__ import annotations
+import hashlib, json, os
+
+MANIFEST_NAME = "sealouse_manifest.json"
+PACK_MANIFEST_NAME = "sealouse_packed.json"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def fileHash(filepath: str) -> str:
+    h = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+def sourceKey(filepath: str) -> str:
+    return os.path.normcase(os.path.abspath(filepath))
+
+
+class ExtractManifest:
+    """Source file -> outputs record for an extract folder.
+    A source is up to date while its size and mtime (or, failing that, its hash) match and its outputs still exist.
+    Sources that failed are recorded with their failures, and count as up to date until they change."""
+    extract_dir: str
+    path: str
+    sources: dict[str, dict]
+    
+    def __init__(self, extract_dir: str):
+        self.extract_dir = extract_dir
+        self.path = os.path.join(extract_dir, MANIFEST_NAME)
+        self.sources = {}
+        
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rt") as f:
+                    self.sources = json.load(f)["sources"]
+            except (ValueError, KeyError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+    
+    def isCurrent(self, source: str) -> bool:
+        entry = self.sources.get(sourceKey(source))
+        if entry is None or not os.path.exists(source):
+            return False
+        if not all(os.path.exists(os.path.join(self.extract_dir, x)) for x in entry["outputs"]):
+            return False
+        
+        stat = os.stat(source)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns != entry["mtime"]:
+            # Touched or copied, compare the contents
+            if fileHash(source) != entry["hash"]:
+                return False
+            entry["mtime"] = stat.st_mtime_ns
+        return True
+    
+    def failures(self, source: str) -> list[str]:
+        """Failures recorded for the source's last extraction, empty if it succeeded or was never recorded"""
+        entry = self.sources.get(sourceKey(source))
+        return entry.get("failures", []) if entry is not None else []
+    
+    def isStale(self, source: str) -> bool:
+        """Recorded before, but changed since. Outputs not in the manifest are left alone"""
+        return sourceKey(source) in self.sources and not self.isCurrent(source)
+    
+    def record(self, source: str, outputs: list[str], hash: str = None, failures: list[str] = None):
+        stat = os.stat(source)
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": hash or fileHash(source),
+            "outputs": sorted({os.path.relpath(x, self.extract_dir) for x in outputs})
+        }
+        if failures:
+            entry["failures"] = list(failures)
+        self.sources[sourceKey(source)] = entry
+    
+    def save(self):
+        os.makedirs(self.extract_dir, exist_ok=True)
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "wt") as f:
+            json.dump({"version": 1, "sources": self.sources}, f, indent=1)
+        os.replace(tmpPath, self.path)
+
+
+class PackManifest:
+    """DDS -> CTXR record for an export folder, so unchanged textures aren't repacked.
+    A CTXR is up to date while its DDS hash and pack options match and the CTXR itself is untouched."""
+    ctxr_dir: str
+    path: str
+    textures: dict[str, dict]
+    
+    def __init__(self, ctxr_dir: str):
+        self.ctxr_dir = ctxr_dir
+        self.path = os.path.join(ctxr_dir, PACK_MANIFEST_NAME)
+        self.textures = {}
+        
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rt") as f:
+                    self.textures = json.load(f)["textures"]
+            except (ValueError, KeyError) as e:
+                print(f"Ignoring unreadable pack record {self.path}: {e}")
+    
+    def ddsHash(self, ctxr_name: str, dds_path: str) -> str:
+        """Hash of the DDS, skipped if its size and mtime match the last pack"""
+        entry = self.textures.get(ctxr_name)
+        stat = os.stat(dds_path)
+        if entry is not None and entry["ddsSize"] == stat.st_size and entry["ddsMtime"] == stat.st_mtime_ns:
+            return entry["ddsHash"]
+        return fileHash(dds_path)
+    
+    def isCurrent(self, ctxr_name: str, ddsHash: str, options: list) -> bool:
+        entry = self.textures.get(ctxr_name)
+        ctxr_path = os.path.join(self.ctxr_dir, ctxr_name)
+        if entry is None or not os.path.exists(ctxr_path):
+            return False
+        if entry["ddsHash"] != ddsHash or entry["options"] != options:
+            return False
+        # Replaced by something else since, e.g. a game update or a manual copy
+        stat = os.stat(ctxr_path)
+        return stat.st_size == entry["ctxrSize"] and stat.st_mtime_ns == entry["ctxrMtime"]
+    
+    def record(self, ctxr_name: str, dds_path: str, ddsHash: str, options: list):
+        ddsStat = os.stat(dds_path)
+        ctxrStat = os.stat(os.path.join(self.ctxr_dir, ctxr_name))
+        self.textures[ctxr_name] = {
+            "ddsHash": ddsHash,
+            "ddsSize": ddsStat.st_size,
+            "ddsMtime": ddsStat.st_mtime_ns,
+            "options": options,
+            "ctxrSize": ctxrStat.st_size,
+            "ctxrMtime": ctxrStat.st_mtime_ns
+        }
+    
+    def save(self):
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "wt") as f:
+            json.dump({"version": 1, "textures": self.textures}, f, indent=1)
+        os.replace(tmpPath, self.path)
@@ -0,0 +1,91 @@
+"""Lookups over ctxrmapping.txt and trimapping.txt.
+
+Each table is parsed on first use, then kept for the rest of the session.
+The parsed tables are also pickled next to the text file and reused until the text file changes.
+"""
+from __future__ import annotations
+import os, pickle
+from functools import cache
+from ..ctxr.ctxr import ctxr_lookup_path
+from ..tri.tri import tri_lookup_path
+from .util import compute_hash
+
+CACHE_VERSION = 1
+
+
+def loadTable(txtPath: str, parse):
+    """parse(lines) for the text file, through its pickle cache"""
+    cachePath = txtPath + ".cache"
+    stat = os.stat(txtPath)
+    key = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+    
+    try:
+        with open(cachePath, "rb") as f:
+            cacheKey, table = pickle.load(f)
+        if cacheKey == key:
+            return table
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    
+    with open(txtPath, "rt") as f:
+        table = parse(f.readlines())
+    
+    try:
+        with open(cachePath, "wb") as f:
+            pickle.dump((key, table), f, pickle.HIGHEST_PROTOCOL)
+    except OSError as e: # read-only install, just parse again next session
+        print(f"Could not write mapping cache {cachePath}: {e}")
+    
+    return table
+
+def parseCtxrMapping(lines: list[str]) -> tuple[dict[int, str], dict[str, int]]:
+    # e.g. "a16ec7.tga 10579655.tga ene_fph_belt_center.bmp.png"
+    names = {}
+    hashes = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        texID = int(os.path.splitext(fields[1])[0])
+        names[texID] = fields[2]
+        hashes.setdefault(os.path.splitext(fields[2])[0], texID)
+    return names, hashes
+
+def parseTriMapping(lines: list[str]) -> dict[int, str]:
+    # e.g. "a2bd08 10665224 crg_blood_mh_mt.tri"
+    names = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        names.setdefault(int(fields[1]), fields[2])
+    return names
+
+@cache
+def ctxrTables() -> tuple[dict[int, str], dict[str, int]]:
+    return loadTable(ctxr_lookup_path, parseCtxrMapping)
+
+@cache
+def triTable() -> dict[int, str]:
+    return loadTable(tri_lookup_path, parseTriMapping)
+
+
+def ctxrNames() -> dict[int, str]:
+    """tga id -> png name, shared, don't modify"""
+    return ctxrTables()[0]
+
+def textureName(texID: int) -> str | None:
+    """png name of a tga id, e.g. 10579655 -> "ene_fph_belt_center.bmp.png" """
+    return ctxrTables()[0].get(texID)
+
+def textureHash(name: str) -> int:
+    """tga id of a texture name without its last extension, e.g. "ene_fph_belt_center.bmp".
+    Names not in the table are hashed like the game does."""
+    texID = ctxrTables()[1].get(name)
+    if texID is None:
+        texID = compute_hash(name.split('.')[0])
+    return texID
+
+def triName(strcode: int) -> str | None:
+    """TRI file name of a model's TRI strcode"""
+    return triTable().get(strcode)
@@ -1,8 +1,12 @@
 import bpy
-import os
+import os, threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from math import radians
-from ..ctxr.ctxr import DDS, CTXR, ctxr_lookup_path
-from .util import replaceExt, stripAllExt, create_bak
+from ..ctxr.ctxr import DDS, CTXR
+from .util import replaceExt, stripAllExt, create_bak, compute_hash
+from .mapping import ctxrNames, textureHash
+from .manifest import ExtractManifest, PackManifest
+from .texcache import extractDDS
 
 class MaterialHelper:
     material: bpy.types.Material
@@ -59,47 +63,91 @@ class TextureLoad:
     ctxr_name_lookup: dict
     material_cache: dict
     overwrite_existing: bool
+    manifest: ExtractManifest
+    manifest_lock: threading.Lock
+    manifest_changed: bool  # saved once, in close
+    executor: ThreadPoolExecutor | None
+    pending: dict[str, Future]  # DDS name -> background extraction
 
     def __init__(self, extract_dir: str, ctxr_dir: str = None, overwrite_existing: bool = False):
         self.extract_dir = extract_dir
         self.ctxr_dir = ctxr_dir
         self.material_cache = {}
-        self.ctxr_name_lookup = {}
         self.overwrite_existing = overwrite_existing
+        self.manifest = ExtractManifest(extract_dir)
+        self.manifest_lock = threading.Lock()
+        self.manifest_changed = False
+        self.executor = None
+        self.pending = {}
 
         # Load dictionary regardless, we'll use it to guess texture blending modes
-        with open(ctxr_lookup_path, "rt") as f:
-            for line in f.readlines():
-                tga_num = os.path.splitext(line.split()[1])[0]
-                self.ctxr_name_lookup[int(tga_num)] = line.split()[2]
+        self.ctxr_name_lookup = ctxrNames()
     
-    def get_texture(self, mapID: int) -> bpy.types.Image | None:
+    def get_map_name(self, mapID: int) -> str:
         mapName = self.get_texture_nice_name(mapID) if self.ctxr_dir else self.get_texture_tri_name(mapID)
-        if mapName == "":
-            return None
         if mapName.endswith(".png"):
             mapName = replaceExt(mapName, "dds")
-        
-        if bpy.data.images.get(mapName) is not None:
-            return bpy.data.images.get(mapName)
-        
+        return mapName
+    
+    def prefetch(self, mapIDs):
+        """Start extracting textures on background threads, so they convert while the meshes are built"""
+        if not self.ctxr_dir:
+            return
+        for mapID in set(mapIDs):
+            mapName = self.get_map_name(mapID)
+            if mapName == "" or mapName in self.pending or bpy.data.images.get(mapName) is not None:
+                continue
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(min(8, os.cpu_count() or 1))
+            self.pending[mapName] = self.executor.submit(self.extract_texture, mapName)
+    
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.pending = {}
+        with self.manifest_lock:
+            if self.manifest_changed:
+                self.manifest.save()
+                self.manifest_changed = False
+    
+    def extract_texture(self, mapName: str) -> str | None:
+        """Make sure the texture file exists in extract_dir. File work only, safe off the main thread"""
         mapPath = os.path.join(self.extract_dir, mapName)
+        ctxr_path = os.path.join(self.ctxr_dir, replaceExt(mapName, "ctxr")) if self.ctxr_dir else None
         
-        if not os.path.exists(mapPath) or self.overwrite_existing:
+        # Existing DDS files are kept unless the manifest knows their CTXR changed
+        with self.manifest_lock:
+            stale = ctxr_path is not None and self.manifest.isStale(ctxr_path)
+        if not os.path.exists(mapPath) or self.overwrite_existing or stale:
             if not self.ctxr_dir:
                 print("Path did not exist:", mapPath)
                 return None
             # Load ctxr
-            ctxr_path = os.path.join(self.ctxr_dir, replaceExt(mapName, "ctxr"))
             if not os.path.exists(ctxr_path):
                 return None
             print("Extracting", ctxr_path, "to DDS")
-            ctxr = CTXR()
-            with open(ctxr_path, "rb") as f:
-                ctxr.fromFile(f)
-            dds = ctxr.convertDDS()
-            with open(mapPath, "wb") as f:
-                dds.writeToFile(f)
+            hash, _ = extractDDS(ctxr_path, mapPath)
+            with self.manifest_lock:
+                self.manifest.record(ctxr_path, [mapPath], hash)
+                self.manifest_changed = True
+        
+        return mapPath
+    
+    def get_texture(self, mapID: int) -> bpy.types.Image | None:
+        mapName = self.get_map_name(mapID)
+        if mapName == "":
+            return None
+        
+        if bpy.data.images.get(mapName) is not None:
+            return bpy.data.images.get(mapName)
+        
+        if mapName in self.pending:
+            mapPath = self.pending.pop(mapName).result()
+        else:
+            mapPath = self.extract_texture(mapName)
+        if mapPath is None:
+            return None
         
         bpy.data.images.load(mapPath)
         return bpy.data.images.get(mapName)
@@ -321,33 +369,61 @@ class TextureSave:
                 self.textures_to_save.add(matchImage)
                 # DDS detection does not have priority over fallback ID
                 if not mapID:
-                    mapID = compute_hash(matchImageName.split('.')[0])
+                    mapID = textureHash(matchImageName)
         
         return mapID
     
-    def save_textures(self, extract_dir: str, bak_mode: str = 'never'):
+    def pack_texture(self, dds_path: str, ctxr_path: str, bak_mode: str, generate_mips: bool, gamma_correct_mips: bool):
+        """DDS to CTXR, file work only, safe off the main thread"""
+        ctxr_name = os.path.basename(ctxr_path)
+        print("Packing image", ctxr_name)
+        with open(dds_path, "rb") as f:
+            dds = DDS().fromFile(f)
+        # Single-level DDS files get a generated mip chain
+        ctxr = dds.convertCTXR(generate_mips, gamma_correct_mips)
+        if "ovl" in ctxr_name and "alp" in ctxr_name:
+            # Specular maps/transparent textures need different parameters
+            ctxr.header.unknown4 = [0, 0, 0, 2, 2, 2, 0, 2, 2, 2, 0x68, 0xff, 0xff, 0, 0, 0, 0, 0]
+        create_bak(ctxr_path, bak_mode)
+        with open(ctxr_path, "wb") as f:
+            ctxr.writeToFile(f)
+    
+    def save_textures(self, extract_dir: str, bak_mode: str = 'never', generate_mips: bool = True, gamma_correct_mips: bool = False):
+        # Images whose DDS hasn't changed since they were last packed with the same options are skipped
+        manifest = PackManifest(extract_dir)
+        options = [generate_mips, gamma_correct_mips]
+        jobs = {}
         for image in self.textures_to_save:
             ctxr_name = replaceExt(image.name, "ctxr")
-            print("Packing image", ctxr_name)
-            if not os.path.exists(image.filepath_from_user()):
+            dds_path = image.filepath_from_user()
+            if not os.path.exists(dds_path):
+                print("Packing image", ctxr_name)
                 print("Error: Could not locate image on disk, skipping.")
                 continue
-            with open(image.filepath_from_user(), "rb") as f:
-                dds = DDS().fromFile(f)
-            ctxr = dds.convertCTXR()
-            if "ovl" in ctxr_name and "alp" in ctxr_name:
-                # Specular maps/transparent textures need different parameters
-                ctxr.header.unknown4 = [0, 0, 0, 2, 2, 2, 0, 2, 2, 2, 0x68, 0xff, 0xff, 0, 0, 0, 0, 0]
-            ctxr_path = os.path.join(extract_dir, ctxr_name)
-            create_bak(ctxr_path, bak_mode)
-            with open(ctxr_path, "wb") as f:
-                ctxr.writeToFile(f)
-
-# Thanks TrikzMe
-def compute_hash(string):
-    h = 0
-    for c in string:
-        h = ((h << 0x05) | (h >> 0x13)) + ord(c)
-        h &= 0xffffff
-    return h
+            ddsHash = manifest.ddsHash(ctxr_name, dds_path)
+            if manifest.isCurrent(ctxr_name, ddsHash, options):
+                print("Unchanged, not repacking", ctxr_name)
+                continue
+            jobs[ctxr_name] = (dds_path, ddsHash)
+        
+        if not jobs:
+            return
+        error = None
+        with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1, 8)) as executor:
+            futures = {executor.submit(self.pack_texture, dds_path, os.path.join(extract_dir, ctxr_name), bak_mode,
+                                       generate_mips, gamma_correct_mips): ctxr_name
+                       for ctxr_name, (dds_path, _) in jobs.items()}
+            for future in as_completed(futures):
+                ctxr_name = futures[future]
+                if future.exception() is not None:
+                    print(f"Error packing {ctxr_name}: {future.exception()}")
+                    error = error or future.exception()
+                    continue
+                dds_path, ddsHash = jobs[ctxr_name]
+                manifest.record(ctxr_name, dds_path, ddsHash, options)
+        
+        # Keep what was packed even if one texture failed
+        manifest.save()
+        if error is not None:
+            raise error
 
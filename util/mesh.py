@@ -0,0 +1,53 @@
+"""Blender mesh building from flat arrays, shared by the KMS and EVM importers"""
+from __future__ import annotations
+import bpy
+import numpy as np
+
+
+def stripFaces(isFace: np.ndarray, flip: bool = False, first: int = 0) -> tuple[np.ndarray, bool]:
+    """Triangles of a strip with per-vertex isFace flags, as (numFaces, 3) local vertex indices.
+    Winding alternates within each run of faces, starting from flip for a run that begins at first.
+    Also returns the flip state after the last vertex."""
+    n = len(isFace)
+    if n <= first:
+        return np.empty((0, 3), np.int64), flip
+    
+    j = np.arange(first, n)
+    isFace = np.asarray(isFace[first:], bool)
+    # Last non-face vertex before each vertex, first - 1 if none
+    lastBreak = np.maximum.accumulate(np.where(isFace, first - 1, j))
+    flips = ((j - lastBreak) % 2 == 0) ^ (flip & (lastBreak == first - 1))
+    
+    j, flips = j[isFace], flips[isFace]
+    faces = np.column_stack((j - 2, np.where(flips, j - 1, j), np.where(flips, j, j - 1)))
+    endFlip = bool(isFace[-1] and not flips[-1])
+    return faces, endFlip
+
+def buildMesh(objmesh, vertices: np.ndarray, faces: np.ndarray):
+    """Like objmesh.from_pydata(vertices, [], faces, False), for (n, 3) arrays"""
+    numFaces = len(faces)
+    objmesh.vertices.add(len(vertices))
+    objmesh.vertices.foreach_set("co", np.ascontiguousarray(vertices, np.float32).reshape(-1))
+    objmesh.loops.add(numFaces * 3)
+    objmesh.polygons.add(numFaces)
+    objmesh.polygons.foreach_set("loop_start", np.arange(0, numFaces * 3, 3, dtype=np.int32))
+    if bpy.app.version < (4, 0): # read-only from 4.0, derived from loop_start
+        objmesh.polygons.foreach_set("loop_total", np.full(numFaces, 3, np.int32))
+    objmesh.polygons.foreach_set("vertices", np.ascontiguousarray(faces, np.int32).reshape(-1))
+    objmesh.update(calc_edges=True)
+
+def setLoopUvs(objmesh, name: str, uvs: np.ndarray):
+    """New UV layer from per-vertex (u, v) rows"""
+    loopVertices = np.empty(len(objmesh.loops), np.int32)
+    objmesh.loops.foreach_get("vertex_index", loopVertices)
+    uvLayer = objmesh.uv_layers.new(name=name)
+    uvLayer.data.foreach_set("uv", np.ascontiguousarray(uvs[loopVertices], np.float32).reshape(-1))
+
+def addWeights(group, vertexIndices: np.ndarray, weights: np.ndarray, mode: str = "REPLACE"):
+    """group.add per vertex, with one call per distinct weight"""
+    weights = np.asarray(weights)
+    order = np.argsort(weights, kind="stable")
+    values, starts = np.unique(weights[order], return_index=True)
+    batches = np.split(np.asarray(vertexIndices)[order], starts[1:])
+    for value, batch in zip(values.tolist(), batches):
+        group.add(batch.tolist(), value, mode)
@@ -0,0 +1,95 @@
+"""User-level DDS cache shared by every model and stage folder, keyed by CTXR content hash.
+
+Extract folders get hardlinks to the cached DDS (copies where links aren't possible).
+Entries are read-only, so an editor has to replace a linked DDS rather than write through it into every other folder.
+Set SEALOUSE_CACHE_DIR to move the cache.
+"""
+from __future__ import annotations
+import os, shutil, stat, sys
+from ..ctxr.ctxr import CTXR
+from .manifest import fileHash
+
+
+def cacheDir() -> str:
+    if os.environ.get("SEALOUSE_CACHE_DIR"):
+        return os.environ["SEALOUSE_CACHE_DIR"]
+    if sys.platform == "win32":
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        root = os.path.expanduser("~/Library/Caches")
+    else:
+        root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(root, "sealouse", "dds")
+
+# Every entry's mtime is set to this before it is moved into place, so any write through a hardlink shows up
+# as a different mtime. Whole seconds, so filesystems with coarse timestamps keep it exactly.
+ENTRY_MTIME_NS = 1_000_000_000 * 1_000_000_000
+ENTRY_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+def cachePath(hash: str) -> str:
+    return os.path.join(cacheDir(), hash[:2], hash + ".dds")
+
+def isIntact(entry: str) -> bool:
+    """False if the entry was written through one of its hardlinks since it was cached"""
+    try:
+        return os.stat(entry).st_mtime_ns == ENTRY_MTIME_NS
+    except OSError:
+        return False
+
+def addEntry(ctxr_path: str, entry: str) -> int:
+    """Convert into the cache, atomically so parallel workers can race on the same texture"""
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmpPath = f"{entry}.{os.getpid()}.tmp"
+    try:
+        with open(ctxr_path, "rb") as inFile, open(tmpPath, "wb") as outFile:
+            size = CTXR.streamDDS(inFile, outFile)
+        # Stamped and made read-only before the replace, so the entry is never visible without either
+        os.utime(tmpPath, ns=(ENTRY_MTIME_NS, ENTRY_MTIME_NS))
+        os.chmod(tmpPath, ENTRY_MODE)
+        try:
+            os.replace(tmpPath, entry)
+        except PermissionError: # Windows won't replace a read-only file
+            os.chmod(entry, stat.S_IRUSR | stat.S_IWUSR)
+            os.replace(tmpPath, entry)
+    finally:
+        if os.path.exists(tmpPath):
+            removeFile(tmpPath)
+    return size
+
+def removeFile(path: str):
+    try:
+        os.remove(path)
+    except PermissionError: # Windows won't delete a read-only file
+        os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+        os.remove(path)
+
+def linkOutput(entry: str, outpath: str):
+    # Never write through an old link, that would change the cached copy
+    if os.path.lexists(outpath):
+        removeFile(outpath)
+        # Clearing read-only on a link clears it on the entry too
+        os.chmod(entry, ENTRY_MODE)
+    try:
+        os.link(entry, outpath)
+    except OSError: # other drive, FAT32, ...
+        shutil.copyfile(entry, outpath)
+
+def extractDDS(ctxr_path: str, outpath: str) -> tuple[str, int]:
+    """Put the DDS for a CTXR at outpath, converting only on a cache miss.
+    Returns the CTXR hash and the bytes converted (0 on a hit)."""
+    hash = fileHash(ctxr_path)
+    entry = cachePath(hash)
+    size = 0
+
+    try:
+        if not (os.path.exists(entry) and isIntact(entry)):
+            size = addEntry(ctxr_path, entry)
+        linkOutput(entry, outpath)
+    except OSError as e: # cache unusable, convert in place
+        print(f"Texture cache unavailable ({e}), converting directly")
+        if os.path.lexists(outpath):
+            removeFile(outpath)
+        with open(ctxr_path, "rb") as inFile, open(outpath, "wb") as outFile:
+            size = CTXR.streamDDS(inFile, outFile)
+
+    return hash, size
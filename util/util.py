@@ -1,5 +1,6 @@
 import os, shutil, struct
-from ..tri.tri import tri_lookup_path
+from collections.abc import Sequence
+import numpy as np
 
 kmsBoneNameArray = [
     # Tuples indicate a bone that we would prefer to map differently with MGR models (I like MGR)
@@ -122,6 +123,14 @@ def getVertWeight(vert, obj = None, group_name: str = None) -> float:
             return group.weight
     return 0.0 # vertex is only weighted to parent
 
+# Thanks TrikzMe
+def compute_hash(string):
+    h = 0
+    for c in string:
+        h = ((h << 0x05) | (h >> 0x13)) + ord(c)
+        h &= 0xffffff
+    return h
+
 def replaceExt(path: str, new_ext: str) -> str:
     return f"{os.path.splitext(path)[0]}.{new_ext}"
 
@@ -167,10 +176,48 @@ def triNameFromModel(modelPath: str, modelType: str = None) -> str | None:
         fp.seek(0x10 if modelType == 'kms' else 0x20)
         triCode: int = struct.unpack("<I", fp.read(4))[0]
 
-    with open(tri_lookup_path, "rt") as fp:
-        for line in fp.readlines():
-            if int(line.split()[1]) == triCode:
-                return line.split()[2]
-
-    return None
-
+    from .mapping import triName # mapping imports this module
+    return triName(triCode)
+
+
+
+def readArray(file, dtype, shape) -> np.ndarray:
+    """Bulk-read a packed array from the current file position."""
+    array = np.empty(shape, dtype)
+    buffer = array.reshape(-1).view(np.uint8)
+    if hasattr(file, "readinto"):
+        readSize = file.readinto(buffer)
+    else: # mmap
+        data = file.read(array.nbytes)
+        readSize = len(data)
+        buffer[:readSize] = np.frombuffer(data, np.uint8)
+    if readSize != array.nbytes:
+        raise EOFError(f"Unexpected end of file reading {array.nbytes} bytes")
+    return array
+
+def packArray(buffer: bytearray, offset: int, array: np.ndarray, dtype):
+    """Copy an array into buffer at offset, converted to the given packed dtype."""
+    packed = np.ascontiguousarray(array, dtype)
+    memoryview(buffer)[offset:offset + packed.nbytes] = packed.reshape(-1).view(np.uint8)
+
+def alignOffset(offset: int, alignment: int = 0x10) -> int:
+    return (offset + alignment - 1) & ~(alignment - 1)
+
+class PackedList(Sequence):
+    """Read-only list stand-in over the rows of a packed array.
+    Objects are built by factory(row) on access, so per-element code keeps working on columnar data."""
+    def __init__(self, data: np.ndarray, factory):
+        self.data = data
+        self.factory = factory
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.factory(row) for row in self.data[index].tolist()]
+        return self.factory(self.data[index].tolist())
+    
+    def __iter__(self):
+        for row in self.data.tolist():
+            yield self.factory(row)